@@ -1,6 +1,37 @@
 #
-from .gsea import replot, prerank, gsea, ssgsea
-from .enrichr import enrichr
-from .parser import get_library_name
-from .plot import dotplot, barplot, heatmap, gseaplot
+import sys, types
+from importlib import import_module
 from .__main__ import __version__
+
+# public functions -> submodule, submodules are imported on first use,
+# so `import gseapy` doesn't pull in matplotlib, bioservices and friends.
+_LAZY = {'replot': 'gsea', 'prerank': 'gsea', 'gsea': 'gsea', 'ssgsea': 'gsea',
+         'enrichr': 'enrichr', 'enrichr_batch': 'enrichr',
+         'get_library_name': 'parser',
+         'dotplot': 'plot', 'barplot': 'plot', 'heatmap': 'plot', 'gseaplot': 'plot'}
+
+__all__ = list(_LAZY) + ['__version__']
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(import_module("." + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing the gsea and enrichr submodules sets them as attributes of the package,
+        # keep the functions of the same names instead
+        if name in _LAZY and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super(_Package, self).__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
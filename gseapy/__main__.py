@@ -25,7 +25,8 @@ def main():
         # reproduce plots using GSEAPY
         from .gsea import Replot
         Replot(indir=args.indir, outdir=args.outdir, weighted_score_type=args.weight,
-                     figsize=args.figsize, format=args.format, verbose=args.verbose).run()
+                     figsize=args.figsize, format=args.format, verbose=args.verbose,
+                     report=args.report, processes=args.threads).run()
 
 
     elif subcommand == "gsea":
@@ -35,14 +36,18 @@ def main():
         gs = GSEA(args.data, args.gmt, args.cls, args.outdir,
                   args.mins, args.maxs, args.n, args.weight,
                   args.type, args.method, args.ascending, args.threads,
-                  args.figsize, args.format, args.graph, args.noplot, args.seed, args.verbose)
+                  args.figsize, args.format, args.graph, args.noplot, args.seed, args.verbose,
+                  report=args.report, chip=args.chip, collapse=args.collapse,
+                  contrast=args.contrast, null_mode=args.null_mode)
         gs.run()
     elif subcommand == "prerank":
         from .gsea import Prerank
-
+        from .parser import IDMapper
+        id_map = IDMapper(target=args.id_map, collapse=args.collapse) if args.id_map else None
         pre = Prerank(args.rnk, args.gmt, args.outdir, args.label[0], args.label[1],
                       args.mins, args.maxs, args.n, args.weight, args.ascending, args.threads,
-                      args.figsize, args.format, args.graph, args.noplot, args.seed, args.verbose)
+                      args.figsize, args.format, args.graph, args.noplot, args.seed, args.verbose,
+                      report=args.report, id_map=id_map, null_mode=args.null_mode)
         pre.run()
 
     elif subcommand == "ssgsea":
@@ -53,7 +58,9 @@ def main():
                               weighted_score_type=args.weight, scale=args.scale,
                               ascending=args.ascending, processes=args.threads,
                               figsize=args.figsize, format=args.format, graph_num=args.graph,
-                              no_plot=args.noplot, seed=args.seed, verbose=args.verbose)
+                              no_plot=args.noplot, seed=args.seed, verbose=args.verbose,
+                              report=args.report, chip=args.chip, collapse=args.collapse,
+                              null_mode=args.null_mode)
         ss.run()
 
     elif subcommand == "enrichr":
@@ -63,7 +70,15 @@ def main():
                       gene_sets=args.library, organism=args.organism,
                       outdir=args.outdir, format=args.format, cutoff=args.thresh, 
                       background=args.bg, figsize=args.figsize,
-                      top_term=args.term, no_plot=args.noplot, verbose=args.verbose)
+                      top_term=args.term, no_plot=args.noplot, verbose=args.verbose,
+                      processes=args.threads, offline=args.offline, id_map=args.id_map)
+        enr.run()
+    elif subcommand == "enrichr-batch":
+        from .enrichr import EnrichrBatch
+        enr = EnrichrBatch(gene_lists=args.gene_lists, gene_sets=args.library,
+                           organism=args.organism, descriptions=args.descrip,
+                           outdir=args.outdir, cutoff=args.thresh,
+                           background=args.bg, verbose=args.verbose, id_map=args.id_map)
         enr.run()
     elif subcommand == "biomart":
         from .parser import Biomart
@@ -76,7 +91,12 @@ def main():
         # run query
         bm = Biomart(host=args.host, verbose=args.verbose)
         bm.query(dataset=args.bg, attributes=args.attrs.split(","), 
-                 filters={name : value}, filename=args.ofile)
+                 filters={name : value}, filename=args.ofile, processes=args.threads)
+    elif subcommand == "serve":
+        from .server import serve
+        serve(host=args.host, port=args.port, socket=args.socket, processes=args.threads,
+              idle_timeout=args.idle_timeout, data_dir=args.data_dir, max_body=args.max_body * 2**20,
+              verbose=args.verbose)
     else:
         argparser.print_help()
         sys.exit(0)
@@ -102,8 +122,12 @@ def prepare_argparser():
     add_plot_parser(subparsers)
     # command for 'enrichr'
     add_enrichr_parser(subparsers)
+    # command for 'enrichr-batch'
+    add_enrichr_batch_parser(subparsers)
     # command for 'biomart'
     add_biomart_parser(subparsers)
+    # command for 'serve'
+    add_serve_parser(subparsers)
 
     return argparser
 
@@ -129,6 +153,45 @@ def add_output_option(parser):
                         help="Increase output verbosity, print out progress of your job", )
 
 
+def add_report_option(parser):
+    """report option"""
+
+    parser.add_argument("--report", dest="report", type=str, metavar='', action="store",
+                        choices=("pdf", "html"), default=None,
+                        help="Write all figures into one report file instead of one file per term,\
+                              choose from {'pdf', 'html'}. 'pdf' writes a multi-page pdf,\
+                              'html' writes a self-contained html report. Default: None.")
+
+
+def add_null_mode_option(group):
+    """null mode option"""
+    group.add_argument("--null-mode", action="store", dest="null_mode", type=str, metavar='',
+                       choices=("memory", "stream", "exact"), default=None,
+                       help="How permutation nulls are kept, choose from {'memory', 'stream', 'exact'}. \
+                       'exact' spills them to disk, 'stream' bins them for an approximate FDR, with \
+                       scores in [-1, 1] only. Default: 'exact' for very large jobs, else 'memory'.")
+
+
+def add_id_map_option(group):
+    """id mapping option"""
+    group.add_argument("--id-map", action="store", dest="id_map", type=str, default=None,
+                       choices=("symbol", "entrez", "ensembl"),
+                       help="Convert input gene ids to this id type with the local BioMart table \
+                       of hsapiens_gene_ensembl before the analysis. Default: None")
+
+
+def add_chip_option(parser):
+    """chip option"""
+
+    parser.add_argument("--chip", dest="chip", type=str, metavar='CHIP', action="store", default=None,
+                        help="Probe to gene mapping in .chip format, or a tab-delimited file whose first \
+                              two columns are probe id and gene. Collapse probes to genes before the analysis.")
+    parser.add_argument("--collapse", dest="collapse", type=str, metavar='', action="store", default='max',
+                        choices=("max", "mean", "median", "sum", "maxabs"),
+                        help="How to collapse probes of the same gene, choose from \
+                              {'max', 'mean', 'median', 'sum', 'maxabs'}. Default: max.")
+
+
 def add_output_group(parser, required=True):
     """output group"""
 
@@ -155,10 +218,16 @@ def add_gsea_parser(subparsers):
     group_input.add_argument("-t", "--permu-type", action="store", dest="type", type=str, metavar='perType',
                              choices=("gene_set", "phenotype"), default="gene_set",
                              help="Permutation type. Same with GSEA, choose from {'gene_set', 'phenotype'}")
+    add_chip_option(group_input)
+    group_input.add_argument("--contrast", action="store", dest="contrast", type=str, metavar='',
+                             choices=("one-vs-rest", "all-pairs"), default=None,
+                             help="Compare more than two phenotypes of the cls file in one run, \
+                             choose from {'one-vs-rest', 'all-pairs'}. Default: the first two phenotypes.")
 
     # group for output files
     group_output = argparser_gsea.add_argument_group("Output arguments")
     add_output_option(group_output)
+    add_report_option(group_output)
 
     # group for General options.
     group_opt = argparser_gsea.add_argument_group("GSEA advanced arguments")
@@ -171,17 +240,19 @@ def add_gsea_parser(subparsers):
     group_opt.add_argument("-w", "--weight", action='store', dest='weight', default=1.0, type=float, metavar='float',
                            help='Weighted_score of rank_metrics. For weighting input genes. Choose from {0, 1, 1.5, 2}. Default: 1',)
     group_opt.add_argument("-m", "--method", action="store", dest="method", type=str, metavar='',
-                           choices=("signal_to_noise", "t_test", "ratio_of_classes", "diff_of_classes", "log2_ratio_of_classes"),
+                           choices=("signal_to_noise", "t_test", "ratio_of_classes", "diff_of_classes", "log2_ratio_of_classes",
+                                    "pearson", "cosine"),
                            default="log2_ratio_of_classes",
                            help="Methods to calculate correlations of ranking metrics. \
                            Choose from {'signal_to_noise', 't_test', 'ratio_of_classes', 'diff_of_classes','log2_ratio_of_classes'}.\
-                           Default: 'log2_ratio_of_classes'")
+                           For continuous phenotypes choose from {'pearson', 'cosine'}. Default: 'log2_ratio_of_classes'")
     group_opt.add_argument("-a", "--ascending", action='store_true', dest='ascending', default=False,
                            help='Rank metric sorting order. If the -a flag was chosen, then ascending equals to True. Default: False.')
     group_opt.add_argument("-s", "--seed", dest = "seed", action="store", type=int, default=None, metavar='',
                            help="Number of random seed. Default: None")
     group_opt.add_argument("-p", "--threads", dest = "threads", action="store", type=int, default=1, metavar='procs',
                            help="Number of Processes you are going to use. Default: 1")
+    add_null_mode_option(group_opt)
 
     return
 
@@ -194,7 +265,8 @@ def add_prerank_parser(subparsers):
     # group for input files
     prerank_input = argparser_prerank.add_argument_group("Input files arguments")
     prerank_input.add_argument("-r", "--rnk", dest="rnk", action="store", type=str, required=True,
-                             help="Ranking metric file in .rnk format. Same with GSEA.")
+                             help="Ranking metric file in .rnk format. Same with GSEA. \
+                             A tab-delimited table with a header and one column per ranking runs all rankings at once.")
     prerank_input.add_argument("-g", "--gmt", dest="gmt", action="store", type=str, required=True,
                              help="Gene set database in GMT format. Same with GSEA.")
     prerank_input.add_argument("-l", "--label", action='store', nargs=2, dest='label',
@@ -204,6 +276,7 @@ def add_prerank_parser(subparsers):
     # group for output files
     prerank_output = argparser_prerank.add_argument_group("Output arguments")
     add_output_option(prerank_output)
+    add_report_option(prerank_output)
 
     # group for General options.
     prerank_opt = argparser_prerank.add_argument_group("GSEA advanced arguments")
@@ -221,6 +294,11 @@ def add_prerank_parser(subparsers):
                              help="Number of random seed. Default: None")
     prerank_opt.add_argument("-p", "--threads", dest = "threads", action="store", type=int, default=1, metavar='procs',
                            help="Number of Processes you are going to use. Default: 1")
+    add_id_map_option(prerank_opt)
+    add_null_mode_option(prerank_opt)
+    prerank_opt.add_argument("--collapse", action="store", dest="collapse", type=str, default='max',
+                             choices=("max", "min", "mean", "median", "maxabs", "first"),
+                             help="How to collapse ranking values of ids converted to the same gene. Default: max")
 
     return
 
@@ -236,9 +314,11 @@ def add_singlesample_parser(subparsers):
                              help="Input gene expression dataset file in txt format. Same with GSEA.")
     group_input.add_argument("-g", "--gmt", dest="gmt", action="store", type=str, required=True,
                              help="Gene set database in GMT format. Same with GSEA.")
+    add_chip_option(group_input)
     # group for output files
     group_output = argparser_gsea.add_argument_group("Output arguments")
     add_output_option(group_output)
+    add_report_option(group_output)
 
     # group for General options.
     group_opt = argparser_gsea.add_argument_group("Single Sample GSEA advanced arguments")
@@ -262,6 +342,7 @@ def add_singlesample_parser(subparsers):
                            help="Number of random seed. Default: None")
     group_opt.add_argument("-p", "--threads", dest = "threads", action="store", type=int, default=1, metavar='procs',
                            help="Number of Processes you are going to use. Default: 1")
+    add_null_mode_option(group_opt)
 
     return
 
@@ -276,9 +357,12 @@ def add_plot_parser(subparsers):
     group_replot.add_argument("-i", "--indir", action="store", dest="indir", required=True, metavar='GSEA_dir',
                               help="The GSEA desktop results directroy that you want to reproduce the figure ")
     add_output_option(group_replot)
+    add_report_option(group_replot)
     #add_output_group( argparser_plot )
     group_replot.add_argument("-w", "--weight", action='store', dest='weight', default=1.0, type=float, metavar='float',
                               help='Weighted_score of rank_metrics. Please Use the same value in GSEA. Choose from (0, 1, 1.5, 2),default: 1',)
+    group_replot.add_argument("-p", "--threads", dest = "threads", action="store", type=int, default=1, metavar='procs',
+                              help="Number of Processes you are going to use for plotting. Default: 1")
 
     return
 
@@ -305,6 +389,12 @@ def add_enrichr_parser(subparsers):
                               help="BioMart Dataset name or Background total genes number. Default: None")
     enrichr_opt.add_argument("-t", "--top-term", dest="term", action="store", type=int, default=10, metavar='int',
                               help="Numbers of top terms shown in the plot. Default: 10")
+    enrichr_opt.add_argument("-p", "--threads", dest="threads", action="store", type=int, default=1, metavar='procs',
+                              help="Number of libraries fetched concurrently from the Enrichr server. Default: 1")
+    enrichr_opt.add_argument("--offline", action='store_true', dest='offline', default=False,
+                              help="Test Enrichr libraries locally with the background, instead of on the Enrichr server. \
+                              Libraries are downloaded only once. Default: False.")
+    add_id_map_option(enrichr_opt)
     # enrichr_opt.add_argument("--scale", dest = "scale", action="store", type=float, default=0.5, metavar='float',
     #                          help="scatter dot scale in the dotplot. Default: 0.5")
     # enrichr_opt.add_argument("--no-plot", action='store_true', dest='no_plot', default=False,
@@ -315,6 +405,38 @@ def add_enrichr_parser(subparsers):
     return
 
 
+def add_enrichr_batch_parser(subparsers):
+    """Add function 'enrichr-batch' argument parsers."""
+
+    argparser_batch = subparsers.add_parser("enrichr-batch",
+                                            help="Enrichr local mode for many gene lists in one run.")
+
+    # group for required options.
+    batch_opt = argparser_batch.add_argument_group("Input arguments")
+    batch_opt.add_argument("-i", "--input-lists", action="store", dest="gene_lists", type=str, required=True, metavar='LISTS',
+                           help="Named gene lists. A gmt file with one gene list per row, or a tab-delimited file \
+                           with a header, whose first column is the gene list name and second column is the gene.")
+    batch_opt.add_argument("-g", "--gene-sets", action="store", dest="library", type=str, required=True, metavar='GMT',
+                           help="Enrichr library name(s) or gmt file(s). Separate each name by comma.")
+    batch_opt.add_argument("--org", "--organism", action="store", dest="organism", type=str, default='human',
+                           help="Enrichr supported organism name. Default: human.")
+    batch_opt.add_argument("--ds", "--description", action="store", dest="descrip", type=str, default='enrichr', metavar='STRING',
+                           help="A short description, used as the output file prefix. Default: enrichr.")
+    batch_opt.add_argument("--cut", "--cut-off", action="store", dest="thresh", metavar='float', type=float, default=0.05,
+                           help="Alpha of the Benjamini-Hochberg correction. Default: 0.05.")
+    batch_opt.add_argument("--bg", "--background", action="store", dest="bg", default='hsapiens_gene_ensembl', metavar='BGNUM',
+                           help="BioMart Dataset name or Background total genes number. Default: hsapiens_gene_ensembl")
+    add_id_map_option(batch_opt)
+
+    batch_output = argparser_batch.add_argument_group("Output arguments")
+    batch_output.add_argument("-o", "--outdir", dest="outdir", type=str, default='GSEApy_reports',
+                              metavar='', action="store",
+                              help="The GSEApy output directory. Default: the current working directory")
+    batch_output.add_argument("-v", "--verbose", action="store_true", default=False, dest='verbose',
+                              help="Increase output verbosity, print out progress of your job", )
+    return
+
+
 def add_biomart_parser(subparsers):
     """Add function 'biomart' argument parsers."""
 
@@ -336,10 +458,38 @@ def add_biomart_parser(subparsers):
                              help="Which host to use. Select from {'www.ensembl.org', 'asia.ensembl.org', 'useast.ensembl.org'}.")
     biomart_opt.add_argument("-m", "--mart", action="store", dest="mart", type=str, metavar='MART',
                              default="ENSEMBL_MART_ENSEMBL", help="Which mart to use. Default: ENSEMBL_MART_ENSEMBL.")
+    biomart_opt.add_argument("-p", "--threads", dest="threads", action="store", type=int, default=1, metavar='procs',
+                             help="Number of concurrent queries, long filter value lists are split into chunks. Default: 1")
     biomart_opt.add_argument("-v", "--verbose", action="store_true", default=False, dest='verbose',
                              help="Increase output verbosity, print out progress of your job", )
 
 
+def add_serve_parser(subparsers):
+    """Add function 'serve' argument parsers."""
+
+    argparser_serve = subparsers.add_parser("serve", help="Run a server for prerank, ssgsea and enrichr jobs.")
+
+    serve_opt = argparser_serve.add_argument_group("Server arguments")
+    serve_opt.add_argument("--host", action="store", dest="host", type=str, default='127.0.0.1', metavar='HOST',
+                           help="Host to listen on. Anyone who can reach it can run jobs as this user, \
+                                 use a loopback address unless the network is trusted. Default: 127.0.0.1")
+    serve_opt.add_argument("--port", action="store", dest="port", type=int, default=8000, metavar='PORT',
+                           help="Port to listen on. Default: 8000")
+    serve_opt.add_argument("--socket", action="store", dest="socket", type=str, default=None, metavar='PATH',
+                           help="Listen on a unix socket file instead of host and port.")
+    serve_opt.add_argument("-p", "--threads", dest="threads", action="store", type=int, default=1, metavar='procs',
+                           help="Default number of processes of each job, worker processes are kept between jobs. Default: 1")
+    serve_opt.add_argument("--idle-timeout", dest="idle_timeout", action="store", type=int, default=3600, metavar='SECONDS',
+                           help="Shut down worker processes idle for this many seconds. Default: 3600")
+    serve_opt.add_argument("--data-dir", dest="data_dir", action="store", type=str, default=None, metavar='DIR',
+                           help="Directory jobs may read files from, paths are relative to it. \
+                                 Default: None, jobs can't read files.")
+    serve_opt.add_argument("--max-body", dest="max_body", action="store", type=int, default=100, metavar='MB',
+                           help="Max size of a job in MB, larger jobs are rejected. Default: 100")
+    serve_opt.add_argument("-v", "--verbose", action="store_true", default=False, dest='verbose',
+                           help="Log every request.")
+
+
 if __name__ == '__main__':
     try:
         main()
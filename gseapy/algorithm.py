@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 
-import sys, logging
+import os, sys, logging
 import numpy as np
+import pandas as pd
 #from functools import reduce
 #from multiprocessing import Pool
 from math import ceil
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
 from gseapy.stats import multiple_testing_correction
+from gseapy.utils import unique
 from joblib import delayed, Parallel
 
+# spill esnulls to disk when gene_sets * permutations exceeds this number of esnulls
+NULL_STREAM_SIZE = 2.5e7
+# ranking metrics of continuous phenotypes
+CONTINUOUS_METHODS = ('pearson', 'cosine')
+
 
 def enrichment_score(gene_list, correl_vector, gene_set, weighted_score_type=1, 
-                     nperm=1000, rs=None, single=False, scale=False):
+                     nperm=1000, rs=None, single=False, scale=False, lazy=False):
     """This is the most important function of GSEApy. It has the same algorithm with GSEA and ssGSEA.
 
     :param gene_list:       The ordered gene list gene_name_list, rank_metric.index.values
@@ -29,6 +38,7 @@ def enrichment_score(gene_list, correl_vector, gene_set, weighted_score_type=1,
     :param nperm:           Only use this parameter when computing esnull for statistical testing. Set the esnull value
                             equal to the permutation number.
     :param rs:              Random state for initializing gene list shuffling. Default: seed=None
+    :param lazy:            If True, don't return RES. Use :func:`running_enrichment_score` to recompute it.
 
     :return:
 
@@ -59,11 +69,19 @@ def enrichment_score(gene_list, correl_vector, gene_set, weighted_score_type=1,
     # set axis to 1, because we have 2D array
     axis = 1
     tag_indicator = np.tile(tag_indicator, (nperm+1,1))
-    correl_vector = np.tile(correl_vector,(nperm+1,1))
     # gene list permutation
     rs = np.random.RandomState(rs)
     for i in range(nperm): rs.shuffle(tag_indicator[i])
     # np.apply_along_axis(rs.shuffle, 1, tag_indicator)
+    if lazy:
+        # RES is not kept, score the hit positions of each permutation only
+        hit_pos = np.nonzero(tag_indicator)[1].reshape(nperm+1, -1)
+        score = enrichment_score_sum if single else enrichment_score_hits
+        es_vec = score(correl_vector[hit_pos], hit_pos, N)
+        if scale: es_vec = es_vec / N
+        return es_vec[-1], es_vec[:-1], hit_ind, None
+
+    correl_vector = np.tile(correl_vector,(nperm+1,1))
 
     Nhint = tag_indicator.sum(axis=axis, keepdims=True)
     sum_correl_tag = np.sum(correl_vector*tag_indicator, axis=axis, keepdims=True)
@@ -89,7 +107,7 @@ def enrichment_score(gene_list, correl_vector, gene_set, weighted_score_type=1,
 
 
 def enrichment_score_tensor(gene_mat, cor_mat, gene_sets, weighted_score_type, nperm=1000,
-                            rs=None, single=False, scale=False):
+                            rs=None, single=False, scale=False, lazy=False):
     """Next generation algorithm of GSEA and ssGSEA.
 
         :param gene_mat:        the ordered gene list(vector) with or without gene indices matrix.
@@ -103,6 +121,7 @@ def enrichment_score_tensor(gene_mat, cor_mat, gene_sets, weighted_score_type, n
         :param bool single:     If True, use ssGSEA algorithm, otherwise use GSEA.
         :param rs:              Random state for initialize gene list shuffling.
                                 Default: seed=None
+        :param bool lazy:       If True, RES is None. Use :func:`running_enrichment_score` to recompute it.
         :return: a tuple contains::
 
                  | ES: Enrichment score (real number between -1 and +1), for ssGSEA, set scale eq to True.
@@ -141,10 +160,8 @@ def enrichment_score_tensor(gene_mat, cor_mat, gene_sets, weighted_score_type, n
         perm_tag_tensor = np.repeat(tag_indicator, nperm+1).reshape((M,N,nperm+1))
         # shuffle matrix, last matrix is not shuffled when nperm > 0
         if nperm: np.apply_along_axis(lambda x: np.apply_along_axis(rs.shuffle,0,x),1, perm_tag_tensor[:,:,:-1])
-        # missing hits
-        no_tag_tensor = 1 - perm_tag_tensor
-        # calculate numerator, denominator of each gene hits
-        rank_alpha = (perm_tag_tensor*cor_mat[np.newaxis,:,np.newaxis])** weighted_score_type
+        # same rankings for all permutations
+        cor = cor_mat[:,np.newaxis]
 
     elif cor_mat.ndim == 2:
         # GSEA
@@ -161,14 +178,30 @@ def enrichment_score_tensor(gene_mat, cor_mat, gene_sets, weighted_score_type, n
         perm_tag_tensor = np.stack([tag.take(genes_ind).T for tag in tag_indicator], axis=0)
         #index of hits
         hit_ind = [ np.flatnonzero(tag).tolist() for tag in perm_tag_tensor[:,:,-1] ]
-        # nohits
-        no_tag_tensor = 1 - perm_tag_tensor
-        # calculate numerator, denominator of each gene hits
-        rank_alpha = (perm_tag_tensor*cor_mat[np.newaxis,:,:])** weighted_score_type
+        cor = cor_mat
     else:
         logging.error("Program die because of unsupported input")
         sys.exit(0)
 
+    # misses are weighted too when weighted_score_type is 0 (0**0), that needs the full RES
+    if lazy and weighted_score_type > 0:
+        # RES is not kept, score the hit positions of each gene set and permutation only
+        N, P = perm_tag_tensor.shape[1:]
+        score = enrichment_score_sum if single else enrichment_score_hits
+        cor_perm = np.broadcast_to(cor.T, (P, N))
+        esmatrix = np.zeros((len(keys), P))
+        for m, tag in enumerate(perm_tag_tensor):
+            hit_pos = np.nonzero(tag.T)[1].reshape(P, -1)
+            hit_w = np.take_along_axis(cor_perm, hit_pos, axis=1)** weighted_score_type
+            esmatrix[m] = score(hit_w, hit_pos, N)
+        if scale: esmatrix = esmatrix / len(gene_mat)
+        return esmatrix[:,-1], esmatrix[:,:-1], hit_ind, None
+
+    # missing hits
+    no_tag_tensor = 1 - perm_tag_tensor
+    # calculate numerator, denominator of each gene hits
+    rank_alpha = (perm_tag_tensor*cor[np.newaxis])** weighted_score_type
+
     # Nhint = tag_indicator.sum(1)
     # Nmiss =  N - Nhint
     axis=1
@@ -186,11 +219,71 @@ def enrichment_score_tensor(gene_mat, cor_mat, gene_sets, weighted_score_type, n
         esmax, esmin = REStensor.max(axis=axis), REStensor.min(axis=axis)
         esmatrix = np.where(np.abs(esmax)>np.abs(esmin), esmax, esmin)
 
-    es, esnull, RES = esmatrix[:,-1], esmatrix[:,:-1], REStensor[:,:,-1]
+    es, esnull = esmatrix[:,-1], esmatrix[:,:-1]
+    RES = None if lazy else REStensor[:,:,-1]
 
     return es, esnull, hit_ind, RES
 
 
+def running_enrichment_score(correl_vector, hit_ind, weighted_score_type=1, scale=False):
+    """Recompute the running enrichment score of one gene set from its hit indices.
+
+    :param correl_vector: sorted rankings, rank_metric.values.
+    :param hit_ind: indices of genes in the sorted gene list which are included in the gene set.
+    :param weighted_score_type: same with :func:`enrichment_score`.
+    :param bool scale: if true, scale RES by gene number (ssGSEA).
+    :return: RES, identical to the one returned by :func:`enrichment_score`.
+    """
+    N = len(correl_vector)
+    tag_indicator = np.zeros(N)
+    tag_indicator[np.asarray(hit_ind, dtype=int)] = 1
+    if weighted_score_type == 0:
+        correl_vector = np.ones(N)
+    else:
+        correl_vector = np.abs(correl_vector)**weighted_score_type
+    norm_tag = 1.0/np.sum(correl_vector*tag_indicator)
+    norm_no_tag = 1.0/(N - tag_indicator.sum())
+    RES = np.cumsum(tag_indicator * correl_vector * norm_tag - (1 - tag_indicator) * norm_no_tag)
+    if scale: RES = RES / N
+
+    return RES
+
+
+def enrichment_score_peak(correl_vector, hit_ind, weighted_score_type=1):
+    """Locate the max and min of the running enrichment score of gene sets without building RES.
+
+       RES reaches its max right on a hit, and its min right before a hit, so only the
+       values around the hits are computed.
+
+    :param correl_vector: sorted rankings, rank_metric.values.
+    :param hit_ind: nested list of sorted hit indices, one for each gene set.
+    :param weighted_score_type: same with :func:`enrichment_score`.
+    :return: positions of RES.argmax() and RES.argmin() for each gene set.
+    """
+    N = len(correl_vector)
+    if weighted_score_type == 0:
+        weights = np.ones(N)
+    else:
+        weights = np.abs(correl_vector)**weighted_score_type
+    sizes = np.array([len(h) for h in hit_ind])
+    rows = np.repeat(np.arange(len(sizes)), sizes)
+    start = np.r_[0, np.cumsum(sizes)[:-1]]
+    hits = np.concatenate(hit_ind).astype(int)
+    w = weights[hits]
+    cum_w = np.cumsum(w)
+    cum_w = cum_w - (cum_w - w)[start][rows]
+    sum_w = cum_w[np.r_[start[1:], len(hits)] - 1][rows]
+    # misses before (and at) each hit
+    misses = (hits - (np.arange(len(hits)) - start[rows])) / (N - sizes[rows])
+    up = cum_w / sum_w - misses
+    down = (cum_w - w) / sum_w - misses
+    # first position of the max (min) in each gene set
+    imax = np.lexsort((hits, -up, rows))[start]
+    imin = np.lexsort((hits, down, rows))[start]
+
+    return hits[imax], hits[imin] - 1
+
+
 def ranking_metric_tensor(exprs, method, permutation_num, pos, neg, classes,
                           ascending, rs=None):
     """Build shuffled ranking matrix when permutation_type eq to phenotype.
@@ -256,6 +349,134 @@ def ranking_metric_tensor(exprs, method, permutation_num, pos, neg, classes,
     # return genes_mat[:,::-1], cor_mat[:,::-1]
     return cor_mat_ind[:, ::-1], cor_mat[:, ::-1]
 
+def phenotype_permutations(n_samples, n_genes, n_sets, rs=None):
+    """Sample orders of phenotype permutations. The number of permutations follows
+       :func:`gsea_compute_tensor`, one block of permutations per block of gene sets.
+
+       :param int n_samples: sample number.
+       :param int n_genes: gene number.
+       :param int n_sets: gene set number.
+       :param rs: random state.
+       :return: int ndarray with shape (nperm+1, n_samples), the last row is not permutated.
+    """
+    rs = np.random.RandomState(rs)
+    base = 5 if n_genes >= 5000 else 10
+    nperm = ceil(n_sets / base) * base
+    perms = np.tile(np.arange(n_samples), (nperm + 1, 1))
+    for arr in perms[:-1]: rs.shuffle(arr)
+    return perms
+
+
+def contrast_metric(method, pos_mean, neg_mean, pos_std, neg_std):
+    """ranking metric of a contrast from class means and standard deviations,
+       same formulas with :func:`ranking_metric_tensor`. Arrays are (..., genes).
+    """
+    if method == 'signal_to_noise':
+        return (pos_mean - neg_mean)/(pos_std + neg_std)
+    elif method == 't_test':
+        denom = 1.0/pos_mean.shape[-1]
+        return (pos_mean - neg_mean)/ np.sqrt(denom*pos_std**2 + denom*neg_std**2)
+    elif method == 'ratio_of_classes':
+        return pos_mean / neg_mean
+    elif method == 'diff_of_classes':
+        return pos_mean - neg_mean
+    elif method == 'log2_ratio_of_classes':
+        return np.log2(pos_mean / neg_mean)
+    logging.error("Please provide correct method name!!!")
+    sys.exit(0)
+
+
+def ranking_metric_contrasts(exprs, method, classes, contrasts, perms, ascending, chunk=100):
+    """Ranking metrics of many contrasts, with shared phenotype permutations.
+       Per-class sums and sums of squares are computed once for each permutation,
+       then every contrast is derived from them. 'rest' stands for all other classes.
+
+       :param exprs: gene_expression DataFrame, gene_name indexed.
+       :param str method: ranking metric, see :func:`ranking_metric`.
+       :param list classes: phenotype label of each column of exprs.
+       :param list contrasts: list of (pos, neg) labels, neg could be 'rest'.
+       :param perms: sample orders of permutations, see :func:`phenotype_permutations`.
+       :param bool ascending: sorting order of rankings.
+       :param int chunk: permutations computed at a time.
+       :return: a list of (cor_mat_indices, cor_mat) of each contrast, same as :func:`ranking_metric_tensor`.
+    """
+    labels = unique(list(classes))
+    classes = np.asarray(classes)
+    onehot = (classes[:, np.newaxis] == np.array(labels)[np.newaxis, :]).astype(float)
+    counts = onehot.sum(axis=0)
+    # center genes for numerically stable variances
+    X = exprs.values
+    center = X.mean(axis=1, keepdims=True)
+    Xc = X - center
+    total, total2 = Xc.sum(axis=1), (Xc**2).sum(axis=1)
+    S = X.shape[1]
+    out = [([], []) for c in contrasts]
+    for b in range(0, len(perms), chunk):
+        # permutated labels -> one-hot matrices, shape (perm, sample, class)
+        labmat = onehot[perms[b:b+chunk]]
+        sums = np.einsum('gs,psc->pcg', Xc, labmat)
+        sums2 = np.einsum('gs,psc->pcg', Xc**2, labmat)
+        for ci, (pos, neg) in enumerate(contrasts):
+            stats = []
+            for lab in (pos, neg):
+                if lab == 'rest':
+                    i = labels.index(pos)
+                    n, s1, s2 = S - counts[i], total - sums[:, i], total2 - sums2[:, i]
+                else:
+                    i = labels.index(lab)
+                    n, s1, s2 = counts[i], sums[:, i], sums2[:, i]
+                mean = s1 / n
+                std = np.sqrt(np.clip((s2 - n * mean**2) / (n - 1), 0, None))
+                stats.append((mean + center[:, 0], std))
+            (pm, ps), (nm, ns) = stats
+            cor = contrast_metric(method, pm, nm, ps, ns)
+            ind = cor.argsort(axis=1)
+            cor = np.take_along_axis(cor, ind, axis=1)
+            if not ascending: ind, cor = ind[:, ::-1], cor[:, ::-1]
+            out[ci][0].append(ind)
+            out[ci][1].append(cor)
+
+    return [(np.vstack(ind), np.vstack(cor)) for ind, cor in out]
+
+
+def ranking_metric_continuous(exprs, method, phenotype, perms, ascending, chunk=200):
+    """Correlations of genes with a continuous phenotype, for all permutations at once.
+       Rows of exprs and columns of permutated phenotypes are standardized, so correlations
+       are one (genes x samples) x (samples x permutations) matrix product.
+
+       :param exprs: gene_expression DataFrame, gene_name indexed.
+       :param str method: 'pearson' or 'cosine'.
+       :param phenotype: continuous phenotype value of each column of exprs.
+       :param perms: sample orders of permutations, see :func:`phenotype_permutations`.
+       :param bool ascending: sorting order of rankings.
+       :param int chunk: permutations computed at a time.
+       :return: (cor_mat_indices, cor_mat), same as :func:`ranking_metric_tensor`.
+    """
+    X = exprs.values.astype(float)
+    y = np.asarray(phenotype, dtype=float)
+    if method == 'pearson':
+        X = X - X.mean(axis=1, keepdims=True)
+        y = y - y.mean()
+    elif method != 'cosine':
+        logging.error("Please provide correct method name!!!")
+        sys.exit(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Z = X / np.linalg.norm(X, axis=1, keepdims=True)
+        y = y / np.linalg.norm(y)
+    ind, cor = [], []
+    for b in range(0, len(perms), chunk):
+        # permutated phenotypes, shape (samples, perm)
+        Y = y[perms[b:b+chunk]].T
+        c = (Z @ Y).T
+        i = c.argsort(axis=1)
+        c = np.take_along_axis(c, i, axis=1)
+        if not ascending: i, c = i[:, ::-1], c[:, ::-1]
+        ind.append(i)
+        cor.append(c)
+
+    return np.vstack(ind), np.vstack(cor)
+
+
 def ranking_metric(df, method, pos, neg, classes, ascending):
     """The main function to rank an expression table.
 
@@ -323,9 +544,74 @@ def ranking_metric(df, method, pos, neg, classes, ascending):
     return ser
 
 
+def ranking_order(values, ascending=False):
+    """Positions that sort a ranking vector. Uses pandas sort_values as Prerank and ssGSEA do,
+       so tied genes end up in the same order, and so do the enrichment scores.
+
+       :param values: 1d ranking values.
+       :param bool ascending: sorting order. Default: False.
+       :return: ndarray of positions, values[order] is sorted.
+    """
+    return pd.Series(values).sort_values(ascending=ascending).index.values
+
+
+def collapse_dataset(df, chip, mode='max'):
+    """Collapse probe level expression values to gene level, same as "Collapse dataset" of GSEA.
+       Rows are sorted by gene once, then each gene block is reduced with ufunc.reduceat.
+
+       :param df: expression DataFrame, probe ids are index, samples are columns.
+       :param chip: a pd.Series of probe id -> gene name, see :func:`gseapy.parser.gsea_chip_parser`.
+       :param mode: how to collapse probes of the same gene, one of
+
+                    1. 'max', max value of the probes, the default of GSEA.
+                    2. 'mean', mean value of the probes.
+                    3. 'median', median value of the probes.
+                    4. 'sum', sum of the probes.
+                    5. 'maxabs', value of the probe with the largest absolute value.
+
+       :return: gene level DataFrame, gene names are index, in order of first appearance.
+                Probes not found in chip are dropped, the DataFrame is empty if no probe is found.
+    """
+    genes = chip.reindex(df.index.astype(str)).values
+    mapped = pd.notnull(genes)
+    codes, names = pd.factorize(genes[mapped])
+    values = df.values[mapped].astype(float)
+    # gene blocks
+    order = np.argsort(codes, kind='mergesort')
+    values, codes = values[order], codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[starts, len(codes)])[:, None]
+
+    if not mapped.any():
+        # no probe in chip, e.g. a chip of another platform
+        mat = np.empty((0, df.shape[1]))
+    elif mode == 'max':
+        mat = np.maximum.reduceat(values, starts, axis=0)
+    elif mode == 'sum':
+        mat = np.add.reduceat(values, starts, axis=0)
+    elif mode == 'mean':
+        mat = np.add.reduceat(values, starts, axis=0) / counts
+    elif mode == 'maxabs':
+        absmax = np.maximum.reduceat(np.abs(values), starts, axis=0)
+        # the positive value wins a tie
+        mat = np.where(np.maximum.reduceat(values, starts, axis=0) == absmax, absmax, -absmax)
+    elif mode == 'median':
+        # gene blocks of the same size are stacked into one 3-D array
+        mat = np.empty((len(starts), values.shape[1]))
+        for c in np.unique(counts):
+            blocks = np.flatnonzero(counts[:, 0] == c)
+            rows = starts[blocks][:, None] + np.arange(c)
+            mat[blocks] = np.median(values[rows], axis=1)
+    else:
+        raise Exception("Unsupported collapse mode: %s, choose from max, mean, median, sum, maxabs" % mode)
+
+    return pd.DataFrame(mat, index=pd.Index(names, name=df.index.name), columns=df.columns)
+
+
 def gsea_compute_tensor(data, gmt, n, weighted_score_type, permutation_type,
                  method, pheno_pos, pheno_neg, classes, ascending,
-                 processes=1, seed=None, single=False, scale=False):
+                 processes=1, seed=None, single=False, scale=False, null_mode=None, lazy=False,
+                 rankings=None):
     """compute enrichment scores and enrichment nulls.
 
         :param data: preprocessed expression dataframe or a pre-ranked file if prerank=True.
@@ -339,6 +625,10 @@ def gsea_compute_tensor(data, gmt, n, weighted_score_type, permutation_type,
         :param bool ascending: sorting order of rankings. Default: False.
         :param seed: random seed. Default: np.random.RandomState()
         :param bool scale: if true, scale es by gene number.
+        :param str null_mode: how esnulls are kept, see :func:`null_accumulator`.
+        :param bool lazy: if true, don't keep RES, the nested list of RES is None.
+        :param rankings: only for phenotype permutation, precomputed (cor_mat_indices, cor_mat) of
+                         all permutations, the last row is not permutated. See :func:`ranking_metric_contrasts`.
 
         :return: a tuple contains::
 
@@ -358,7 +648,10 @@ def gsea_compute_tensor(data, gmt, n, weighted_score_type, permutation_type,
     np.random.seed(seed)
     random_state = np.random.randint(np.iinfo(np.int32).max, size=block)
 
-    if permutation_type == "phenotype":
+    if permutation_type == "phenotype" and rankings is not None:
+        genes_ind, cor_mat = rankings
+        genes_mat = (data.index.values, genes_ind)
+    elif permutation_type == "phenotype":
         # shuffling classes and generate random correlation rankings
         logging.debug("Start to permutate classes..............................")
         genes_ind = []
@@ -402,31 +695,78 @@ def gsea_compute_tensor(data, gmt, n, weighted_score_type, permutation_type,
                                             #          single, scale)))
         m = base * i
         i += 1
-    # use joblib
-    temp_esnu = Parallel(n_jobs=processes)(delayed(enrichment_score_tensor)(
-                    genes_mat, cor_mat, gmtrim, w, n, rs, single, scale) 
-                    for gmtrim, rs in zip(gmt_block, random_state))
-    # pool_esnu.close()
-    # pool_esnu.join()
-
-    # esn is a list, don't need to use append method.
-    for si, temp in enumerate(temp_esnu):
-        # e, enu, hit, rune = temp.get()
-        e, enu, hit, rune = temp
-        esnull.append(enu)
-        es.append(e)
-        RES.append(rune)
-        hit_ind += hit
-    # concate results
-    es, esnull, RES = np.hstack(es), np.vstack(esnull), np.vstack(RES)
-
-    return gsea_significance(es, esnull), hit_ind, RES, subsets
+    acc = null_accumulator(len(subsets), n, null_mode)
+    # use joblib, a batch of blocks at a time when esnulls are accumulated
+    nbatch = block if acc is None else max(processes, 1)
+    for b in range(0, block, nbatch):
+        temp_esnu = Parallel(n_jobs=processes)(delayed(enrichment_score_tensor)(
+                        genes_mat, cor_mat, gmtrim, w, n, rs, single, scale, lazy)
+                        for gmtrim, rs in zip(gmt_block[b:b+nbatch], random_state[b:b+nbatch]))
+        # pool_esnu.close()
+        # pool_esnu.join()
 
+        # esn is a list, don't need to use append method.
+        for si, temp in enumerate(temp_esnu):
+            # e, enu, hit, rune = temp.get()
+            e, enu, hit, rune = temp
+            if acc is None:
+                esnull.append(enu)
+            else:
+                acc.update(enu, index=np.arange(len(hit_ind), len(hit_ind) + len(e)), es=e)
+            es.append(e)
+            RES.append(rune)
+            hit_ind += hit
+    # concate results
+    es = np.hstack(es)
+    RES = [None] * len(hit_ind) if lazy else np.vstack(RES)
+    if acc is not None:
+        return acc.significance(), hit_ind, RES, subsets
+
+    return gsea_significance(es, np.vstack(esnull)), hit_ind, RES, subsets
+
+
+
+def gsea_compute_contrasts(data, gmt, n, weighted_score_type, permutation_type, method,
+                           classes, contrasts, ascending, processes=1, seed=None, null_mode=None, lazy=False):
+    """compute enrichment scores and enrichment nulls of many contrasts of one expression table.
+       Phenotype permutations are shared by all contrasts, see :func:`ranking_metric_contrasts`.
+
+        :param data: preprocessed expression dataframe.
+        :param dict gmt: gene sets, call load_gmt() to get results.
+        :param int n: permutation number.
+        :param str permutation_type: 'phenotype' or 'gene_set'.
+        :param str method: ranking_metric method.
+        :param list classes: phenotype label of each column of data.
+        :param list contrasts: list of (pos, neg) labels, neg could be 'rest'.
+        :param str null_mode: how esnulls are kept, see :func:`null_accumulator`.
+        :return: an OrderedDict of contrast (pos, neg) -> (zipped results of es, nes, pval, fdr,
+                 nested list of hit indices, nested list of RES, list of terms, sorted ranking Series).
+    """
+    S = data.shape[1]
+    if permutation_type == "phenotype":
+        perms = phenotype_permutations(S, data.shape[0], len(gmt), rs=seed)
+    else:
+        # observed rankings only
+        perms = np.arange(S)[np.newaxis, :]
+    rankings = ranking_metric_contrasts(data, method, classes, contrasts, perms, ascending)
+    results = OrderedDict()
+    for (pos, neg), (ind, cor) in zip(contrasts, rankings):
+        logging.debug("Start to compute es and esnulls of %s vs %s..........."%(pos, neg))
+        rnk = pd.Series(cor[-1], index=data.index.values[ind[-1]])
+        dataset = data if permutation_type == "phenotype" else rnk
+        res = gsea_compute_tensor(data=dataset, gmt=gmt, n=n, weighted_score_type=weighted_score_type,
+                                  permutation_type=permutation_type, method=method,
+                                  pheno_pos=pos, pheno_neg=neg, classes=classes, ascending=ascending,
+                                  processes=processes, seed=seed, null_mode=null_mode, lazy=lazy,
+                                  rankings=(ind, cor))
+        results[(pos, neg)] = res + (rnk,)
+
+    return results
 
 
 def gsea_compute(data, gmt, n, weighted_score_type, permutation_type,
                  method, pheno_pos, pheno_neg, classes, ascending,
-                 processes=1, seed=None, single=False, scale=False):
+                 processes=1, seed=None, single=False, scale=False, null_mode=None, lazy=False):
     """compute enrichment scores and enrichment nulls.
 
         :param data: preprocessed expression dataframe or a pre-ranked file if prerank=True.
@@ -440,6 +780,8 @@ def gsea_compute(data, gmt, n, weighted_score_type, permutation_type,
         :param bool ascending: sorting order of rankings. Default: False.
         :param seed: random seed. Default: np.random.RandomState()
         :param bool scale: if true, scale es by gene number.
+        :param str null_mode: how esnulls are kept, see :func:`null_accumulator`.
+        :param bool lazy: if true, don't keep RES, the nested list of RES is None.
 
         :return: a tuple contains::
 
@@ -476,7 +818,9 @@ def gsea_compute(data, gmt, n, weighted_score_type, permutation_type,
                                                            gene_sets=gmt,
                                                            weighted_score_type=w,
                                                            nperm=n, rs=rs,
-                                                           single=False, scale=False,)
+                                                           single=False, scale=False,
+                                                           lazy=lazy)
+        if lazy: RES = [None] * len(hit_ind)
 
     else:
         # Prerank, ssGSEA, GSEA with gene_set permutation
@@ -503,22 +847,318 @@ def gsea_compute(data, gmt, n, weighted_score_type, permutation_type,
         # pool_esnu.close()
         # pool_esnu.join()
 
-        temp_esnu = Parallel(n_jobs=processes)(delayed(enrichment_score)(
-                        gl, cor_vec, gmt.get(subset), w, n, 
-                        rs, single, scale) 
-                        for subset, rs in zip(subsets, random_state))        
-        # esn is a list, don't need to use append method.
-        for si, temp in enumerate(temp_esnu):
-            #e, enu, hit, rune = temp.get()
-            e, enu, hit, rune = temp
-            esnull[si] = enu
-            es.append(e)
-            RES.append(rune)
-            hit_ind.append(hit)
+        acc = null_accumulator(len(subsets), n, null_mode)
+        # a batch of gene sets at a time when esnulls are accumulated
+        nbatch = len(subsets) if acc is None else max(64, 16 * processes)
+        for b in range(0, len(subsets), nbatch):
+            temp_esnu = Parallel(n_jobs=processes)(delayed(enrichment_score)(
+                            gl, cor_vec, gmt.get(subset), w, n,
+                            rs, single, scale, lazy)
+                            for subset, rs in zip(subsets[b:b+nbatch], random_state[b:b+nbatch]))
+            # esn is a list, don't need to use append method.
+            for si, temp in enumerate(temp_esnu, b):
+                #e, enu, hit, rune = temp.get()
+                e, enu, hit, rune = temp
+                if acc is None:
+                    esnull[si] = enu
+                else:
+                    acc.update(enu, index=[si], es=e)
+                es.append(e)
+                RES.append(rune)
+                hit_ind.append(hit)
+        if acc is not None:
+            return acc.significance(), hit_ind, RES, subsets
 
     return gsea_significance(es, esnull), hit_ind, RES, subsets
 
 
+def enrichment_score_hits(weights, hit_pos, N):
+    """Enrichment scores from hit positions only. RES only moves up at hits, so its max
+       is reached at a hit, and its min just before a hit.
+
+       :param weights: weights of hits, ndarray with shape (..., k), e.g. abs(correl_vector)**w.
+       :param hit_pos: sorted positions of hits in the gene list, broadcast with weights.
+       :param int N: length of the gene list.
+       :return: enrichment scores with shape (...), same as :func:`enrichment_score`.
+    """
+    k = hit_pos.shape[-1]
+    cumw = np.cumsum(weights, axis=-1)
+    norm_tag = cumw[..., -1:]
+    # misses before each hit
+    miss = (hit_pos - np.arange(k)) / float(N - k)
+    max_ES = np.maximum((cumw / norm_tag - miss).max(axis=-1), 0)
+    min_ES = (((cumw - weights) / norm_tag) - miss).min(axis=-1)
+    return np.where(np.abs(max_ES) > np.abs(min_ES), max_ES, min_ES)
+
+
+def enrichment_score_sum(weights, hit_pos, N):
+    """ssGSEA enrichment scores, the sum of RES, from hit positions only.
+       See :func:`ssgsea_permu_block` for the closed form.
+
+       :param weights: weights of hits, ndarray with shape (..., k), e.g. abs(correl_vector)**w.
+       :param hit_pos: sorted positions of hits in the gene list, broadcast with weights.
+       :param int N: length of the gene list.
+       :return: enrichment scores with shape (...), same as :func:`enrichment_score` with single=True.
+    """
+    k = hit_pos.shape[-1]
+    dist = N - hit_pos
+    return (weights * dist).sum(axis=-1) / weights.sum(axis=-1) - \
+           (N * (N + 1) / 2.0 - dist.sum(axis=-1)) / float(N - k)
+
+
+def enrichment_score_multi(orders, weights, tag, weighted_score_type=1, nperm=1000,
+                           rs=None, lazy=False, chunk=100):
+    """Enrichment scores of one gene set in many rankings of the same genes.
+       Each permutation draws a random set of hit positions, and is shared by all rankings.
+
+       :param orders: ndarray with shape (R, N), gene indices of each ranking, sorted by ranking values.
+       :param weights: ndarray with shape (R, N), sorted abs(ranking values)**weighted_score_type.
+       :param tag: bool vector with shape (N,), True if a gene is in the gene set.
+       :param int nperm: permutation times.
+       :param rs: random state of the permutations.
+       :param bool lazy: if true, RES is None.
+       :param int chunk: permutations computed at a time.
+       :return: es (R,), esnull (R, nperm), list of hit indices and list of RES of each ranking.
+    """
+    rs = np.random.RandomState(rs)
+    R, N = weights.shape
+    k = int(tag.sum())
+    es, hit_ind, RES = np.zeros(R), [], []
+    for r in range(R):
+        hit = np.flatnonzero(tag[orders[r]])
+        es[r] = enrichment_score_hits(weights[r, hit], hit, N)
+        hit_ind.append(hit.tolist())
+        RES.append(None if lazy else running_enrichment_score(weights[r], hit, 1))
+    esnull = np.zeros((R, nperm))
+    for b in range(0, nperm, chunk):
+        m = min(chunk, nperm - b)
+        # random k-subsets of positions
+        pos = np.sort(rs.random_sample((m, N)).argpartition(k - 1, axis=1)[:, :k], axis=1)
+        esnull[:, b:b+m] = enrichment_score_hits(weights[:, pos], pos, N)
+
+    return es, esnull, hit_ind, RES
+
+
+def gsea_compute_multi(data, gmt, n, weighted_score_type, ascending=False,
+                       processes=1, seed=None, null_mode=None, lazy=False):
+    """Prerank of many rankings of the same genes in one pass. Gene sets are encoded once,
+       and each gene set is scored in all rankings by one job. See :func:`enrichment_score_multi`.
+
+        :param data: genes x rankings DataFrame, gene names are index.
+        :param dict gmt: gene sets, call load_gmt() to get results.
+        :param int n: permutation number.
+        :param float weighted_score_type: default:1
+        :param bool ascending: sorting order of rankings. Default: False.
+        :param seed: random seed.
+        :param str null_mode: how esnulls are kept, see :func:`null_accumulator`.
+        :param bool lazy: if true, don't keep RES.
+
+        :return: an OrderedDict of ranking name -> (zipped results of es, nes, pval, fdr,
+                 nested list of hit indices, nested list of RES, list of terms, sorted ranking Series).
+    """
+    w = weighted_score_type
+    subsets = sorted(gmt.keys())
+    genes, values = data.index.values, data.values.T
+    R, N = values.shape
+    # same tie order as the ranking of a single Prerank
+    orders = np.vstack([ranking_order(v, ascending) for v in values])
+    sorted_values = np.take_along_axis(values, orders, axis=1)
+    weights = np.ones(sorted_values.shape) if w == 0 else np.abs(sorted_values)**w
+
+    np.random.seed(seed)
+    random_state = np.random.randint(np.iinfo(np.int32).max, size=len(subsets))
+    es = np.zeros((R, len(subsets)))
+    hit_ind = [[None] * len(subsets) for r in range(R)]
+    RES = [[None] * len(subsets) for r in range(R)]
+    accs = [null_accumulator(len(subsets), n, null_mode) for r in range(R)]
+    # full esnull matrix only for rankings without an accumulator
+    esnull = [np.zeros((len(subsets), n)) if acc is None else None for acc in accs]
+    # a batch of gene sets at a time when esnulls are accumulated
+    nbatch = len(subsets) if accs[0] is None else max(64, 16 * processes)
+    for b in range(0, len(subsets), nbatch):
+        temp = Parallel(n_jobs=processes)(delayed(enrichment_score_multi)(
+                    orders, weights, np.in1d(genes, gmt.get(subset), assume_unique=True),
+                    w, n, rs, lazy)
+                    for subset, rs in zip(subsets[b:b+nbatch], random_state[b:b+nbatch]))
+        for si, (e, enu, hit, rune) in enumerate(temp, b):
+            es[:, si] = e
+            for r in range(R):
+                if accs[r] is None:
+                    esnull[r][si] = enu[r]
+                else:
+                    accs[r].update(enu[r][np.newaxis, :], index=[si], es=e[r])
+                hit_ind[r][si], RES[r][si] = hit[r], rune[r]
+
+    results = OrderedDict()
+    for r, name in enumerate(data.columns):
+        sig = gsea_significance(es[r], esnull[r]) if accs[r] is None else accs[r].significance()
+        rnk = pd.Series(sorted_values[r], index=genes[orders[r]], name=name)
+        results[name] = (sig, hit_ind[r], RES[r], subsets, rnk)
+
+    return results
+
+
+def ssgsea_permu_block(weights, hit_block, nperm, scale=False, rs=None):
+    """Compute ssGSEA enrichment scores and size matched nulls for a block of gene sets.
+
+       The sum of the running enrichment score has a closed form, so RES is never built::
+
+           sum(RES) = sum_h w_h*(N-h)/sum_h w_h - (N*(N+1)/2 - sum_h (N-h))/(N-k)
+
+       where h are the 0-based hit positions and k the matched size. The prefix of a random
+       permutation is a random gene set for every size, so the null of all sizes in the block
+       is read from the prefix sums of the same nperm permutations.
+
+       :param weights:   weighted rankings of one sample, sorted, e.g. abs(rankings)**weighted_score_type.
+       :param hit_block: a list of hit indices (of the sorted ranking) for each gene set.
+       :param int nperm: permutation times.
+       :param bool scale: if true, scale es by gene number.
+       :param rs:        random state for gene list shuffling.
+
+       :return: a tuple contains::
+
+                | es of each gene set.
+                | esnull matrix with shape (unique matched size, nperm).
+                | index of each gene set into the rows of esnull.
+
+    """
+    rs = np.random.RandomState(rs)
+    N = len(weights)
+    total = N * (N + 1) / 2.0
+    sizes = np.array([len(h) for h in hit_block])
+    hits = np.concatenate(hit_block).astype(int)
+    offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+    hit_w = weights[hits]
+    dist = N - hits
+    es = np.add.reduceat(hit_w * dist, offsets) / np.add.reduceat(hit_w, offsets) - \
+         (total - np.add.reduceat(dist, offsets)) / (N - sizes)
+    # one null for each matched size
+    usize, uind = np.unique(sizes, return_inverse=True)
+    esnull = np.zeros((len(usize), nperm))
+    if nperm:
+        kmax = usize.max()
+        perm_ind = np.vstack([rs.permutation(N)[:kmax] for i in range(nperm)])
+        perm_w = weights[perm_ind]
+        perm_dist = N - perm_ind
+        cum_w = np.cumsum(perm_w, axis=1)[:, usize - 1]
+        cum_wd = np.cumsum(perm_w * perm_dist, axis=1)[:, usize - 1]
+        cum_d = np.cumsum(perm_dist, axis=1)[:, usize - 1]
+        esnull = (cum_wd / cum_w - (total - cum_d) / (N - usize)).T
+    if scale:
+        es, esnull = es / N, esnull / N
+
+    return es, esnull, uind
+
+
+def ssgsea_compute_permu(data, gmt, n, weighted_score_type, ascending=False,
+                         processes=1, seed=None, scale=False, null_mode=None):
+    """compute ssGSEA enrichment scores and significance of all samples in one job.
+
+        :param data: normalized expression dataframe, gene_name indexed, one column per sample.
+        :param dict gmt: all gene sets in .gmt file. need to call load_gmt() to get results.
+        :param int n: permutation number.
+        :param float weighted_score_type: default:0.25
+        :param bool ascending: sorting order of rankings. Default: False.
+        :param int processes: number of processes. The job is split into samples x gene set chunks.
+        :param seed: random seed. Default: np.random.RandomState()
+        :param bool scale: if true, scale es by gene number.
+        :param str null_mode: how esnulls of each sample are kept, see :func:`null_accumulator`.
+
+        :return: a tuple contains::
+
+                | list of enriched terms
+                | matched size of each term
+                | es, nes, pval, fdr. ndarray with shape (samples, terms).
+
+    """
+    subsets = sorted(gmt.keys())
+    genes = data.index.values
+    # gene indices of each gene set are shared by all samples
+    gene_ind = [np.flatnonzero(np.in1d(genes, gmt.get(s), assume_unique=True)) for s in subsets]
+    sizes = np.array([len(g) for g in gene_ind])
+    # sort gene sets by matched size, so each chunk shares a narrow band of nulls
+    nchunk = max(1, min(processes, len(subsets)))
+    chunks = np.array_split(np.argsort(sizes, kind='mergesort'), nchunk)
+    mat = data.values
+    N, S = mat.shape
+    np.random.seed(seed)
+    random_state = np.random.randint(np.iinfo(np.int32).max, size=(S, nchunk))
+
+    weights, positions = [], []
+    for j in range(S):
+        col = mat[:, j]
+        order = ranking_order(col, ascending)
+        pos = np.empty(N, dtype=int)
+        pos[order] = np.arange(N)
+        positions.append(pos)
+        if weighted_score_type == 0:
+            weights.append(np.ones(N))
+        else:
+            weights.append(np.abs(col[order]) ** weighted_score_type)
+
+    logging.debug("Start to compute es and esnulls........................")
+    es = np.zeros((S, len(subsets)))
+    nes, pvals, fdrs = np.zeros(es.shape), np.zeros(es.shape), np.zeros(es.shape)
+    # a batch of samples at a time, only the esnulls of this batch are kept in memory
+    nbatch = max(processes, 1)
+    for b in range(0, S, nbatch):
+        tasks = [(j, c) for j in range(b, min(b + nbatch, S)) for c in range(nchunk)]
+        temp_esnu = Parallel(n_jobs=processes)(delayed(ssgsea_permu_block)(
+                        weights[j], [positions[j][gene_ind[i]] for i in chunks[c]],
+                        n, scale, random_state[j, c])
+                        for j, c in tasks)
+
+        esnull = {j: np.zeros((len(subsets), n)) for j, c in tasks}
+        for (j, c), temp in zip(tasks, temp_esnu):
+            e, enu, uind = temp
+            es[j, chunks[c]] = e
+            esnull[j][chunks[c]] = enu[uind]
+        for j, enu in esnull.items():
+            acc = null_accumulator(len(subsets), n, null_mode)
+            if acc is None:
+                _, nes[j], pvals[j], fdrs[j] = zip(*gsea_significance(es[j], enu))
+            else:
+                acc.update(enu, es=es[j])
+                _, nes[j], pvals[j], fdrs[j] = zip(*acc.significance())
+
+    return subsets, sizes, es, nes, pvals, fdrs
+
+
+def null_accumulator(n_sets, nperm, null_mode=None, spill=None):
+    """Select how esnulls are kept.
+
+    :param int n_sets: number of gene sets.
+    :param int nperm: permutation number.
+    :param str null_mode: one of
+
+                          | None: 'exact' if n_sets * nperm > NULL_STREAM_SIZE, else 'memory'.
+                          | 'memory': keep the full esnull matrix, see :func:`gsea_significance`.
+                          | 'stream': :class:`NullAccumulator` with binned FDR null, approximate FDR.
+                          |           Enrichment scores must be in [-1, 1], e.g. not unscaled ssGSEA.
+                          | 'exact': :class:`NullAccumulator` which spills esnulls to disk for exact FDR.
+
+    :param spill: directory to spill esnulls in 'exact' mode. Default: a temporary directory.
+    :return: None for 'memory' mode, or a NullAccumulator.
+    """
+    if null_mode is None:
+        null_mode = 'exact' if n_sets * nperm > NULL_STREAM_SIZE else 'memory'
+    if null_mode == 'memory' or nperm == 0:
+        return None
+    elif null_mode == 'stream':
+        logging.warning("Accumulate esnulls with binned FDR null, FDR is approximate.")
+        return NullAccumulator(n_sets)
+    elif null_mode == 'exact':
+        logging.debug("Spill esnulls to disk for exact FDR.................")
+        if spill is None:
+            # removed when the accumulator is garbage collected
+            tmpdir = TemporaryDirectory()
+            acc = NullAccumulator(n_sets, spill=tmpdir.name)
+            acc._tmpdir = tmpdir
+            return acc
+        return NullAccumulator(n_sets, spill=spill)
+    raise ValueError("Unsupported null_mode: %s" % null_mode)
+
+
 def normalize(es, esnull):
     """normalize the ES(S,pi) and the observed ES(S), separately rescaling
        the positive and negative scores by dividing the mean of the ES(S,pi).
@@ -660,3 +1300,131 @@ def gsea_significance(enrichment_scores, enrichment_nulls):
 
 
 
+class NullAccumulator(object):
+    """Online accumulator of enrichment score nulls.
+
+       Instead of holding the full (gene_sets, nperm) esnull matrix, it keeps per gene set
+       positive/negative sums, sign counts and exceedance counts, which give exact NES and
+       p-values. For FDR, each gene set's nulls are binned on a fixed ES grid, and the bins
+       are rescaled into a global NES null distribution when significance() is called.
+
+       If ``spill`` is a directory, esnulls are buffered and written to disk in large blocks
+       instead of binned, and FDR is computed exactly by reading them back block by block.
+
+       :param int n_sets: number of gene sets.
+       :param int bins: number of ES bins of each gene set. Default: 500.
+       :param float es_range: ES grid spans [-es_range, es_range]. Scores outside raise a ValueError.
+       :param spill: None or a directory to save esnull blocks for exact FDR.
+       :param int block_size: number of esnulls in each spilled block. Default: 2**22.
+    """
+
+    def __init__(self, n_sets, bins=500, es_range=1.0, spill=None, block_size=2**22):
+        self.es = np.full(n_sets, np.nan)
+        self.nperm = np.zeros(n_sets, dtype=int)
+        self.pos_sum = np.zeros(n_sets)
+        self.neg_sum = np.zeros(n_sets)
+        self.pos_num = np.zeros(n_sets, dtype=int)
+        self.neg_num = np.zeros(n_sets, dtype=int)
+        self.exceed = np.zeros(n_sets, dtype=int)
+        self.spill = spill
+        self.block_size = block_size
+        self._blocks = []
+        self._buffer = []
+        self._buffered = 0
+        if spill is None:
+            # even bins, so that 0 is always a bin edge and bins never mix signs
+            self._edges = np.linspace(-es_range, es_range, 2 * max(bins // 2, 1) + 1)
+            self._hist = np.zeros((n_sets, len(self._edges) - 1), dtype=np.int32)
+
+    def update(self, esnull, index=None, es=None):
+        """add a block of nulls.
+
+        :param esnull: ndarray with shape (len(index), b), b permutations of each gene set in index.
+        :param index: row indices of gene sets in this block. Default: all gene sets.
+        :param es: observed enrichment scores of gene sets in index, if not given yet.
+        """
+        esnull = np.atleast_2d(np.asarray(esnull, dtype=float))
+        index = np.arange(len(self.es)) if index is None else np.asarray(index)
+        if es is not None: self.es[index] = es
+        e = self.es[index][:, np.newaxis]
+        if self.spill is None:
+            # scores beyond the grid would all fall into the edge bins
+            limit = self._edges[-1] * (1 + 1e-9)
+            if np.abs(esnull).max(initial=0) > limit or np.nanmax(np.abs(e), initial=0) > limit:
+                raise ValueError("Enrichment scores out of [-%s, %s], binned FDR null needs scaled scores. "
+                                 "Use null_mode 'memory' or 'exact' instead." % (self._edges[-1], self._edges[-1]))
+        pos = esnull >= 0
+        self.nperm[index] += esnull.shape[1]
+        self.pos_sum[index] += np.where(pos, esnull, 0).sum(axis=1)
+        self.neg_sum[index] += np.where(pos, 0, esnull).sum(axis=1)
+        self.pos_num[index] += pos.sum(axis=1)
+        self.neg_num[index] += (~pos).sum(axis=1)
+        # same rule with gsea_pval
+        self.exceed[index] += np.where(e >= 0, esnull >= e, esnull < e).sum(axis=1)
+
+        if self.spill is not None:
+            # gene set of each null, nulls of many updates share one block file
+            self._buffer.append((np.repeat(index, esnull.shape[1]).astype(np.int32), esnull.ravel()))
+            self._buffered += esnull.size
+            if self._buffered >= self.block_size: self._flush()
+            return
+        nbin = self._hist.shape[1]
+        bind = np.clip(np.searchsorted(self._edges, esnull, side='right') - 1, 0, nbin - 1)
+        flat = (np.arange(len(index))[:, np.newaxis] * nbin + bind).ravel()
+        self._hist[index] += np.bincount(flat, minlength=len(index) * nbin).reshape(len(index), nbin).astype(np.int32)
+
+    def _flush(self):
+        """write buffered nulls to one block file"""
+        if len(self._buffer) == 0: return
+        fname = os.path.join(self.spill, "esnull.%06d.npz" % len(self._blocks))
+        np.savez(fname, rows=np.concatenate([r for r, v in self._buffer]),
+                 vals=np.concatenate([v for r, v in self._buffer]))
+        self._blocks.append(fname)
+        self._buffer, self._buffered = [], 0
+
+    def _null_nes(self, pos_mean, neg_mean, chunk=1024):
+        """yield (normalized nulls, counts) blocks"""
+        if self.spill is not None:
+            self._flush()
+            for fname in self._blocks:
+                with np.load(fname) as block:
+                    rows, esnull = block['rows'], block['vals']
+                yield np.where(esnull >= 0, esnull / pos_mean[rows], -esnull / neg_mean[rows]), None
+            return
+        centers = (self._edges[:-1] + self._edges[1:]) / 2.0
+        for i in range(0, len(self.es), chunk):
+            pm, nm = pos_mean[i:i + chunk, np.newaxis], neg_mean[i:i + chunk, np.newaxis]
+            yield np.where(centers >= 0, centers / pm, -centers / nm), self._hist[i:i + chunk]
+
+    def significance(self):
+        """Compute nominal pvals, normalized ES, and FDR q value, see :func:`gsea_significance`.
+
+        :return: zipped results of es, nes, pval, fdr.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            es = self.es
+            pvals = np.where(es < 0, self.exceed / self.neg_num, self.exceed / self.pos_num)
+            pos_mean = self.pos_sum / self.nperm
+            neg_mean = self.neg_sum / self.nperm
+            nes = np.where(es >= 0, es / pos_mean, -es / neg_mean)
+            # null NES beyond observed NES, accumulated block by block
+            higher = np.zeros(len(es))
+            for vals, counts in self._null_nes(pos_mean, neg_mean):
+                vals = vals.ravel()
+                counts = np.ones(len(vals)) if counts is None else counts.ravel()
+                order = np.argsort(vals, kind='mergesort')
+                vals, cumcnt = vals[order], np.r_[0, np.cumsum(counts[order])]
+                higher += np.where(nes >= 0, cumcnt[-1] - cumcnt[np.searchsorted(vals, nes, side='left')],
+                                             cumcnt[np.searchsorted(vals, nes, side='right')])
+            all_pos = np.where(nes >= 0, self.pos_num.sum(), self.neg_num.sum())
+            nnes = np.sort(nes)
+            nes_pos = np.where(nes >= 0, len(nnes) - np.searchsorted(nnes, 0, side='left'),
+                                         np.searchsorted(nnes, 0, side='left'))
+            nes_higher = np.where(nes >= 0, len(nnes) - np.searchsorted(nnes, nes, side='left'),
+                                            np.searchsorted(nnes, nes, side='right'))
+            fdrs = (higher / all_pos) / (nes_higher / nes_pos)
+        fdrs = np.where(fdrs < 1, fdrs, 1.0)
+        # zero division
+        fdrs[(all_pos == 0) | (nes_pos == 0) | (nes_higher == 0)] = 1000000000.0
+
+        return zip(es, nes, pvals.tolist(), fdrs.tolist())
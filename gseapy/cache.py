@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Managed on-disk cache for downloaded gene set libraries, library catalogues
+and background gene tables.
+
+Files are written to a temp file and renamed into place, so readers never see a
+partial file. Every file is recorded in a manifest with its checksum, size, version
+and date. A file whose checksum doesn't match is dropped and downloaded again.
+The least recently used files are evicted when the cache grows larger than max_size.
+
+Parsed and size-filtered libraries are also kept in memory by :data:`LIBRARY_MEMO`,
+so repeated runs in one process skip parsing and filtering.
+"""
+
+import os, sys, json, time, hashlib, logging, tempfile, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from gseapy.utils import mkdirs, get_cache_path, CACHE_MAX_SIZE, MEMO_MAX_SIZE
+
+try:
+    import fcntl
+except ImportError: # windows
+    fcntl = None
+
+
+class GeneSetCache(object):
+    """Managed gene set cache.
+
+    :param root: cache directory. Default: :func:`gseapy.utils.get_cache_path`.
+    :param max_size: max total size in bytes. Default: gseapy.utils.CACHE_MAX_SIZE.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root=None, max_size=None):
+        self.root = get_cache_path() if root is None else root
+        self.max_size = CACHE_MAX_SIZE if max_size is None else max_size
+        self._manifest = os.path.join(self.root, self.MANIFEST)
+
+    def path(self, name):
+        """file path of an item, whether it is cached or not"""
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def lock(self, shared=False):
+        """lock of the cache, shared by all processes.
+
+        :param shared: a shared lock for readers, instead of the exclusive lock for writers.
+                       Readers of a read-only cache go without a lock.
+        """
+        lockfile = os.path.join(self.root, ".lock")
+        if shared:
+            try:
+                f = open(lockfile, "a" if os.access(self.root, os.W_OK) else "r")
+            except OSError:
+                yield
+                return
+        else:
+            mkdirs(self.root)
+            f = open(lockfile, "a")
+        with f:
+            if fcntl is not None: fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None: fcntl.flock(f, fcntl.LOCK_UN)
+
+    def manifest(self):
+        """return the manifest, a dict of name -> {sha256, size, version, date, atime}"""
+        try:
+            with open(self._manifest) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".manifest.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self._manifest)
+
+    def info(self, name):
+        """return manifest entry of an item, or None"""
+        return self.manifest().get(name)
+
+    def get(self, name, verify=True):
+        """return file path of a cached item, or None if it's not cached or broken.
+
+        :param name: file name of the item.
+        :param verify: check size and checksum against the manifest.
+        """
+        path = self.path(name)
+        # a writer can't replace the file while it is checked
+        with self.lock(shared=True):
+            entry = self.info(name)
+            if entry is None or not os.path.isfile(path):
+                return
+            broken = verify and (os.path.getsize(path) != entry['size'] or _sha256(path) != entry['sha256'])
+        if broken:
+            logging.warning("Cached file %s is broken, it will be downloaded again." % path)
+            try:
+                self.remove(name, entry=entry)
+            except OSError:
+                pass
+            return
+        # best effort, the cache may be read-only
+        try:
+            with self.lock():
+                manifest = self.manifest()
+                if name in manifest:
+                    manifest[name]['atime'] = time.time()
+                    self._save_manifest(manifest)
+        except OSError:
+            pass
+        return path
+
+    def put(self, name, data, version=None):
+        """write an item to the cache.
+
+        :param name: file name of the item.
+        :param data: str, bytes, or an iterable of them, e.g. lines of a streamed response.
+        :param version: optional version string stored in the manifest.
+        :return: file path of the item.
+        """
+        mkdirs(self.root)
+        if isinstance(data, (str, bytes)): data = [data]
+        sha = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".%s." % name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in data:
+                    if isinstance(chunk, str): chunk = chunk.encode('utf-8')
+                    sha.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            with self.lock():
+                os.replace(tmp, self.path(name))
+                manifest = self.manifest()
+                manifest[name] = {'sha256': sha.hexdigest(),
+                                  'size': os.path.getsize(self.path(name)),
+                                  'version': version,
+                                  'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                                  'atime': time.time()}
+                self._evict(manifest, keep=name)
+                self._save_manifest(manifest)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+        return self.path(name)
+
+    def remove(self, name, entry=None):
+        """remove an item from the cache
+
+        :param entry: only remove the item if its manifest entry is still this one.
+        """
+        with self.lock():
+            manifest = self.manifest()
+            if entry is not None and manifest.get(name) != entry: return
+            manifest.pop(name, None)
+            if os.path.isfile(self.path(name)): os.remove(self.path(name))
+            self._save_manifest(manifest)
+
+    def size(self):
+        """total size in bytes of all cached items"""
+        return sum(e['size'] for e in self.manifest().values())
+
+    def _evict(self, manifest, keep=None):
+        """remove least recently used items until the cache fits in max_size"""
+        total = sum(e['size'] for e in manifest.values())
+        for name in sorted(manifest, key=lambda n: manifest[n]['atime']):
+            if total <= self.max_size: break
+            if name == keep: continue
+            total -= manifest.pop(name)['size']
+            if os.path.isfile(self.path(name)): os.remove(self.path(name))
+            logging.info("Evicted %s from gseapy cache" % name)
+
+
+def library_file(library, organism='Enrichr'):
+    """cache file name of an Enrichr library.
+
+    :param library: Enrichr library name.
+    :param organism: Enrichr organism path, e.g. 'Enrichr', 'FlyEnrichr'.
+    """
+    if organism == 'Enrichr': return "enrichr.%s.gmt" % library
+    return "%s.%s.gmt" % (organism, library)
+
+
+class LibraryMemo(object):
+    """In-process LRU memo of parsed and filtered gene set libraries.
+
+    :param max_size: max total size in bytes of memoized items. Default: gseapy.utils.MEMO_MAX_SIZE.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = MEMO_MAX_SIZE if max_size is None else max_size
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return a memoized item, or None"""
+        with self._lock:
+            if key not in self._items: return
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """memoize an item. Items larger than max_size are not kept.
+
+        :param key: hashable key.
+        :param value: the item.
+        :param nbytes: size of the item in bytes. Default: estimated by :func:`geneset_nbytes`.
+        """
+        nbytes = geneset_nbytes(value) if nbytes is None else nbytes
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+            if nbytes > self.max_size: return
+            self._items[key] = (value, nbytes)
+            self._size += nbytes
+            # least recently used first
+            while self._size > self.max_size:
+                self._size -= self._items.popitem(last=False)[1][1]
+
+    def clear(self):
+        """drop all items"""
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def size(self):
+        """total size in bytes of memoized items"""
+        return self._size
+
+
+def geneset_nbytes(value):
+    """estimated memory size in bytes of a gene set dict, or a tuple or list holding one,
+       e.g. a library with its encoding from :func:`gseapy.stats.encode_gene_sets`.
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(geneset_nbytes(v) for v in value)
+    if hasattr(value, 'indptr'):
+        # scipy sparse matrix
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if not isinstance(value, dict):
+        return sys.getsizeof(value)
+    size = sys.getsizeof(value)
+    for term, genes in value.items():
+        size += sys.getsizeof(term) + sys.getsizeof(genes)
+        size += sum(sys.getsizeof(g) for g in genes)
+    return size
+
+
+# shared by all GSEA runs of this process
+LIBRARY_MEMO = LibraryMemo()
+
+
+def _sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -3,18 +3,114 @@
 # see: http://amp.pharm.mssm.edu/Enrichr/help#api for API docs
 
 import sys, json, os, logging
-import requests
 import pandas as pd
 from io import StringIO
 from collections import OrderedDict
-from pkg_resources import resource_filename
 from time import sleep
 from tempfile import TemporaryDirectory
+from joblib import Parallel, delayed
+import numpy as np
 from numpy import isscalar
-from gseapy.plot import barplot
-from gseapy.parser import Biomart
+from gseapy.parser import enrichr_library_catalog, get_background_index, IDMapper
 from gseapy.utils import *
-from gseapy.stats import calc_pvalues, multiple_testing_correction
+from gseapy.cache import GeneSetCache, LIBRARY_MEMO, library_file
+from gseapy.stats import calc_pvalues, calc_pvalues_batch, multiple_testing_correction, odds_ratio, encode_gene_sets
+
+
+class EnrichrClient(object):
+    """Enrichr API client. All requests share one pooled keep-alive session,
+       exports of several libraries are fetched concurrently.
+
+    :param organism: Enrichr organism path, e.g. 'Enrichr', 'FlyEnrichr'.
+    :param url: Enrichr server url.
+    :param processes: max number of concurrent requests.
+    :param retries: max retries of each request.
+    :param backoff_factor: sleep [backoff_factor, 2*backoff_factor, 4*backoff_factor, ...]
+                           between retries.
+    :param timeout: seconds to wait for the server.
+    """
+    def __init__(self, organism='Enrichr', url=ENRICHR_URL, processes=1,
+                 retries=5, backoff_factor=0.5, timeout=60):
+        self.organism = organism
+        self.url = url.rstrip("/")
+        self.processes = max(int(processes), 1)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.session = retry(num=retries, backoff_factor=backoff_factor, pool=self.processes)
+
+    def _url(self, endpoint):
+        return "%s/%s/%s" % (self.url, self.organism, endpoint)
+
+    def get_libraries(self):
+        """return active enrichr library name."""
+        response = self.session.get(self._url('datasetStatistics'), timeout=self.timeout)
+        if not response.ok:
+            raise Exception("Error getting the Enrichr libraries")
+        libs_json = json.loads(response.text)
+        return sorted([lib['libraryName'] for lib in libs_json['statistics']])
+
+    def add_list(self, gene_list, description=''):
+        """send gene list to enrichr server
+
+        :param str gene_list: genes, one per line.
+        :return: job id dict, with userListId and shortId.
+        """
+        payload = {
+          'list': (None, gene_list),
+          'description': (None, description)
+           }
+        response = self.session.post(self._url('addList'), files=payload, timeout=self.timeout)
+        if not response.ok:
+            raise Exception('Error analyzing gene list')
+        return json.loads(response.text)
+
+    def view(self, user_list_id):
+        """return the genes of a submitted gene list"""
+        response = self.session.get(self._url('view'), params={'userListId': user_list_id},
+                                    timeout=self.timeout)
+        if not response.ok:
+            raise Exception('Error getting gene list back')
+        return json.loads(response.text)["genes"]
+
+    def get_library(self, library):
+        """download an enrichr library.
+
+        :return: gmt text, genes may carry a weight, e.g. 'GENE,1.0'.
+        """
+        response = self.session.get(self._url('geneSetLibrary'),
+                                    params={'mode': 'text', 'libraryName': library},
+                                    timeout=self.timeout)
+        if not response.ok:
+            raise Exception('Error fetching enrichr library: %s' % library)
+        response.encoding = 'utf-8'
+        return response.text
+
+    def export(self, user_list_id, library, filename):
+        """fetch enrichment table of one library. The list may not be ready right after
+           :meth:`add_list`, so empty or failed responses are retried with back-off.
+
+        :return: a DataFrame, or None if the server never returned the table.
+        """
+        params = {'userListId': user_list_id, 'filename': filename, 'backgroundType': library}
+        for i in range(self.retries + 1):
+            response = self.session.get(self._url('export'), params=params, timeout=self.timeout)
+            response.encoding = 'utf-8'
+            if response.ok and response.text.strip():
+                return pd.read_csv(StringIO(response.text), sep="\t")
+            if i < self.retries: sleep(self.backoff_factor * 2**i)
+        return
+
+    def export_all(self, user_list_id, libraries, description=''):
+        """fetch enrichment tables of several libraries concurrently.
+
+        :return: a list of DataFrames (or None), the same order as libraries.
+        """
+        filenames = ["%s.%s.reports" % (lib, description) for lib in libraries]
+        if self.processes == 1 or len(libraries) < 2:
+            return [self.export(user_list_id, lib, f) for lib, f in zip(libraries, filenames)]
+        return Parallel(n_jobs=min(self.processes, len(libraries)), backend='threading')(
+                        delayed(self.export)(user_list_id, lib, f) for lib, f in zip(libraries, filenames))
 
 
 class Enrichr(object):
@@ -22,7 +118,7 @@ class Enrichr(object):
     def __init__(self, gene_list, gene_sets, organism='human', descriptions='',
                  outdir='Enrichr', cutoff=0.05, background='hsapiens_gene_ensembl',
                  format='pdf', figsize=(6.5,6), top_term=10, no_plot=False, 
-                 verbose=False):
+                 verbose=False, processes=1, offline=False, id_map=None):
 
         self.gene_list = gene_list
         self.gene_sets = gene_sets
@@ -36,7 +132,11 @@ class Enrichr(object):
         self.verbose = bool(verbose)
         self.module = "enrichr"
         self.res2d = None
-        self._processes = 1
+        self._processes = processes
+        self.offline = offline
+        self.id_map = id_map
+        self.url = ENRICHR_URL
+        self._client = None
         self.background = background
         self._bg = None
         self.organism = organism
@@ -70,6 +170,7 @@ class Enrichr(object):
 
     def parse_genesets(self):
         """parse gene_sets input file type"""
+        if self._organism is None: self.get_organism()
 
         
         if isinstance(self.gene_sets, list):
@@ -90,22 +191,28 @@ class Enrichr(object):
         # if gss contains .gmt, dict, enrichr_liraries.
         # convert .gmt to dict
         gss_exist = [] 
-        enrichr_library = self.get_libraries()
+        enrichr_library = None
         for g in gss:
             if isinstance(g, dict): 
                 gss_exist.append(g)
                 continue
 
             if isinstance(g, str): 
-                if g in enrichr_library: 
-                    gss_exist.append(g)
-                    continue
                 if g.lower().endswith(".gmt") and os.path.exists(g):
                     self._logger.info("User Defined gene sets is given: %s"%g)
                     with open(g) as genesets:
                         g_dict = { line.strip().split("\t")[0]: line.strip().split("\t")[2:]
                                         for line in genesets.readlines() }
                     gss_exist.append(g_dict)
+                    continue
+                # library already downloaded, no need to look up the catalogue
+                if GeneSetCache().get(library_file(g, self._organism)) is not None:
+                    gss_exist.append(g)
+                    continue
+                if enrichr_library is None:
+                    enrichr_library = self.get_libraries()
+                if g in enrichr_library: 
+                    gss_exist.append(g)
         return gss_exist
 
     def parse_genelists(self):
@@ -129,6 +236,9 @@ class Enrichr(object):
             with open(self.gene_list) as f:
                 for gene in f:
                     genes.append(gene.strip())
+        # bed files and weighted gene lists are not converted
+        if self.id_map is not None and not any(("\t" in g or "," in g) for g in map(str, genes)):
+            genes = self.map_ids(genes)
 
         self._isezid = all(map(self._is_entrez_id, genes))
         if self._isezid: 
@@ -138,52 +248,71 @@ class Enrichr(object):
 
         return '\n'.join(genes)
 
-    def send_genes(self, gene_list, url):
+    def map_ids(self, genes):
+        """convert gene ids with the local id mapping index, see :class:`gseapy.parser.IDMapper`.
+           genes not found are dropped.
+        """
+        mapper = self.id_map if isinstance(self.id_map, IDMapper) else IDMapper(target=self.id_map)
+        mapped = [str(g) for g in mapper.convert_genes(genes)]
+        self._logger.info("%s of %s gene ids are converted to %s ids."%(len(mapped), len(genes), mapper.target))
+        return mapped
+
+    def get_client(self):
+        """pooled Enrichr client, shared by all requests of this object"""
+        if self._client is None:
+            self._client = EnrichrClient(organism=self._organism, url=self.url,
+                                         processes=self._processes)
+        return self._client
+
+    def send_genes(self, gene_list, url=None):
         """ send gene list to enrichr server"""
-        payload = {
-          'list': (None, gene_list),
-          'description': (None, self.descriptions)
-           }
-        # response
-        response = requests.post(url, files=payload)
-        if not response.ok:
-            raise Exception('Error analyzing gene list')
-        sleep(1)
-        job_id = json.loads(response.text)
-
+        job_id = self.get_client().add_list(gene_list, self.descriptions)
         return job_id
 
     def check_genes(self, gene_list, usr_list_id):
         '''
         Compare the genes sent and received to get successfully recognized genes
         '''
-        response = requests.get('http://amp.pharm.mssm.edu/%s/view?userListId=%s' %(self._organism, usr_list_id))
-        if not response.ok:
-            raise Exception('Error getting gene list back')
-        returnedL = json.loads(response.text)["genes"]
+        returnedL = set(self.get_client().view(usr_list_id))
         returnedN = sum([1 for gene in gene_list if gene in returnedL])
         self._logger.info('{} genes successfully recognized by Enrichr'.format(returnedN))
 
     def get_results(self, gene_list):
         """Enrichr API"""
-        ADDLIST_URL = 'http://amp.pharm.mssm.edu/%s/addList'%self._organism
-        job_id = self.send_genes(gene_list, ADDLIST_URL)
-        user_list_id = job_id['userListId']
-
-        RESULTS_URL = 'http://amp.pharm.mssm.edu/%s/export'%self._organism
-        query_string = '?userListId=%s&filename=%s&backgroundType=%s'
-        # set max retries num =5
-        s = retry(num=5)
+        job_id = self.send_genes(gene_list)
         filename = "%s.%s.reports" % (self._gs, self.descriptions)
-        url = RESULTS_URL + query_string % (user_list_id, filename, self._gs)
-        response = s.get(url, stream=True)
-        response.encoding = 'utf-8'
-        if not response.ok:
+        res = self.get_client().export(job_id['userListId'], self._gs, filename)
+        if res is None:
             self._logger.error('Error fetching enrichment results: %s'%self._gs)
-        
-        res = pd.read_csv(StringIO(response.text), sep="\t")
         return [job_id['shortId'], res]
 
+    def load_library(self, library, encoded=False):
+        """return gmt dict of an enrichr library. The library is downloaded only once,
+           then read from the gene set cache. Parsed libraries and their encoding are
+           memoized in :data:`gseapy.cache.LIBRARY_MEMO`.
+
+        :param encoded: if True, return the gmt dict and its encoding from
+                        :func:`gseapy.stats.encode_gene_sets`.
+        """
+        name = library_file(library, self._organism)
+        cache = GeneSetCache()
+        path = cache.get(name)
+        if path is None:
+            self._logger.info("Downloading Enrichr library: %s" % library)
+            lines = self.get_client().get_library(library).splitlines()
+            lines = ["%s\t\t%s\n" % (l.split("\t")[0], "\t".join(g.split(",")[0] for g in l.split("\t")[2:] if g))
+                     for l in lines if l.strip()]
+            path = cache.put(name, lines, version=library)
+        key = ("encoded", name, cache.info(name)['sha256'])
+        memo = LIBRARY_MEMO.get(key)
+        if memo is None:
+            with open(path) as genesets:
+                gmt = { line.strip().split("\t")[0]: line.strip().split("\t")[2:]
+                        for line in genesets.readlines() }
+            memo = (gmt, encode_gene_sets(gmt))
+            LIBRARY_MEMO.put(key, memo)
+        return memo if encoded else memo[0]
+
     def _is_entrez_id(self, idx):
         try:
             int(idx)
@@ -194,14 +323,8 @@ class Enrichr(object):
     def get_libraries(self):
         """return active enrichr library name. Official API """
 
-        lib_url='http://amp.pharm.mssm.edu/%s/datasetStatistics'%self._organism
-        response = requests.get(lib_url)
-        if not response.ok:
-            raise Exception("Error getting the Enrichr libraries")
-        libs_json = json.loads(response.text)
-        libs = [lib['libraryName'] for lib in libs_json['statistics']]
- 
-        return sorted(libs)
+        return enrichr_library_catalog(self._organism, url=self.url,
+                                       fetch=self.get_client().get_libraries)
 
 
     def get_background(self):
@@ -214,28 +337,33 @@ class Enrichr(object):
             bg = [g.strip() for g in bg2]  
             return set(bg)
         
-        # package included data
-        DB_FILE = resource_filename("gseapy", "data/{}.background.genes.txt".format(self.background))
-        filename = os.path.join(DEFAULT_CACHE_PATH, "{}.background.genes.txt".format(self.background))  
-        if os.path.exists(filename):
-            df = pd.read_csv(filename,sep="\t")
-        elif os.path.exists(DB_FILE):
-            df = pd.read_csv(DB_FILE,sep="\t")
-        else:
-            # background is a biomart database name
-            self._logger.warning("Downloading %s for the first time. It might take a couple of miniutes."%self.background)
-            bm = Biomart()
-            df = bm.query(dataset=self.background)
-            df.dropna(subset=['go_id'], inplace=True)
+        # package included data, or biomart dataset, compiled to a sorted index once
+        idx = get_background_index(self.background)
         self._logger.info("using all annotated genes with GO_ID as background genes")
-        df.dropna(subset=['entrezgene'], inplace=True)     
         # input id type: entrez or gene_name
-        if self._isezid:
-            bg = df['entrezgene'].astype(int)
-        else:
-            bg = df['external_gene_name']
+        return idx['entrez'] if self._isezid else idx['symbol']
 
-        return set(bg)
+    def parse_background(self):
+        """parse background input, only loaded once for all libraries"""
+        if self._bg is not None: return self._bg
+
+        if isscalar(self.background):
+            if isinstance(self.background, int) or self.background.isdigit():
+                self._bg = int(self.background)
+            elif isinstance(self.background, str):
+                # self.background = set(reduce(lambda x,y: x+y, gmt.values(),[]))
+                self._bg = self.get_background()
+                self._logger.info("Background: found %s genes"%(len(self._bg)))
+            else:
+                raise Exception("Unsupported background data type")
+        else:
+            # handle array object: nd.array, list, tuple, set, Series
+            try:
+                it = iter(self.background)
+                self._bg = set(self.background)
+            except TypeError:
+                self._logger.error("Unsupported background data type")
+        return self._bg
 
     def get_organism(self):
         """Select Enrichr organism from below:
@@ -272,7 +400,7 @@ class Enrichr(object):
             raise Exception("No supported organism found !!!")
         return
 
-    def enrich(self, gmt):
+    def enrich(self, gmt, encoded=None):
         """use local mode
          
         p = p-value computed using the Fisher exact test (Hypergeometric test)  
@@ -288,25 +416,10 @@ class Enrichr(object):
             Term Overlap P-value Adjusted_P-value Genes
 
         """
-        if isscalar(self.background):
-            if isinstance(self.background, int) or self.background.isdigit():
-                self._bg = int(self.background)
-            elif isinstance(self.background, str):
-                # self.background = set(reduce(lambda x,y: x+y, gmt.values(),[]))
-                self._bg = self.get_background()
-                self._logger.info("Background: found %s genes"%(len(self._bg)))
-            else:
-                raise Exception("Unsupported background data type")
-        else:
-            # handle array object: nd.array, list, tuple, set, Series
-            try:
-                it = iter(self.background)
-                self._bg = set(self.background)
-            except TypeError:
-                self._logger.error("Unsupported background data type")
+        self.parse_background()
         # statistical testing
         hgtest = list(calc_pvalues(query=self._gls, gene_sets=gmt, 
-                                   background=self._bg))
+                                   background=self._bg, encoded=encoded))
         if len(hgtest) > 0:
             terms, pvals, olsz, gsetsz, genes = hgtest
             fdrs, rej = multiple_testing_correction(ps = pvals, 
@@ -319,6 +432,14 @@ class Enrichr(object):
             odict['P-value'] = pvals
             odict['Adjusted P-value'] = fdrs
             # odict['Reject (FDR< %s)'%self.cutoff ] = rej
+            if self.offline:
+                # same columns as the online export, old p-values are not available locally
+                bg = self._bg if isinstance(self._bg, int) else len(self._bg)
+                oddr = odds_ratio(olsz, gsetsz, len(self._gls), bg)
+                odict['Old P-value'] = np.nan
+                odict['Old Adjusted P-value'] = np.nan
+                odict['Odds Ratio'] = oddr
+                odict['Combined Score'] = -np.log(pvals) * oddr
             odict['Genes'] = [";".join(g) for g in genes]
             res = pd.DataFrame(odict)
             return res
@@ -338,8 +459,14 @@ class Enrichr(object):
             sys.stderr.write("Not validated Enrichr library name provided\n")
             sys.stdout.write("Hint: use get_library_name() to view full list of supported names")
             sys.exit(1)
-        self.results = pd.DataFrame()
-
+        ## online mode: submit gene list once, then fetch all libraries concurrently
+        online = [str(g) for g in gss if not isinstance(g, dict)]
+        if len(online) > 0 and not self.offline:
+            job_id = self.send_genes(genes_list)
+            self._logger.info('Analysis name: %s, Enrichr Library: %s' % (self.descriptions, ", ".join(online)))
+            exports = dict(zip(online, self.get_client().export_all(job_id['userListId'], online,
+                                                                    self.descriptions)))
+        results = []
         for g in gss: 
             if isinstance(g, dict): 
                 ## local mode
@@ -348,16 +475,25 @@ class Enrichr(object):
                 if res is None: 
                     self._logger.info("No hits return, for gene set: Custom%s"%shortID)
                     continue
+            elif self.offline:
+                ## offline mode, enrichr library is tested locally
+                self._gs = str(g)
+                self._logger.info('Analysis name: %s, Enrichr Library: %s, offline' % (self.descriptions, self._gs))
+                shortID, res = "offline", self.enrich(*self.load_library(self._gs, encoded=True))
+                if res is None:
+                    self._logger.info("No hits return, for gene set: %s"%self._gs)
+                    continue
             else:
                 ## online mode
                 self._gs = str(g)
-                self._logger.debug("Start Enrichr using library: %s" % (self._gs))
-                self._logger.info('Analysis name: %s, Enrichr Library: %s' % (self.descriptions, self._gs))
-                shortID, res = self.get_results(genes_list)
+                shortID, res = job_id['shortId'], exports[self._gs]
+                if res is None:
+                    self._logger.error('Error fetching enrichment results: %s'%self._gs)
+                    continue
                 # Remember gene set library used
             res.insert(0, "Gene_set", self._gs)
             # Append to master dataframe
-            self.results = self.results.append(res, ignore_index=True)
+            results.append(res)
             self.res2d = res
             if self._outdir is None: continue
             self._logger.info('Save file of enrichment results: Job Id:' + str(shortID))
@@ -365,12 +501,142 @@ class Enrichr(object):
             self.res2d.to_csv(outfile, index=False, encoding='utf-8', sep="\t")
             # plotting
             if not self.__no_plot:
+                from gseapy.plot import barplot
                 msg = barplot(df=res, cutoff=self.cutoff, figsize=self.figsize,
                               top_term=self.__top_term, color='salmon',
                               title=self._gs,
                               ofname=outfile.replace("txt", self.format))
                 if msg is not None : self._logger.warning(msg)
             self._logger.info('Done.\n')
+        self.results = pd.concat(results, ignore_index=True) if len(results) > 0 else pd.DataFrame()
+        # clean up tmpdir
+        if self._outdir is None: self._tmpdir.cleanup()
+
+        return
+
+
+class EnrichrBatch(Enrichr):
+    """Enrichr local mode for many gene lists against the same libraries"""
+    def __init__(self, gene_lists, gene_sets, organism='human', descriptions='',
+                 outdir='Enrichr', cutoff=0.05, background='hsapiens_gene_ensembl',
+                 verbose=False, id_map=None):
+
+        Enrichr.__init__(self, None, gene_sets, organism, descriptions, outdir,
+                         cutoff, background, no_plot=True, verbose=verbose, id_map=id_map)
+        self.gene_lists = gene_lists
+        self.results = None
+
+    def parse_genelists(self):
+        """parse named gene lists.
+
+        :return: an OrderedDict of gene list name -> genes.
+        """
+        if isinstance(self.gene_lists, dict):
+            gls = OrderedDict((str(k), list(v)) for k, v in self.gene_lists.items())
+        elif isinstance(self.gene_lists, pd.DataFrame):
+            # long table, first column is gene list name, second column is gene
+            df = self.gene_lists.iloc[:, :2].dropna()
+            gls = OrderedDict((str(k), v.tolist())
+                              for k, v in df.groupby(df.columns[0], sort=False)[df.columns[1]])
+        elif isinstance(self.gene_lists, str) and self.gene_lists.lower().endswith(".gmt"):
+            with open(self.gene_lists) as f:
+                gls = OrderedDict((line.strip().split("\t")[0], line.strip().split("\t")[2:])
+                                  for line in f if line.strip())
+        elif isinstance(self.gene_lists, str) and os.path.isfile(self.gene_lists):
+            self.gene_lists = pd.read_csv(self.gene_lists, sep="\t")
+            return self.parse_genelists()
+        else:
+            raise Exception("Error parsing gene lists, please provide a dict, a long table or a gmt file")
+
+        gls = OrderedDict((k, [str(g).strip() for g in v if str(g).strip()]) for k, v in gls.items())
+        if self.id_map is not None:
+            gls = OrderedDict((k, self.map_ids(v)) for k, v in gls.items())
+        self._isezid = all(self._is_entrez_id(g) for v in gls.values() for g in v)
+        if self._isezid:
+            gls = OrderedDict((k, list(map(int, v))) for k, v in gls.items())
+        self._logger.info("Found %s gene lists" % len(gls))
+        return gls
+
+    def load_genesets(self):
+        """load each library only once.
+
+        :return: an OrderedDict of library name -> (gmt dict, encoding or None).
+        """
+        libs = OrderedDict()
+        for g in self.parse_genesets():
+            if isinstance(g, dict):
+                libs["CUSTOM%s"%id(g)] = (g, None)
+            else:
+                # enrichr library, download the gmt once
+                libs[g] = self.load_library(g, encoded=True)
+        return libs
+
+    def enrich(self, gls, gmt, encoded=None):
+        """use local mode for all gene lists against one library
+
+        :param gls: an OrderedDict of gene list name -> genes.
+        :param gmt: gmt dict.
+        :param encoded: optional, output of :func:`gseapy.stats.encode_gene_sets` for gmt.
+        :return: a DataFrame, the first column is the name of gene list.
+                 Other columns are the same as :meth:`Enrichr.enrich`.
+        """
+        names = list(gls.keys())
+        hgtest = list(calc_pvalues_batch(queries=list(gls.values()), gene_sets=gmt,
+                                         background=self.parse_background(), encoded=encoded))
+        if len(hgtest) == 0: return
+        qidx, terms, pvals, olsz, gsetsz, genes = hgtest
+        # adjusted p-values of each gene list
+        fdrs = np.empty_like(pvals)
+        for idx in np.split(np.arange(len(qidx)), np.flatnonzero(np.diff(qidx)) + 1):
+            fdrs[idx], rej = multiple_testing_correction(ps=pvals[idx],
+                                                         alpha=self.cutoff,
+                                                         method='benjamini-hochberg')
+        odict = OrderedDict()
+        odict['Gene_list'] = [names[i] for i in qidx]
+        odict['Term'] = terms
+        odict['Overlap'] = list(map(lambda h,g: "%s/%s"%(h, g), olsz, gsetsz))
+        odict['P-value'] = pvals
+        odict['Adjusted P-value'] = fdrs
+        odict['Genes'] = [";".join(g) for g in genes]
+        res = pd.DataFrame(odict)
+        res.insert(0, "_order", qidx)
+        return res
+
+    def run(self):
+        """run enrichr local mode for all gene lists and all libraries"""
+
+        # set organism
+        self.get_organism()
+        gls = self.parse_genelists()
+        libs = self.load_genesets()
+        if len(libs) < 1:
+            sys.stderr.write("Not validated Enrichr library name provided\n")
+            sys.stdout.write("Hint: use get_library_name() to view full list of supported names")
+            sys.exit(1)
+
+        results = []
+        for gs, (gmt, encoded) in libs.items():
+            self._logger.info('Analysis name: %s, Enrichr Library: %s, %s gene lists' % (self.descriptions, gs, len(gls)))
+            res = self.enrich(gls, gmt, encoded)
+            if res is None:
+                self._logger.info("No hits return, for gene set: %s"%gs)
+                continue
+            res.insert(2, "Gene_set", gs)
+            results.append(res)
+        # one long table, sorted by gene list, then library
+        if len(results) > 0:
+            res = pd.concat(results, ignore_index=True)
+            res = res.iloc[np.argsort(res['_order'].values, kind='mergesort')]
+            self.results = res.drop('_order', axis=1).reset_index(drop=True)
+        else:
+            self.results = pd.DataFrame(columns=['Gene_list', 'Gene_set', 'Term', 'Overlap', 'P-value',
+                                                 'Adjusted P-value', 'Genes'])
+        self.res2d = self.results
+        if self._outdir is not None:
+            outfile = "%s/%s.%s.batch.reports.txt" % (self.outdir, self.descriptions, self.module)
+            self._logger.info('Save file of enrichment results: %s' % outfile)
+            self.results.to_csv(outfile, index=False, encoding='utf-8', sep="\t")
+        self._logger.info('Done.\n')
         # clean up tmpdir
         if self._outdir is None: self._tmpdir.cleanup()
 
@@ -379,7 +645,8 @@ class Enrichr(object):
 
 def enrichr(gene_list, gene_sets, organism='human', description='',
             outdir='Enrichr', background='hsapiens_gene_ensembl', cutoff=0.05,
-            format='pdf', figsize=(8,6), top_term=10, no_plot=False, verbose=False):
+            format='pdf', figsize=(8,6), top_term=10, no_plot=False, verbose=False,
+            processes=1, offline=False, id_map=None):
     """Enrichr API.
 
     :param gene_list: Flat file with list of genes, one gene id per row, or a python list object
@@ -408,13 +675,52 @@ def enrichr(gene_list, gene_sets, organism='human', description='',
     :param list figsize: Matplotlib figsize, accept a tuple or list, e.g. (width,height). Default: (6.5,6).
     :param bool no_plot: If equals to True, no figure will be drawn. Default: False.
     :param bool verbose: Increase output verbosity, print out progress of your job, Default: False.
+    :param int processes: Max number of libraries fetched concurrently from the Enrichr server.
+                          The gene list is only submitted once. Default: 1.
+    :param bool offline: Test Enrichr libraries locally instead of on the Enrichr server.
+                         Libraries are downloaded once into the gene set cache, then tested
+                         against background. Results have the same columns as online mode,
+                         but 'Old P-value' and 'Old Adjusted P-value' are empty. Default: False.
+    :param id_map: Convert gene ids of gene_list before the analysis, with the local id mapping index
+                   of BioMart tables. A target id type, 'symbol', 'entrez' or 'ensembl', or a
+                   :class:`gseapy.parser.IDMapper` object. Genes not found are dropped. Default: None.
 
     :return: An Enrichr object, which obj.res2d stores your last query, obj.results stores your all queries.
     
     """
     enr = Enrichr(gene_list, gene_sets, organism, description, outdir,
-                  cutoff, background, format, figsize, top_term, no_plot, verbose)
+                  cutoff, background, format, figsize, top_term, no_plot, verbose, processes, offline, id_map)
     enr.run()
 
     return enr
 
+
+
+def enrichr_batch(gene_lists, gene_sets, organism='human', description='',
+                  outdir='Enrichr', background='hsapiens_gene_ensembl', cutoff=0.05,
+                  verbose=False, id_map=None):
+    """Enrichr local mode for many gene lists. Each library and the background are only
+       loaded once, and all gene lists are tested against a library in one pass.
+
+    :param gene_lists: Named gene lists. Accepts a dict of name -> list of genes, a gmt file (one
+                       gene list per row), or a DataFrame or tab-delimited file with a header,
+                       whose first column is the gene list name and second column is the gene.
+    :param gene_sets: Enrichr Library name(s), gmt file(s) or a dict. Separate each name by comma.
+    :param organism: Enrichr supported organism. Select from (human, mouse, yeast, fly, fish, worm).
+    :param description: name of analysis. optional.
+    :param outdir: Output file directory
+    :param float cutoff: Alpha for the Benjamini-Hochberg correction. Default: 0.05
+    :param background: BioMart dataset name, a set of genes or the total genes number.
+                       See :func:`enrichr`.
+    :param bool verbose: Increase output verbosity, print out progress of your job, Default: False.
+    :param id_map: Convert gene ids of all gene lists before the analysis, see :func:`enrichr`.
+
+    :return: An EnrichrBatch object, obj.results stores one long table of all gene lists and libraries.
+             Adjusted P-values are computed for each gene list and library.
+
+    """
+    enr = EnrichrBatch(gene_lists, gene_sets, organism, description, outdir,
+                       cutoff, background, verbose, id_map)
+    enr.run()
+
+    return enr
@@ -1,7 +1,8 @@
 #! python
 # -*- coding: utf-8 -*-
 
-import os, sys, logging, json, glob
+import os, sys, logging, json, glob, hashlib
+from itertools import combinations
 from collections import OrderedDict
 from multiprocessing import Pool, cpu_count
 from tempfile import TemporaryDirectory
@@ -9,12 +10,40 @@ from joblib import delayed, Parallel
 from numpy import log, exp
 import numpy as np
 import pandas as pd
-import requests
 from gseapy.algorithm import enrichment_score, gsea_compute, ranking_metric
-from gseapy.algorithm import enrichment_score_tensor, gsea_compute_tensor
-from gseapy.parser import gsea_edb_parser, gsea_cls_parser
-from gseapy.plot import gseaplot, heatmap
-from gseapy.utils import mkdirs, log_init, retry, DEFAULT_LIBRARY, DEFAULT_CACHE_PATH
+from gseapy.algorithm import running_enrichment_score, enrichment_score_peak
+from gseapy.algorithm import enrichment_score_tensor, gsea_compute_tensor, ssgsea_compute_permu
+from gseapy.algorithm import collapse_dataset, gsea_compute_multi, gsea_compute_contrasts
+from gseapy.algorithm import ranking_metric_continuous, phenotype_permutations, CONTINUOUS_METHODS
+from gseapy.parser import gsea_edb_iterparser, gsea_cls_parser, enrichr_library_catalog, IDMapper
+from gseapy.parser import gsea_chip_parser
+from gseapy.utils import mkdirs, log_init, retry, unique, DEFAULT_LIBRARY
+from gseapy.cache import GeneSetCache, LIBRARY_MEMO, library_file
+
+
+def _plot_term(rank_metric, term, hit_indices, nes, pval, fdr, RES, pheno_pos, pheno_neg,
+               figsize, ofname, weighted_score_type=1, scale=False, heatmat=None, ofname2=None,
+               pdf=None):
+    """Render figures of one term. Used by the parallel plotting stage.
+
+    :param RES: running enrichment score. If None, recompute it from rank_metric and hit_indices.
+    :param heatmat: expression values of the hit genes. If not None, draw heatmap to ofname2.
+    :param pdf: PdfPages object. If given, figures are appended to it instead of ofname, ofname2.
+    """
+    # matplotlib is only imported when figures are drawn
+    from gseapy.plot import gseaplot, heatmap
+    if RES is None:
+        RES = running_enrichment_score(rank_metric.values, hit_indices, weighted_score_type, scale)
+    gseaplot(rank_metric=rank_metric, term=term, hit_indices=hit_indices,
+             nes=nes, pval=pval, fdr=fdr, RES=RES,
+             pheno_pos=pheno_pos, pheno_neg=pheno_neg, figsize=figsize,
+             ofname=ofname, pdf=pdf)
+    if heatmat is not None:
+        width = np.clip(heatmat.shape[1], 4, 20)
+        height = np.clip(heatmat.shape[0], 4, 20)
+        heatmap(df=heatmat, title=term, ofname=ofname2,
+                z_score=0, figsize=(width, height),
+                xticklabels=True, yticklabels=True, pdf=pdf)
 
 
 class GSEAbase(object):
@@ -29,11 +58,18 @@ class GSEAbase(object):
         self.ranking=None
         self.ascending=False
         self.verbose=False
+        self.lazy_res=False
+        self.null_mode=None
+        self.report=None
+        self.id_map=None
+        self.chip=None
+        self.collapse='max'
         self._processes=1
         self._logger=None
 
     def prepare_outdir(self):
         """create temp directory."""
+        self._check_report()
         self._outdir = self.outdir
         if self._outdir is None:
             self._tmpdir = TemporaryDirectory()
@@ -54,10 +90,15 @@ class GSEAbase(object):
         logfile = os.path.join(self.outdir, "gseapy.%s.%s.log" % (self.module, _gset))
         return logfile
 
+    def _check_report(self):
+        """check report output mode"""
+        if self.report not in (None, 'pdf', 'html'):
+            raise Exception("report should be one of None, 'pdf', 'html'. Got: %s"%self.report)
+
     def _set_cores(self):
         """set cpu numbers to be used"""
 
-        cpu_num = cpu_count()-1
+        cpu_num = max(cpu_count()-1, 1)
         if self._processes > cpu_num:
             cores = cpu_num
         elif self._processes < 1:
@@ -95,6 +136,12 @@ class GSEAbase(object):
             NAs = rank_metric[rank_metric.isnull().any(axis=1)]
             self._logger.debug('NAs list:\n'+NAs.to_string())
             rank_metric.dropna(how='any', inplace=True)
+        # convert gene ids, values of ids mapped to the same gene are collapsed
+        if self.id_map is not None:
+            mapper = self.id_map if isinstance(self.id_map, IDMapper) else IDMapper(target=self.id_map)
+            nids = len(rank_metric)
+            rank_metric = mapper.convert_ranking(rank_metric, ascending=self.ascending)
+            self._logger.info("%s of %s gene ids are converted to %s ids."%(len(rank_metric), nids, mapper.target))
         # drop duplicate IDs, keep the first
         if rank_metric.duplicated(subset=rank_metric.columns[0]).sum() >0:
             self._logger.warning("Input gene rankings contains duplicated IDs, Only use the duplicated ID with highest value!")
@@ -110,16 +157,46 @@ class GSEAbase(object):
         # return series
         return rankser
 
+    def _collapse_data(self, df):
+        """collapse probe level expression data to gene level with the chip file."""
+        chip = gsea_chip_parser(self.chip)
+        nprobes = df.shape[0]
+        df = collapse_dataset(df, chip, mode=self.collapse)
+        self._logger.info("Collapsed %s probes to %s genes, mode: %s"%(nprobes, df.shape[0], self.collapse))
+        if df.shape[0] == 0:
+            self._logger.error("No probes are found in the chip file!")
+            sys.exit(0)
+        return df
+
     def load_gmt(self, gene_list, gmt):
-        """load gene set dict"""
+        """load gene set dict.
+           Filtered libraries of gmt files and Enrichr libraries are memoized in memory,
+           keyed by the library, gene_list and size limits, see :data:`gseapy.cache.LIBRARY_MEMO`.
+           Parsed libraries are memoized too, so runs on other gene lists skip parsing.
+        """
+
+        lib_key = key = self._library_key(gmt)
+        if key is not None:
+            key += (self._universe_key(gene_list), self.min_size, self.max_size)
+            memo = LIBRARY_MEMO.get(key)
+            if memo is not None:
+                self._logger.info("Use filtered gene sets of %s from memory"%key[1])
+                self.n_genesets, genesets_dict = memo
+                self._gmtdct = dict(genesets_dict)
+                return self._gmtdct
 
         if isinstance(gmt, dict):
             genesets_dict = gmt
         elif isinstance(gmt, str):
-            genesets_dict = self.parse_gmt(gmt)
+            genesets_dict = LIBRARY_MEMO.get(lib_key) if lib_key is not None else None
+            if genesets_dict is None:
+                genesets_dict = self.parse_gmt(gmt)
+                if lib_key is not None: LIBRARY_MEMO.put(lib_key, dict(genesets_dict))
+            # filtering below removes terms, keep the memoized library intact
+            genesets_dict = dict(genesets_dict)
         else:
             raise Exception("Error parsing gmt parameter for gene sets")
-        
+
         subsets = list(genesets_dict.keys())
         self.n_genesets = len(subsets)
         for subset in subsets:
@@ -141,8 +218,29 @@ class GSEAbase(object):
             sys.exit(0)
 
         self._gmtdct=genesets_dict
+        if key is not None:
+            LIBRARY_MEMO.put(key, (self.n_genesets, dict(genesets_dict)))
         return genesets_dict
 
+    def _library_key(self, gmt):
+        """identity of a gene set library: path, mtime and size of a gmt file,
+           or name and checksum of a cached Enrichr library. None if it has no identity.
+        """
+        if not isinstance(gmt, str):
+            return
+        if gmt.lower().endswith(".gmt"):
+            if not os.path.isfile(gmt): return
+            st = os.stat(gmt)
+            return ("gmt", os.path.abspath(gmt), st.st_mtime_ns, st.st_size)
+        info = GeneSetCache().info(library_file(gmt))
+        if info is None: return
+        return ("enrichr", gmt, info['sha256'])
+
+    def _universe_key(self, gene_list):
+        """hash of the gene universe, independent of gene order"""
+        genes = np.sort(np.asarray(gene_list).astype(str))
+        return hashlib.sha1(genes.tobytes()).hexdigest()
+
     def parse_gmt(self, gmt):
         """gmt parser"""
 
@@ -160,11 +258,11 @@ class GSEAbase(object):
         #     self._logger.error("No supported gene_sets: %s"%gmt)
         #     sys.exit(0)
 
-        tmpname = "enrichr." + gmt + ".gmt"
-        tempath = os.path.join(DEFAULT_CACHE_PATH, tmpname)
+        tmpname = library_file(gmt)
+        tempath = GeneSetCache().get(tmpname)
         # if file already download
-        if os.path.isfile(tempath):
-            self._logger.info("Enrichr library gene sets already downloaded in: %s, use local file"%DEFAULT_CACHE_PATH)
+        if tempath is not None:
+            self._logger.info("Enrichr library gene sets already downloaded in: %s, use local file"%os.path.dirname(tempath))
             return self.parse_gmt(tempath)
         else:
             return self._download_libraries(gmt)
@@ -172,14 +270,7 @@ class GSEAbase(object):
     def get_libraries(self):
         """return active enrichr library name.Offical API """
 
-        lib_url='http://amp.pharm.mssm.edu/Enrichr/datasetStatistics'
-        response = requests.get(lib_url)
-        if not response.ok:
-            raise Exception("Error getting the Enrichr libraries")
-        libs_json = json.loads(response.text)
-        libs = [lib['libraryName'] for lib in libs_json['statistics']]
- 
-        return sorted(libs)
+        return enrichr_library_catalog('Enrichr')
 
     def _download_libraries(self, libname):
         """ download enrichr libraries."""
@@ -193,21 +284,31 @@ class GSEAbase(object):
         if not response.ok:
             raise Exception('Error fetching enrichment results, check internet connection first.')
         # reformat to dict and save to disk
-        mkdirs(DEFAULT_CACHE_PATH)
         genesets_dict = {}
-        outname = "enrichr.%s.gmt"%libname
-        gmtout = open(os.path.join(DEFAULT_CACHE_PATH, outname), "w")
-        for line in response.iter_lines(chunk_size=1024, decode_unicode='utf-8'):
-            line=line.strip()
-            k = line.split("\t")[0]
-            v = list(map(lambda x: x.split(",")[0], line.split("\t")[2:]))
-            genesets_dict.update({ k: v})
-            outline = "%s\t\t%s\n"%(k, "\t".join(v))
-            gmtout.write(outline)
-        gmtout.close()
+        outname = library_file(libname)
+        def _lines():
+            for line in response.iter_lines(chunk_size=1024, decode_unicode='utf-8'):
+                line=line.strip()
+                k = line.split("\t")[0]
+                v = list(map(lambda x: x.split(",")[0], line.split("\t")[2:]))
+                genesets_dict.update({ k: v})
+                yield "%s\t\t%s\n"%(k, "\t".join(v))
+        GeneSetCache().put(outname, _lines(), version=libname)
 
         return genesets_dict
 
+    def get_res(self, term):
+        """Running enrichment score of a term. Recomputed from rankings and hit indices
+           if RES is not kept (lazy_res=True).
+
+        :param term: gene set name in self.results.
+        :return: RES, ndarray.
+        """
+        rdict = self.results[term]
+        if rdict['RES'] is not None: return rdict['RES']
+        return running_enrichment_score(self.ranking.values, rdict['hit_indices'],
+                                        self.weighted_score_type)
+
     def _heatmat(self, df, classes, pheno_pos, pheno_neg):
         """only use for gsea heatmap"""
         
@@ -232,77 +333,113 @@ class GSEAbase(object):
         if self._outdir is None: return
         #Plotting
         top_term = self.res2d.index[:graph_num]
-        # multi-threading
-        #pool = Pool(self._processes)
+        NES = 'nes' if self.module != 'ssgsea' else 'es'
+        tasks = []
         for gs in top_term:
-            hit = results.get(gs)['hit_indices']
-            NES = 'nes' if self.module != 'ssgsea' else 'es'
+            rdict = results.get(gs)
+            hit = rdict['hit_indices']
             term = gs.replace('/','_').replace(":","_").replace(" ","_").replace("(","_").replace(")","_").replace("[","_").replace("]","_").replace(",","_")
             outfile = '{0}/{1}.{2}.{3}'.format(self.outdir, term, self.module, self.format)
-            gseaplot(rank_metric=rank_metric, term=term, hit_indices=hit,
-                      nes=results.get(gs)[NES], pval=results.get(gs)['pval'], 
-                      fdr=results.get(gs)['fdr'], RES=results.get(gs)['RES'],
-                      pheno_pos=pheno_pos, pheno_neg=pheno_neg, figsize=figsize,
-                      ofname=outfile)
-            # pool.apply_async(gseaplot, args=(rank_metric, term, hit, results.get(gs)[NES],
-            #                                   results.get(gs)['pval'],results.get(gs)['fdr'],
-            #                                   results.get(gs)['RES'],
-            #                                   pheno_pos, pheno_neg, 
-            #                                   figsize, 'seismic', outfile))
+            task = dict(rank_metric=rank_metric, term=term, hit_indices=hit,
+                        nes=rdict[NES], pval=rdict['pval'], fdr=rdict['fdr'], RES=rdict['RES'],
+                        pheno_pos=pheno_pos, pheno_neg=pheno_neg, figsize=figsize,
+                        ofname=outfile, weighted_score_type=self.weighted_score_type)
             if self.module == 'gsea':
-                outfile2 = "{0}/{1}.heatmap.{2}".format(self.outdir, term, self.format)
-                heatmat = self.heatmat.iloc[hit, :]
-                width = np.clip(heatmat.shape[1], 4, 20)
-                height = np.clip(heatmat.shape[0], 4, 20)
-                heatmap(df=heatmat, title=term, ofname=outfile2, 
-                        z_score=0, figsize=(width, height), 
-                        xticklabels=True, yticklabels=True)
-                # pool.apply_async(heatmap, args=(self.heatmat.iloc[hit, :], 0, term, 
-                #                                (self._width, len(hit)/2+2), 'RdBu_r',
-                #                                 True, True, outfile2))
-        # pool.close()
-        # pool.join()
+                task['ofname2'] = "{0}/{1}.heatmap.{2}".format(self.outdir, term, self.format)
+                task['heatmat'] = self.heatmat.iloc[hit, :]
+            tasks.append(task)
+        self._render(tasks)
+
+    def _render(self, tasks, outdir=None):
+        """Parallel plotting stage. Each task is a dict of the arguments of :func:`_plot_term`,
+           workers only receive the arrays of one term.
+
+           If self.report is set, write all figures to one report file in outdir instead.
+           Tasks may carry a 'sample' key to label terms of different samples in the report.
+        """
+        if not tasks: return
+        outdir = self.outdir if outdir is None else outdir
+        samples = [task.pop('sample', None) for task in tasks]
+        if self.report == 'pdf':
+            # one multi-page pdf, pages are written in order
+            from matplotlib.backends.backend_pdf import PdfPages
+            ofname = os.path.join(outdir, "gseapy.%s.report.pdf"%self.module)
+            with PdfPages(ofname) as pdf:
+                for sample, task in zip(samples, tasks):
+                    if sample is not None:
+                        task['term'] = "%s: %s"%(sample, task['term'])
+                    _plot_term(pdf=pdf, **task)
+        elif self.report == 'html':
+            # compact per-term data, rendered by the browser
+            keys, rankings, terms = {}, OrderedDict(), []
+            for sample, task in zip(samples, tasks):
+                rnk = task['rank_metric']
+                if id(rnk) not in keys:
+                    keys[id(rnk)] = len(keys)
+                    rankings[keys[id(rnk)]] = rnk.values
+                RES = task['RES']
+                if RES is None:
+                    RES = running_enrichment_score(rnk.values, task['hit_indices'],
+                                                   task['weighted_score_type'], task.get('scale', False))
+                terms.append(dict(term=task['term'], sample=sample, nes=task['nes'],
+                                  pval=task['pval'], fdr=task['fdr'], hit_indices=task['hit_indices'],
+                                  RES=RES, rnk=keys[id(rnk)]))
+            from gseapy.plot import html_report
+            ofname = os.path.join(outdir, "gseapy.%s.report.html"%self.module)
+            html_report(terms, rankings, ofname, title="GSEApy %s report"%self.module,
+                        es_label='ES' if self.module == 'ssgsea' else 'NES',
+                        pheno_pos=tasks[0]['pheno_pos'], pheno_neg=tasks[0]['pheno_neg'])
+        elif self._processes > 1 and len(tasks) > 1:
+            Parallel(n_jobs=min(self._processes, len(tasks)))(
+                     delayed(_plot_term)(**task) for task in tasks)
+        else:
+            for task in tasks:
+                _plot_term(**task)
 
        
     def _save_results(self, zipdata, outdir, module, gmt, rank_metric, permutation_type):
         """reformat gsea results, and save to txt"""
 
+        subsets, gsea_results, hit_ind, RES = zip(*zipdata)
+        es, nes, pval, fdr = np.array(gsea_results, dtype=float).T
+        M, N = len(subsets), len(rank_metric)
+        sizes = np.array([len(ind) for ind in hit_ind])
+        hits = np.concatenate(hit_ind).astype(int)
+        start = np.r_[0, np.cumsum(sizes)[:-1]]
+        stop = start + sizes
+        # reformat gene list.
+        names = np.array([str(g).strip() for g in rank_metric.index.values], dtype=object)
+        genes = [";".join(names[hits[i:j]]) for i, j in zip(start, stop)]
+        columns = [('es', es), ('nes', nes), ('pval', pval), ('fdr', fdr),
+                   ('geneset_size', [len(gmt[gs]) for gs in subsets]),
+                   ('matched_size', sizes), ('genes', genes)]
+
+        if self.module != 'ssgsea':
+            # extract leading edge genes.
+            if RES[0] is None:
+                # lazy_res, locate peaks from hit indices
+                pmax, pmin = enrichment_score_peak(rank_metric.values, hit_ind, self.weighted_score_type)
+            else:
+                RES = np.vstack(RES)
+                pmax, pmin = RES.argmax(axis=1), RES.argmin(axis=1)
+            # hit indices are sorted, offset each row by N to search them all at once
+            peak = np.where(es > 0, pmax, pmin) + np.arange(M) * N
+            keys = hits + np.repeat(np.arange(M) * N, sizes)
+            lo = np.where(es < 0, np.searchsorted(keys, peak, side='left'), start)
+            hi = np.where(es > 0, np.searchsorted(keys, peak, side='right'), stop)
+            columns.append(('ledge_genes', [";".join(names[hits[i:j]]) for i, j in zip(lo, hi)]))
+
         res = OrderedDict()
-        for gs, gseale, ind, RES in zipdata:
-            rdict = OrderedDict()
-            rdict['es'] = gseale[0]
-            rdict['nes'] = gseale[1]
-            rdict['pval'] = gseale[2]
-            rdict['fdr'] = gseale[3]
-            rdict['geneset_size'] = len(gmt[gs])
-            rdict['matched_size'] = len(ind)
-            #reformat gene list.
-            _genes = rank_metric.index.values[ind]
-            rdict['genes'] = ";".join([ str(g).strip() for g in _genes ])
-            
-            if self.module != 'ssgsea':
-                # extract leading edge genes
-                if rdict['es'] > 0:
-                    # RES -> ndarray, ind -> list
-                    idx = RES.argmax()
-                    ldg_pos = list(filter(lambda x: x<= idx, ind))
-                elif rdict['es'] < 0:
-                    idx = RES.argmin()
-                    ldg_pos = list(filter(lambda x: x >= idx, ind))
-                else:
-                    ldg_pos = ind # es == 0 ?
-                rdict['ledge_genes'] = ';'.join(list(map(str,rank_metric.iloc[ldg_pos].index)))
-                
-            rdict['RES'] = RES
-            rdict['hit_indices'] = ind
+        for i, gs in enumerate(subsets):
+            rdict = OrderedDict([(k, v[i]) for k, v in columns])
+            rdict['RES'] = RES[i]
+            rdict['hit_indices'] = hit_ind[i]
             # save to one odict
             res[gs] = rdict
         # save
         self.results  = res
         # save to dataframe
-        res_df = pd.DataFrame.from_dict(res, orient='index')
-        res_df.index.name = 'Term'
-        res_df.drop(['RES','hit_indices'], axis=1, inplace=True)
+        res_df = pd.DataFrame(OrderedDict(columns), index=pd.Index(subsets, name='Term'))
         res_df.sort_values(by=['fdr','pval'], inplace=True)
         self.res2d = res_df
 
@@ -328,7 +465,8 @@ class GSEA(GSEAbase):
                  weighted_score_type=1, permutation_type='gene_set',
                  method='log2_ratio_of_classes', ascending=False,
                  processes=1, figsize=(6.5,6), format='pdf', graph_num=20,
-                 no_plot=False, seed=None, verbose=False):
+                 no_plot=False, seed=None, verbose=False, lazy_res=False,
+                 report=None, chip=None, collapse='max', contrast=None, null_mode=None):
 
         self.data = data
         self.gene_sets=gene_sets
@@ -347,6 +485,13 @@ class GSEA(GSEAbase):
         self.graph_num=int(graph_num)
         self.seed=seed
         self.verbose=bool(verbose)
+        self.lazy_res=bool(lazy_res)
+        self.report=report
+        self.chip=chip
+        self.collapse=collapse
+        self.contrast=contrast
+        self.null_mode=null_mode
+        self._continuous=False
         self.module='gsea'
         self.ranking=None
         self._noplot=no_plot
@@ -385,10 +530,16 @@ class GSEA(GSEAbase):
         exprs.set_index(keys=exprs.columns[0], inplace=True)
         # select numberic columns
         df = exprs.select_dtypes(include=[np.number])
+        # collapse probes to genes
+        if self.chip is not None:
+            df = self._collapse_data(df)
         # drop any genes which std ==0
         cls_dict = {k:v for k, v in zip(df.columns, cls_vec)}
-        df_std =  df.groupby(by=cls_dict, axis=1).std()
-        df =  df[~df_std.isin([0]).any(axis=1)]
+        if self._continuous:
+            df = df[df.std(axis=1) > 0]
+        else:
+            df_std =  df.groupby(by=cls_dict, axis=1).std()
+            df =  df[~df_std.isin([0]).any(axis=1)]
         df = df + 0.00001 # we don't like zeros!!!
   
         return df, cls_dict
@@ -403,16 +554,51 @@ class GSEA(GSEAbase):
         self._logger.info("Parsing data files for GSEA.............................")
         # phenotype labels parsing
         phenoPos, phenoNeg, cls_vector = gsea_cls_parser(self.classes)
+        # continuous phenotype
+        if phenoNeg is None and self.method not in CONTINUOUS_METHODS:
+            self._logger.warning("Continuous phenotype found, use pearson instead of %s"%self.method)
+            self.method = 'pearson'
+        self._continuous = self.method in CONTINUOUS_METHODS
+        if self._continuous:
+            if self.contrast is not None:
+                raise Exception("contrast is not supported for continuous phenotypes")
+            try:
+                cls_vector = [float(v) for v in cls_vector]
+            except ValueError:
+                # two classes, pearson gives the point biserial correlation
+                if len(unique(cls_vector)) != 2:
+                    raise Exception("%s needs numeric phenotype values or two classes, got: %s"
+                                    %(self.method, ", ".join(map(str, unique(cls_vector)))))
+                self._logger.info("Categorical phenotype found, use %s=1, %s=0"%(phenoPos, phenoNeg))
+                cls_vector = [1.0 if v == phenoPos else 0.0 for v in cls_vector]
+            name = phenoPos if phenoNeg is None else "phenotype"
+            phenoPos, phenoNeg = "%s_pos"%name, "%s_neg"%name
         # select correct expression genes and values.
         dat, cls_dict = self.load_data(cls_vector)
         # data frame must have length > 1
         assert len(dat) > 1
-        # ranking metrics calculation.
-        dat2 = ranking_metric(df=dat, method=self.method, pos=phenoPos, neg=phenoNeg,
-                              classes= cls_dict, ascending=self.ascending)
+        # many contrasts in one pass
+        if self.contrast is not None:
+            return self.run_contrasts(dat, cls_vector)
+        rankings = None
+        if self._continuous:
+            # observed and permutated correlations from one matrix product
+            if len(cls_vector) != dat.shape[1]:
+                raise Exception("Phenotype has %s values, but data has %s samples"%(len(cls_vector), dat.shape[1]))
+            gmt = self.load_gmt(gene_list=dat.index.values, gmt=self.gene_sets)
+            if self.permutation_type == 'phenotype':
+                perms = phenotype_permutations(dat.shape[1], dat.shape[0], len(gmt), rs=self.seed)
+            else:
+                perms = np.arange(dat.shape[1])[np.newaxis, :]
+            rankings = ranking_metric_continuous(dat, self.method, cls_vector, perms, self.ascending)
+            dat2 = pd.Series(rankings[1][-1], index=dat.index.values[rankings[0][-1]])
+        else:
+            # ranking metrics calculation.
+            dat2 = ranking_metric(df=dat, method=self.method, pos=phenoPos, neg=phenoNeg,
+                                  classes= cls_dict, ascending=self.ascending)
+            # filtering out gene sets and build gene sets dictionary
+            gmt = self.load_gmt(gene_list=dat2.index.values, gmt=self.gene_sets)
         self.ranking = dat2
-        # filtering out gene sets and build gene sets dictionary
-        gmt = self.load_gmt(gene_list=dat2.index.values, gmt=self.gene_sets)
 
         self._logger.info("%04d gene_sets used for further statistical testing....."% len(gmt))
         self._logger.info("Start to run GSEA...Might take a while..................")
@@ -426,7 +612,9 @@ class GSEA(GSEAbase):
                                                              method=self.method,
                                                              pheno_pos=phenoPos, pheno_neg=phenoNeg,
                                                              classes=cls_vector, ascending=self.ascending,
-                                                             processes=self._processes, seed=self.seed)
+                                                             processes=self._processes, seed=self.seed,
+                                                             null_mode=self.null_mode, lazy=self.lazy_res,
+                                                             rankings=rankings)
         
         self._logger.info("Start to generate GSEApy reports and figures............")
         res_zip = zip(subsets, list(gsea_results), hit_ind, rank_ES)
@@ -434,8 +622,12 @@ class GSEA(GSEAbase):
                                    gmt=gmt, rank_metric=dat2, permutation_type=self.permutation_type)
 
         # reorder datarame for heatmap
-        self._heatmat(df=dat.loc[dat2.index], classes=cls_vector, 
-                      pheno_pos=phenoPos, pheno_neg=phenoNeg)
+        if self._continuous:
+            # samples sorted by phenotype
+            self.heatmat = dat.loc[dat2.index].iloc[:, np.argsort(cls_vector, kind='mergesort')[::-1]]
+        else:
+            self._heatmat(df=dat.loc[dat2.index], classes=cls_vector,
+                          pheno_pos=phenoPos, pheno_neg=phenoNeg)
         # Plotting
         if not self._noplot:
             self._plotting(rank_metric=dat2, results=self.results,
@@ -449,6 +641,80 @@ class GSEA(GSEAbase):
 
         return
 
+    def _parse_contrasts(self, cls_vector):
+        """return a list of (pos, neg) phenotype labels of self.contrast"""
+        labels = unique(list(cls_vector))
+        if self.contrast == 'one-vs-rest':
+            contrasts = [(label, 'rest') for label in labels]
+        elif self.contrast == 'all-pairs':
+            contrasts = list(combinations(labels, 2))
+        elif isinstance(self.contrast, (list, tuple)):
+            contrasts = [tuple(c) for c in self.contrast]
+        else:
+            raise Exception("contrast should be one of 'one-vs-rest', 'all-pairs' or a list of (pos, neg). Got: %s"%self.contrast)
+        for pos, neg in contrasts:
+            if pos not in labels or (neg not in labels and neg != 'rest'):
+                raise Exception("Unknown phenotype labels in contrast: %s vs %s"%(pos, neg))
+        if len(labels) < 2:
+            raise Exception("At least two phenotypes are needed for contrasts")
+        return contrasts
+
+    def run_contrasts(self, dat, cls_vector):
+        """GSEA of many contrasts of one expression table. Class statistics of every
+           permutation are computed once and shared by all contrasts, see
+           :func:`gseapy.algorithm.gsea_compute_contrasts`.
+
+           Results of each contrast are saved to a sub folder of outdir, named pos_vs_neg.
+           obj.results and obj.res2d_by_contrast are dicts of contrast name -> results and res2d,
+           and obj.res2d is one long table of all contrasts.
+
+           :param dat: preprocessed expression DataFrame.
+           :param list cls_vector: phenotype label of each column of dat.
+        """
+        contrasts = self._parse_contrasts(cls_vector)
+        gmt = self.load_gmt(gene_list=dat.index.values, gmt=self.gene_sets)
+        self._logger.info("%04d gene_sets used for further statistical testing....."% len(gmt))
+        self._logger.info("Start to run GSEA of %s contrasts...Might take a while..."% len(contrasts))
+        self._set_cores()
+        computed = gsea_compute_contrasts(data=dat, gmt=gmt, n=self.permutation_num,
+                                          weighted_score_type=self.weighted_score_type,
+                                          permutation_type=self.permutation_type,
+                                          method=self.method, classes=cls_vector,
+                                          contrasts=contrasts, ascending=self.ascending,
+                                          processes=self._processes, seed=self.seed,
+                                          null_mode=self.null_mode, lazy=self.lazy_res)
+        self._logger.info("Start to generate GSEApy reports and figures............")
+        outdir = self.outdir
+        results, res2ds = OrderedDict(), OrderedDict()
+        for (pos, neg), (gsea_results, hit_ind, rank_ES, subsets, rank_metric) in computed.items():
+            name = "%s_vs_%s"%(pos, neg)
+            self.outdir = os.path.join(outdir, name.replace("/", "_"))
+            if self._outdir is not None: mkdirs(self.outdir)
+            res_zip = zip(subsets, list(gsea_results), hit_ind, rank_ES)
+            self._save_results(zipdata=res_zip, outdir=self.outdir, module=self.module,
+                               gmt=gmt, rank_metric=rank_metric, permutation_type=self.permutation_type)
+            classes = [c if c == pos or neg != 'rest' else 'rest' for c in cls_vector]
+            self._heatmat(df=dat.loc[rank_metric.index], classes=classes,
+                          pheno_pos=pos, pheno_neg=neg)
+            if not self._noplot:
+                self._plotting(rank_metric=rank_metric, results=self.results,
+                               graph_num=self.graph_num, outdir=self.outdir,
+                               figsize=self.figsize, format=self.format,
+                               pheno_pos=pos, pheno_neg=neg)
+            results[name], res2ds[name] = self.results, self.res2d
+        self.outdir = outdir
+        self.results = results
+        self.res2d_by_contrast = res2ds
+        self.res2d = pd.concat(res2ds, names=['Contrast']).reset_index()
+        if self._outdir is not None:
+            self.res2d.to_csv(os.path.join(outdir, "gseapy.%s.contrasts.report.csv"%self.module), index=False)
+
+        self._logger.info("Congratulations. GSEApy ran successfully.................\n")
+        if self._outdir is None:
+            self._tmpdir.cleanup()
+
+        return
+
 
 class Prerank(GSEAbase):
     """GSEA prerank tool"""
@@ -456,7 +722,8 @@ class Prerank(GSEAbase):
                  pheno_pos='Pos', pheno_neg='Neg', min_size=15, max_size=500,
                  permutation_num=1000, weighted_score_type=1,
                  ascending=False, processes=1, figsize=(6.5,6), format='pdf',
-                 graph_num=20, no_plot=False, seed=None, verbose=False):
+                 graph_num=20, no_plot=False, seed=None, verbose=False, lazy_res=False,
+                 report=None, id_map=None, null_mode=None):
 
         self.rnk =rnk
         self.gene_sets=gene_sets
@@ -473,6 +740,10 @@ class Prerank(GSEAbase):
         self.graph_num=int(graph_num)
         self.seed=seed
         self.verbose=bool(verbose)
+        self.lazy_res=bool(lazy_res)
+        self.report=report
+        self.id_map=id_map
+        self.null_mode=null_mode
         self.ranking=None
         self.module='prerank'
         self._processes=processes
@@ -483,11 +754,56 @@ class Prerank(GSEAbase):
                                 log_level=logging.INFO if self.verbose else logging.WARNING)
 
 
+    def _load_rankings(self, rnk):
+        """Parse a genes x rankings table, one column per ranking, for multi-ranking prerank.
+
+            :param rnk: a DataFrame or a tab-delimited file with a header. Gene names are the index
+                        or the first column, every other numeric column is a ranking.
+            :return: a genes x rankings DataFrame, or None if rnk holds a single ranking.
+        """
+        if isinstance(rnk, pd.DataFrame):
+            df = rnk
+            if df.index.dtype != 'O':
+                # gene names should be the index or the first column
+                if df.shape[1] == 0 or df.iloc[:, 0].dtype != 'O': return
+                df = df.set_index(df.columns[0])
+        elif isinstance(rnk, str) and os.path.isfile(rnk):
+            with open(rnk) as f:
+                ncol = len(f.readline().rstrip("\n").split("\t"))
+            if ncol <= 2: return
+            df = pd.read_csv(rnk, sep="\t", index_col=0, comment='#')
+        else:
+            return
+        df = df.select_dtypes(include=[np.number])
+        if df.shape[1] < 2: return
+        df = df.copy()
+        df.columns = [str(c) for c in df.columns]
+        # genes must be ranked in all rankings
+        if df.isnull().any(axis=1).sum() > 0:
+            self._logger.warning("Input gene rankings contains NA values, drop genes with any NA!")
+            df = df.dropna(how='any')
+        if self.id_map is not None:
+            mapper = self.id_map if isinstance(self.id_map, IDMapper) else IDMapper(target=self.id_map)
+            converted = [mapper.convert_ranking(df[[c]].rename_axis('gene_name').reset_index(),
+                                                ascending=self.ascending).set_index('gene_name')
+                         for c in df.columns]
+            df = pd.concat(converted, axis=1, join='inner')
+            self._logger.info("%s genes are converted to %s ids."%(len(df), mapper.target))
+        if df.index.duplicated().sum() > 0:
+            self._logger.warning("Input gene rankings contains duplicated IDs, only keep the first one!")
+            df = df[~df.index.duplicated(keep='first')]
+        df.index = df.index.astype(str)
+        return df
+
     def run(self):
         """GSEA prerank workflow"""
 
         assert self.min_size <= self.max_size
 
+        # many rankings in one pass
+        rankings = self._load_rankings(self.rnk)
+        if rankings is not None:
+            return self.run_rankings(rankings)
         # parsing rankings
         dat2 = self._load_ranking(self.rnk)
         assert len(dat2) > 1
@@ -507,7 +823,8 @@ class Prerank(GSEAbase):
                                                               permutation_type='gene_set', method=None,
                                                               pheno_pos=self.pheno_pos, pheno_neg=self.pheno_neg,
                                                               classes=None, ascending=self.ascending,
-                                                              processes=self._processes, seed=self.seed)
+                                                              processes=self._processes, seed=self.seed,
+                                                              null_mode=self.null_mode, lazy=self.lazy_res)
         self._logger.info("Start to generate gseapy reports, and produce figures...")
         res_zip = zip(subsets, list(gsea_results), hit_ind, rank_ES)
         self._save_results(zipdata=res_zip, outdir=self.outdir, module=self.module,
@@ -526,13 +843,63 @@ class Prerank(GSEAbase):
 
         return
 
+    def run_rankings(self, data):
+        """Prerank workflow of many rankings. Gene sets are loaded and filtered once, and
+           permutations of each gene set are shared by all rankings, see :func:`gseapy.algorithm.gsea_compute_multi`.
+
+           Results of each ranking are saved to a sub folder of outdir, named after the ranking.
+           obj.results and obj.res2d_by_ranking are dicts of ranking name -> results and res2d,
+           and obj.res2d is one long table of all rankings.
+
+           :param data: genes x rankings DataFrame.
+        """
+        assert len(data) > 1
+        self.ranking = data
+        self._set_cores()
+        self._logger.info("Parsing data files for GSEA.............................")
+        gmt = self.load_gmt(gene_list=data.index.values, gmt=self.gene_sets)
+        self._logger.info("%04d gene_sets used for further statistical testing....."% len(gmt))
+        self._logger.info("Start to run GSEA of %s rankings...Might take a while..."% data.shape[1])
+        computed = gsea_compute_multi(data=data, gmt=gmt, n=self.permutation_num,
+                                      weighted_score_type=self.weighted_score_type,
+                                      ascending=self.ascending, processes=self._processes,
+                                      seed=self.seed, null_mode=self.null_mode, lazy=self.lazy_res)
+        self._logger.info("Start to generate gseapy reports, and produce figures...")
+        outdir = self.outdir
+        results, res2ds = OrderedDict(), OrderedDict()
+        for name, (gsea_results, hit_ind, rank_ES, subsets, rank_metric) in computed.items():
+            self.outdir = os.path.join(outdir, name.replace("/", "_"))
+            if self._outdir is not None: mkdirs(self.outdir)
+            res_zip = zip(subsets, list(gsea_results), hit_ind, rank_ES)
+            self._save_results(zipdata=res_zip, outdir=self.outdir, module=self.module,
+                               gmt=gmt, rank_metric=rank_metric, permutation_type="gene_sets")
+            if not self._noplot:
+                self._plotting(rank_metric=rank_metric, results=self.results,
+                               graph_num=self.graph_num, outdir=self.outdir,
+                               figsize=self.figsize, format=self.format,
+                               pheno_pos=self.pheno_pos, pheno_neg=self.pheno_neg)
+            results[name], res2ds[name] = self.results, self.res2d
+        self.outdir = outdir
+        self.results = results
+        self.res2d_by_ranking = res2ds
+        self.res2d = pd.concat(res2ds, names=['Ranking']).reset_index()
+        if self._outdir is not None:
+            self.res2d.to_csv(os.path.join(outdir, "gseapy.%s.rankings.report.csv"%self.module), index=False)
+
+        self._logger.info("Congratulations. GSEApy runs successfully................\n")
+        if self._outdir is None:
+            self._tmpdir.cleanup()
+
+        return
+
 
 class SingleSampleGSEA(GSEAbase):
     """GSEA extension: single sample GSEA"""
     def __init__(self, data, gene_sets, outdir="GSEA_SingleSample", sample_norm_method='rank',
                  min_size=15, max_size=2000, permutation_num=0, weighted_score_type=0.25,
                  scale=True, ascending=False, processes=1, figsize=(7,6), format='pdf',
-                 graph_num=20, no_plot=True, seed=None, verbose=False):
+                 graph_num=20, no_plot=True, seed=None, verbose=False, lazy_res=False,
+                 report=None, plot_terms=None, chip=None, collapse='max', null_mode=None):
         self.data=data
         self.gene_sets=gene_sets
         self.outdir=outdir
@@ -548,6 +915,13 @@ class SingleSampleGSEA(GSEAbase):
         self.graph_num=int(graph_num)
         self.seed=seed
         self.verbose=bool(verbose)
+        self.lazy_res=bool(lazy_res)
+        self.report=report
+        self.plot_terms=plot_terms
+        self.chip=chip
+        self.collapse=collapse
+        self.null_mode=null_mode
+        self.plotdata=None
         self.ranking=None
         self.module='ssgsea'
         self._processes=processes
@@ -558,6 +932,12 @@ class SingleSampleGSEA(GSEAbase):
         self._logger = log_init(outlog=logfile,
                                 log_level=logging.INFO if self.verbose else logging.WARNING)
 
+    def plot(self, sample, term, ofname=None):
+        """Render the ssGSEA plot of one sample and gene set after the run.
+           See :func:`ssgsea_plot`.
+        """
+        return ssgsea_plot(self.plotdata, sample, term, ofname=ofname, figsize=self.figsize)
+
     def corplot(self):
         """NES Correlation plot
         TODO
@@ -608,6 +988,9 @@ class SingleSampleGSEA(GSEAbase):
         if rank_metric.isnull().any().sum() > 0:
             self._logger.warning("Warning: Input data contains NA, filled NA with 0")
             rank_metric = rank_metric.fillna(0)
+        # collapse probes to genes
+        if self.chip is not None:
+            rank_metric = self._collapse_data(rank_metric)
 
         return rank_metric
 
@@ -644,6 +1027,8 @@ class SingleSampleGSEA(GSEAbase):
         # filtering out gene sets and build gene sets dictionary
         gmt = self.load_gmt(gene_list=normdat.index.values, gmt=self.gene_sets)
         self._logger.info("%04d gene_sets used for further statistical testing....."% len(gmt))
+        # keep compact results for plotting on demand
+        self._save_plotdata(normdat, gmt)
         # set cpu numbers
         self._set_cores()
         # start analysis
@@ -659,46 +1044,90 @@ class SingleSampleGSEA(GSEAbase):
         if self._outdir is None:
             self._tmpdir.cleanup()
 
+    def _save_plotdata(self, df, gmt):
+        """Keep normalized rankings and gene set members as compact arrays, so that
+           any (sample, term) figure can be rendered later by :func:`ssgsea_plot`.
+           Saved to gseapy.ssgsea.plotdata.npz in outdir.
+        """
+        lookup = dict(zip(df.index.values, range(df.shape[0])))
+        terms = sorted(gmt.keys())
+        members = [sorted(set(lookup[g] for g in gmt[t] if g in lookup)) for t in terms]
+        sizes = np.array([len(m) for m in members], dtype=int)
+        self.plotdata = dict(genes=df.index.values.astype(str),
+                             samples=df.columns.values.astype(str),
+                             data=df.values.astype(np.float32),
+                             terms=np.array(terms, dtype=str),
+                             offsets=np.r_[0, np.cumsum(sizes)],
+                             members=np.array([g for m in members for g in m], dtype=int),
+                             weighted_score_type=self.weighted_score_type,
+                             scale=bool(self.scale), ascending=bool(self.ascending))
+        if self._outdir is None: return
+        np.savez(os.path.join(self.outdir, "gseapy.ssgsea.plotdata.npz"), **self.plotdata)
+
+    def _plot_index(self, name, subsets, es):
+        """Indices of the terms to plot for one sample: the terms paired with the sample
+           in plot_terms if given, else the top graph_num terms by |ES|.
+        """
+        if self.plot_terms is not None:
+            want = set(t for sample, t in self.plot_terms if str(sample) == str(name))
+            return [i for i, t in enumerate(subsets) if t in want]
+        return np.argsort(-np.abs(es), kind='mergesort')[:self.graph_num]
+
     def runSamplesPermu(self, df, gmt=None):
-        """Single Sample GSEA workflow with permutation procedure"""
+        """Single Sample GSEA workflow with permutation procedure.
+           All samples and gene sets are scheduled as one parallel job.
+        """
 
         assert self.min_size <= self.max_size
         mkdirs(self.outdir)
+        # compute ES, NES, pval, FDR of samples x gene sets
+        subsets, sizes, es, nes, pvals, fdrs = ssgsea_compute_permu(data=df, gmt=gmt, n=self.permutation_num,
+                                                                    weighted_score_type=self.weighted_score_type,
+                                                                    ascending=self.ascending,
+                                                                    processes=self._processes,
+                                                                    seed=self.seed, scale=self.scale,
+                                                                    null_mode=self.null_mode)
         self.resultsOnSamples = OrderedDict()
-        outdir = self.outdir
-        # iter through each sample
-        for name, ser in df.iteritems():
-            self.outdir = os.path.join(outdir, str(name))
-            self._logger.info("Run Sample: %s " % name)
-            mkdirs(self.outdir)
-            # sort ranking values from high to low or reverse
-            dat2 = ser.sort_values(ascending=self.ascending)
-            # reset integer index, or caused unwanted problems
-            # df.reset_index(drop=True, inplace=True)
-
-            # compute ES, NES, pval, FDR, RES
-            gsea_results, hit_ind,rank_ES, subsets = gsea_compute(data=dat2, n=self.permutation_num, gmt=gmt,
-                                                                  weighted_score_type=self.weighted_score_type,
-                                                                  permutation_type='gene_set', method=None,
-                                                                  pheno_pos='', pheno_neg='',
-                                                                  classes=None, ascending=self.ascending,
-                                                                  processes=self._processes,
-                                                                  seed=self.seed, single=True, scale=self.scale)
-
-            # write file
-            res_zip = zip(subsets, list(gsea_results), hit_ind, rank_ES)
-            self._save_results(zipdata=res_zip, outdir=self.outdir, module=self.module,
-                                gmt=gmt, rank_metric=dat2, permutation_type="gene_sets")
-            self.resultsOnSamples[name] = self.res2d.es
-            # plotting
-            if self._noplot: continue
-            self._logger.info("Plotting Sample: %s \n" % name)
-            self._plotting(rank_metric=dat2, results=self.results,
-                           graph_num=self.graph_num, outdir=self.outdir,
-                           figsize=self.figsize, format=self.format)
-
+        for j, name in enumerate(df.columns):
+            self.resultsOnSamples[name] = pd.Series(data=es[j], index=subsets, name=name)
+        # one samples x gene sets table
+        S, M = es.shape
+        res = pd.DataFrame(OrderedDict([('Name', np.repeat(df.columns.values, M)),
+                                        ('Term', np.tile(subsets, S)),
+                                        ('es', es.ravel()), ('nes', nes.ravel()),
+                                        ('pval', pvals.ravel()), ('fdr', fdrs.ravel()),
+                                        ('geneset_size', np.tile([len(gmt[gs]) for gs in subsets], S)),
+                                        ('matched_size', np.tile(sizes, S))]))
+        self.statsOnSamples = res
+        if self._outdir is not None:
+            out = os.path.join(self.outdir, "gseapy.samples.permutation.report.txt")
+            msg = "# normalize enrichment scores calculated by random permutation procedure (GSEA method)\n" +\
+                  "# It's not proper for publication. Please check the original paper!\n"
+            self._logger.warning(msg)
+            with open(out, 'a') as f:
+                f.write(msg)
+                res.to_csv(f, sep='\t', index=False)
+        # plotting
+        if not self._noplot:
+            tasks = []
+            for j, (name, ser) in enumerate(df.items()):
+                self._logger.info("Plotting Sample: %s \n" % name)
+                sampledir = os.path.join(self.outdir, str(name))
+                if self.report is None: mkdirs(sampledir)
+                dat2 = ser.sort_values(ascending=self.ascending)
+                top = res.iloc[j * M + np.asarray(self._plot_index(name, subsets, es[j]), dtype=int)]
+                for _, row in top.iterrows():
+                    hit = np.flatnonzero(np.in1d(dat2.index.values, gmt[row['Term']]))
+                    term = row['Term'].replace('/','_').replace(":","_")
+                    outfile = '{0}/{1}.{2}.{3}'.format(sampledir, term, self.module, self.format)
+                    tasks.append(dict(rank_metric=dat2, term=term, hit_indices=hit,
+                                      nes=row['es'], pval=row['pval'], fdr=row['fdr'], RES=None,
+                                      pheno_pos='', pheno_neg='', figsize=self.figsize, ofname=outfile,
+                                      weighted_score_type=self.weighted_score_type, scale=self.scale,
+                                      sample=name))
+            self._render(tasks)
         # save es, nes to file
-        self._save(outdir)
+        self._save(self.outdir)
 
         return
 
@@ -743,30 +1172,33 @@ class SingleSampleGSEA(GSEAbase):
                                                dat.index.values, dat.values, gmt,
                                                self.weighted_score_type,
                                                self.permutation_num, rs, True,
-                                               self.scale) 
+                                               self.scale, self.lazy_res)
                              for dat, rs in zip(tempdat, random_state))
 
         # save results and plotting
+        tasks = []
         for i, temp in enumerate(tempes):
             name, rnk = names[i], rankings[i]
             self._logger.info("Calculate Enrichment Score for Sample: %s "%name)
             # es, esnull, hit_ind, RES = temp.get()
             es, esnull, hit_ind, RES = temp
-            # create results subdir
-            self.outdir= os.path.join(outdir, str(name))
-            mkdirs(self.outdir)
             # save results
             self.resultsOnSamples[name] = pd.Series(data=es, index=subsets, name=name)
             # plotting
             if self._noplot: continue
             self._logger.info("Plotting Sample: %s \n" % name)
-            for i, term in enumerate(subsets):
-                term = term.replace('/','_').replace(":","_")
-                outfile = '{0}/{1}.{2}.{3}'.format(self.outdir, term, self.module, self.format)
-                gseaplot(rank_metric=rnk, term=term, 
-                         hit_indices=hit_ind[i], nes=es[i], pval=1, fdr=1, 
-                         RES=RES[i], pheno_pos='', pheno_neg='', 
-                         figsize=self.figsize, ofname=outfile)
+            # figures of each sample go to a subdir, unless written to one report
+            sampledir = os.path.join(outdir, str(name))
+            if self.report is None: mkdirs(sampledir)
+            for i in self._plot_index(name, subsets, es):
+                term = subsets[i].replace('/','_').replace(":","_")
+                outfile = '{0}/{1}.{2}.{3}'.format(sampledir, term, self.module, self.format)
+                tasks.append(dict(rank_metric=rnk, term=term, hit_indices=hit_ind[i],
+                                  nes=es[i], pval=1, fdr=1, RES=None if RES is None else RES[i],
+                                  pheno_pos='', pheno_neg='', figsize=self.figsize, ofname=outfile,
+                                  weighted_score_type=self.weighted_score_type, scale=self.scale,
+                                  sample=name))
+        self._render(tasks, outdir)
         # save es, nes to file
         self._save(outdir)
 
@@ -807,7 +1239,8 @@ class SingleSampleGSEA(GSEAbase):
 class Replot(GSEAbase):
     """To reproduce GSEA desktop output results."""
     def __init__(self, indir, outdir='GSEApy_Replot', weighted_score_type=1,
-                  min_size=3, max_size=1000, figsize=(6.5,6), format='pdf', verbose=False):
+                  min_size=3, max_size=1000, figsize=(6.5,6), format='pdf', verbose=False,
+                  report=None, processes=1):
         self.indir=indir
         self.outdir=outdir
         self.weighted_score_type=weighted_score_type
@@ -816,9 +1249,12 @@ class Replot(GSEAbase):
         self.figsize=figsize
         self.format=format
         self.verbose=bool(verbose)
+        self.report=report
         self.module='replot'
         self.gene_sets=None
         self.ascending=False
+        self.id_map=None
+        self._processes=processes
         # init logger
         mkdirs(self.outdir)
         outlog = os.path.join(self.outdir,"gseapy.%s.%s.log"%(self.module,"run"))
@@ -827,17 +1263,36 @@ class Replot(GSEAbase):
     def run(self):
         """main replot function"""
         assert self.min_size <= self.max_size
+        self._check_report()
 
         # parsing files.......
+        edb_dirs = sorted(glob.glob(self.indir+'*/edb'))
+        edb_dirs = [d for d in edb_dirs if os.path.isfile(os.path.join(d, 'results.edb'))]
+        if not edb_dirs:
+            sys.stderr.write("Could not locate GSEA files in the given directory!")
+            sys.exit(1)
+        outdir = self.outdir
+        for edb in edb_dirs:
+            # one sub folder for each GSEA result folder if more than one found
+            if len(edb_dirs) > 1:
+                self.outdir = os.path.join(outdir, os.path.basename(os.path.dirname(edb)))
+                mkdirs(self.outdir)
+            self._replot(edb)
+        self.outdir = outdir
+
+        self._logger.info("Congratulations! Your plots have been reproduced successfully!\n")
+
+    def _replot(self, edb):
+        """replot one edb folder"""
         try:
-            results_path = glob.glob(self.indir+'*/edb/results.edb')[0]
-            rank_path =  glob.glob(self.indir+'*/edb/*.rnk')[0]
-            gene_set_path =  glob.glob(self.indir+'*/edb/gene_sets.gmt')[0]
+            results_path = os.path.join(edb, 'results.edb')
+            rank_path =  glob.glob(os.path.join(edb, '*.rnk'))[0]
+            gene_set_path =  glob.glob(os.path.join(edb, 'gene_sets.gmt'))[0]
         except IndexError as e:
             sys.stderr.write("Could not locate GSEA files in the given directory!")
             sys.exit(1)
         # extract sample names from .cls file
-        cls_path = glob.glob(self.indir+'*/edb/*.cls')
+        cls_path = glob.glob(os.path.join(edb, '*.cls'))
         if cls_path:
             pos, neg, classes = gsea_cls_parser(cls_path[0])
         else:
@@ -849,42 +1304,34 @@ class Replot(GSEAbase):
         gene_set_dict = self.parse_gmt(gmt=gene_set_path)
         # obtain rank_metrics
         rank_metric = self._load_ranking(rank_path)
-        correl_vector = rank_metric.values
-        gene_list = rank_metric.index.values
-        # extract each enriment term in the results.edb files and plot.
-        
-        database = gsea_edb_parser(results_path)
-        for enrich_term, data in database.items():
-            # extract statistical resutls from results.edb file
-            hit_ind, nes, pval, fdr = data
-            gene_set = gene_set_dict.get(enrich_term)
-            # calculate enrichment score
-            RES = enrichment_score(gene_list=gene_list, 
-                                   correl_vector=correl_vector,
-                                   gene_set=gene_set, 
-                                   weighted_score_type=self.weighted_score_type,
-                                   nperm=0)[-1]
-            # plotting
+        # stream each enriment term in the results.edb files.
+        # RES is rebuilt from hit indices in the plotting workers, no need to match genes again.
+        tasks = []
+        for enrich_term, hit_ind, nes, pval, fdr in gsea_edb_iterparser(results_path):
+            if enrich_term not in gene_set_dict:
+                self._logger.debug("Skip gene set filtered out by size: %s"%enrich_term)
+                continue
             term = enrich_term.replace('/','_').replace(":","_")
             outfile = '{0}/{1}.{2}.{3}'.format(self.outdir, term, self.module, self.format)
-            gseaplot(rank_metric=rank_metric, term=enrich_term, 
-                         hit_indices=hit_ind, nes=nes, pval=pval, fdr=fdr, 
-                         RES=RES, pheno_pos=pos, pheno_neg=neg, 
-                         figsize=self.figsize, ofname=outfile)
-
-        self._logger.info("Congratulations! Your plots have been reproduced successfully!\n")
+            tasks.append(dict(rank_metric=rank_metric, term=enrich_term,
+                              hit_indices=hit_ind, nes=nes, pval=pval, fdr=fdr,
+                              RES=None, pheno_pos=pos, pheno_neg=neg,
+                              figsize=self.figsize, ofname=outfile,
+                              weighted_score_type=self.weighted_score_type))
+        self._render(tasks)
 
 
 
 def gsea(data, gene_sets, cls, outdir='GSEA_', min_size=15, max_size=500, permutation_num=1000,
           weighted_score_type=1,permutation_type='gene_set', method='log2_ratio_of_classes',
 	      ascending=False, processes=1, figsize=(6.5,6), format='pdf',
-          graph_num=20, no_plot=False, seed=None, verbose=False):
+          graph_num=20, no_plot=False, seed=None, verbose=False, lazy_res=False, report=None,
+          chip=None, collapse='max', contrast=None, null_mode=None):
     """ Run Gene Set Enrichment Analysis.
 
     :param data: Gene expression data table, Pandas DataFrame, gct file.
     :param gene_sets: Enrichr Library name or .gmt gene sets file or dict of gene sets. Same input with GSEA.
-    :param cls: A list or a .cls file format required for GSEA.
+    :param cls: A list or a .cls file format required for GSEA. Also accepts continuous phenotypes, see method.
     :param str outdir: Results output directory.
     :param int permutation_num: Number of permutations for significance computation. Default: 1000.
     :param str permutation_type: Permutation type, "phenotype" for phenotypes, "gene_set" for genes.
@@ -922,6 +1369,12 @@ def gsea(data, gene_sets, cls, outdir='GSEA_', min_size=15, max_size=500, permut
                       Uses the log2 ratio of class means to calculate fold change for natural scale data.
                       This is the recommended statistic for calculating fold change for log scale data.
 
+                   6. 'pearson' and 'cosine', for continuous phenotypes
+
+                      Pearson or cosine correlation of each gene with a continuous phenotype.
+                      cls is a list of phenotype values, or a continuous .cls file (first line is #numeric),
+                      which uses 'pearson' unless 'cosine' is chosen.
+
 
     :param bool ascending: Sorting order of rankings. Default: False.
     :param int processes: Number of Processes you are going to use. Default: 1.
@@ -931,6 +1384,26 @@ def gsea(data, gene_sets, cls, outdir='GSEA_', min_size=15, max_size=500, permut
     :param bool no_plot: If equals to True, no figure will be drawn. Default: False.
     :param seed: Random seed. expect an integer. Default:None.
     :param bool verbose: Bool, increase output verbosity, print out progress of your job, Default: False.
+    :param bool lazy_res: If True, don't keep the running enrichment score (RES) of every gene set.
+                          obj.results[term]['RES'] is None, use obj.get_res(term) instead. Default: False.
+    :param str report: Write all figures into one report file instead of one file per term.
+                       'pdf' for a multi-page pdf, 'html' for a self-contained html report.
+                       Default: None.
+    :param chip: Probe to gene mapping, a .chip file of GSEA, a tab-delimited file or a DataFrame
+                 whose first two columns are probe id and gene, or a dict. If given, probe level
+                 data is collapsed to gene level before the analysis. Default: None.
+    :param str collapse: How to collapse probes of the same gene, 'max', 'mean', 'median', 'sum'
+                         or 'maxabs'. See :func:`gseapy.algorithm.collapse_dataset`. Default: 'max'.
+    :param contrast: Compare more than two phenotypes in one run. 'one-vs-rest' compares each
+                     phenotype with all other samples, 'all-pairs' compares every two phenotypes,
+                     or a list of (pos, neg) phenotype labels, neg could be 'rest'.
+                     Results of each contrast are saved to outdir/pos_vs_neg, and obj.res2d is one
+                     long table of all contrasts. See :meth:`GSEA.run_contrasts`. Default: None,
+                     compare the first two phenotypes of cls.
+    :param str null_mode: How permutation nulls are kept. 'memory' keeps all of them, 'exact' spills
+                          them to disk, 'stream' bins them for an approximate FDR, with enrichment
+                          scores in [-1, 1] only. See :func:`gseapy.algorithm.null_accumulator`.
+                          Default: None, 'exact' for very large jobs, else 'memory'.
 
     :return: Return a GSEA obj. All results store to a dictionary, obj.results,
              where contains::
@@ -948,7 +1421,8 @@ def gsea(data, gene_sets, cls, outdir='GSEA_', min_size=15, max_size=500, permut
     """
     gs = GSEA(data, gene_sets, cls, outdir, min_size, max_size, permutation_num,
               weighted_score_type, permutation_type, method, ascending, processes,
-               figsize, format, graph_num, no_plot, seed, verbose)
+               figsize, format, graph_num, no_plot, seed, verbose, lazy_res, report, chip, collapse,
+               contrast, null_mode)
     gs.run()
 
     return gs
@@ -956,7 +1430,8 @@ def gsea(data, gene_sets, cls, outdir='GSEA_', min_size=15, max_size=500, permut
 
 def ssgsea(data, gene_sets, outdir="ssGSEA_", sample_norm_method='rank', min_size=15, max_size=2000,
            permutation_num=0, weighted_score_type=0.25, scale=True, ascending=False, processes=1,
-           figsize=(7,6), format='pdf', graph_num=20, no_plot=True, seed=None, verbose=False):
+           figsize=(7,6), format='pdf', graph_num=20, no_plot=True, seed=None, verbose=False,
+           lazy_res=False, report=None, plot_terms=None, chip=None, collapse='max', null_mode=None):
     """Run Gene Set Enrichment Analysis with single sample GSEA tool
 
     :param data: Expression table, pd.Series, pd.DataFrame, GCT file, or .rnk file format.
@@ -980,42 +1455,99 @@ def ssgsea(data, gene_sets, outdir="ssGSEA_", sample_norm_method='rank', min_siz
     :param int processes: Number of Processes you are going to use. Default: 1.
     :param list figsize: Matplotlib figsize, accept a tuple or list, e.g. [width,height]. Default: [7,6].
     :param str format: Matplotlib figure format. Default: 'pdf'.
-    :param int graph_num: Plot graphs for top sets of each phenotype.
+    :param int graph_num: Plot graphs for top sets of each sample, ranked by abs(ES).
     :param bool no_plot: If equals to True, no figure will be drawn. Default: False.
     :param seed: Random seed. expect an integer. Default:None.
     :param bool verbose: Bool, increase output verbosity, print out progress of your job, Default: False.
+    :param bool lazy_res: If True, don't keep the running enrichment score (RES) of every gene set. Default: False.
+    :param str report: Write all figures into one report file instead of one file per term.
+                       'pdf' for a multi-page pdf, 'html' for a self-contained html report.
+                       Default: None.
+    :param list plot_terms: A list of (sample, term) tuples. If given, only plot these instead of
+                            the top graph_num terms of each sample. Any other figure can be rendered
+                            later with obj.plot(sample, term) or :func:`ssgsea_plot`. Default: None.
+    :param chip: Probe to gene mapping, a .chip file of GSEA, a tab-delimited file or a DataFrame
+                 whose first two columns are probe id and gene, or a dict. If given, probe level
+                 data is collapsed to gene level before the analysis. Default: None.
+    :param str collapse: How to collapse probes of the same gene, 'max', 'mean', 'median', 'sum'
+                         or 'maxabs'. See :func:`gseapy.algorithm.collapse_dataset`. Default: 'max'.
+    :param str null_mode: How permutation nulls are kept. 'memory' keeps all of them, 'exact' spills
+                          them to disk, 'stream' bins them for an approximate FDR, with enrichment
+                          scores in [-1, 1] only, i.e. scale=True. See :func:`gseapy.algorithm.null_accumulator`.
+                          Default: None, 'exact' for very large jobs, else 'memory'.
 
     :return: Return a ssGSEA obj. 
              All results store to  a dictionary, access enrichment score by obj.resultsOnSamples,
              and normalized enrichment score by obj.res2d.
-             if permutation_num > 0, additional results contain::
+             if permutation_num > 0, additional results store to a samples x gene sets
+             DataFrame, obj.statsOnSamples, where contains::
 
-                 | {es: enrichment score,
+                 | {Name: sample name,
+                 |  Term: gene set name,
+                 |  es: enrichment score,
                  |  nes: normalized enrichment score,
-                 |  p: P-value,
+                 |  pval: P-value,
                  |  fdr: FDR,
-                 |  size: gene set size,
-                 |  matched_size: genes matched to the data,
-                 |  genes: gene names from the data set
-                 |  ledge_genes: leading edge genes, if permutation_num >0}
+                 |  geneset_size: gene set size,
+                 |  matched_size: genes matched to the data}
 
 
     """
 
     ss = SingleSampleGSEA(data, gene_sets, outdir, sample_norm_method, min_size, max_size,
                           permutation_num, weighted_score_type, scale, ascending,
-                          processes, figsize, format, graph_num, no_plot, seed, verbose)
+                          processes, figsize, format, graph_num, no_plot, seed, verbose, lazy_res, report,
+                          plot_terms, chip, collapse, null_mode)
     ss.run()
     return ss
 
 
+def ssgsea_plot(plotdata, sample, term, ofname=None, figsize=(7,6)):
+    """Render the ssGSEA plot of one sample and gene set from saved compact results.
+
+    :param plotdata: gseapy.ssgsea.plotdata.npz file in the ssgsea outdir, or obj.plotdata of a ssGSEA obj.
+    :param sample: sample name.
+    :param term: gene set name.
+    :param ofname: output file name. If None, don't save figure.
+    :param list figsize: Matplotlib figsize. Default: [7,6].
+
+    :return: the enrichment score of the term in the sample.
+    """
+    if isinstance(plotdata, str):
+        with np.load(plotdata) as npz:
+            plotdata = {k: npz[k] for k in npz.files}
+    samples, terms = list(plotdata['samples']), list(plotdata['terms'])
+    if str(sample) not in samples: raise Exception("Sample not found: %s"%sample)
+    if str(term) not in terms: raise Exception("Gene set not found: %s"%term)
+    j, t = samples.index(str(sample)), terms.index(str(term))
+    ser = pd.Series(plotdata['data'][:, j].astype(float))
+    ser = ser.sort_values(ascending=bool(plotdata['ascending']))
+    # rank position of each gene
+    pos = np.empty(len(ser), dtype=int)
+    pos[ser.index.values] = np.arange(len(ser))
+    hit = np.sort(pos[plotdata['members'][plotdata['offsets'][t]:plotdata['offsets'][t+1]]])
+    rnk = pd.Series(ser.values, index=plotdata['genes'][ser.index.values])
+    RES = running_enrichment_score(rnk.values, hit, float(plotdata['weighted_score_type']),
+                                   bool(plotdata['scale']))
+    es = RES.sum()
+    from gseapy.plot import gseaplot
+    gseaplot(rank_metric=rnk, term=str(term), hit_indices=hit, nes=es, pval=1, fdr=1,
+             RES=RES, pheno_pos='', pheno_neg='', figsize=figsize, ofname=ofname)
+
+    return es
+
+
 def prerank(rnk, gene_sets, outdir='GSEA_Prerank', pheno_pos='Pos', pheno_neg='Neg',
             min_size=15, max_size=500, permutation_num=1000, weighted_score_type=1,
             ascending=False, processes=1, figsize=(6.5,6), format='pdf',
-            graph_num=20, no_plot=False, seed=None, verbose=False):
+            graph_num=20, no_plot=False, seed=None, verbose=False, lazy_res=False, report=None,
+            id_map=None, null_mode=None):
     """ Run Gene Set Enrichment Analysis with pre-ranked correlation defined by user.
 
     :param rnk: pre-ranked correlation table or pandas DataFrame. Same input with ``GSEA`` .rnk file.
+                Also accepts a genes x rankings DataFrame or tab-delimited file with a header,
+                e.g. statistics of many contrasts, then all rankings are scored in one run.
+                See :meth:`Prerank.run_rankings`.
     :param gene_sets: Enrichr Library name or .gmt gene sets file or dict of gene sets. Same input with GSEA.
     :param outdir: results output directory.
     :param int permutation_num: Number of permutations for significance computation. Default: 1000.
@@ -1030,6 +1562,19 @@ def prerank(rnk, gene_sets, outdir='GSEA_Prerank', pheno_pos='Pos', pheno_neg='N
     :param bool no_plot: If equals to True, no figure will be drawn. Default: False.
     :param seed: Random seed. expect an integer. Default:None.
     :param bool verbose: Bool, increase output verbosity, print out progress of your job, Default: False.
+    :param bool lazy_res: If True, don't keep the running enrichment score (RES) of every gene set.
+                          obj.results[term]['RES'] is None, use obj.get_res(term) instead. Default: False.
+    :param str report: Write all figures into one report file instead of one file per term.
+                       'pdf' for a multi-page pdf, 'html' for a self-contained html report.
+                       Default: None.
+    :param id_map: Convert gene ids of rnk before the analysis, with the local id mapping index of
+                   BioMart tables. A target id type, 'symbol', 'entrez' or 'ensembl', or a
+                   :class:`gseapy.parser.IDMapper` object for other datasets and collapse rules.
+                   Default: None.
+    :param str null_mode: How permutation nulls are kept. 'memory' keeps all of them, 'exact' spills
+                          them to disk, 'stream' bins them for an approximate FDR, with enrichment
+                          scores in [-1, 1] only. See :func:`gseapy.algorithm.null_accumulator`.
+                          Default: None, 'exact' for very large jobs, else 'memory'.
 
     :return: Return a Prerank obj. All results store to  a dictionary, obj.results,
              where contains::
@@ -1047,13 +1592,15 @@ def prerank(rnk, gene_sets, outdir='GSEA_Prerank', pheno_pos='Pos', pheno_neg='N
     """
     pre = Prerank(rnk, gene_sets, outdir, pheno_pos, pheno_neg,
                   min_size, max_size, permutation_num, weighted_score_type,
-                  ascending, processes, figsize, format, graph_num, no_plot, seed, verbose)
+                  ascending, processes, figsize, format, graph_num, no_plot, seed, verbose, lazy_res, report, id_map,
+                  null_mode)
     pre.run()
     return pre
 
 
 def replot(indir, outdir='GSEA_Replot', weighted_score_type=1,
-           min_size=3, max_size=1000, figsize=(6.5,6), format='pdf', verbose=False):
+           min_size=3, max_size=1000, figsize=(6.5,6), format='pdf', verbose=False, report=None,
+           processes=1):
     """The main function to reproduce GSEA desktop outputs.
 
     :param indir: GSEA desktop results directory. In the sub folder, you must contain edb file folder.
@@ -1066,12 +1613,16 @@ def replot(indir, outdir='GSEA_Replot', weighted_score_type=1,
                      You are not encouraged to use min_size, or max_size argument in :func:`replot` function.
                      Because gmt file has already been filtered.
     :param verbose: Bool, increase output verbosity, print out progress of your job, Default: False.
+    :param str report: Write all figures into one report file instead of one file per term.
+                       'pdf' for a multi-page pdf, 'html' for a self-contained html report.
+                       Default: None.
+    :param int processes: Number of Processes you are going to use for plotting. Default: 1.
 
     :return: Generate new figures with selected figure format. Default: 'pdf'.
 
     """
     rep = Replot(indir, outdir, weighted_score_type,
-                 min_size, max_size, figsize, format, verbose)
+                 min_size, max_size, figsize, format, verbose, report, processes)
     rep.run()
 
     return
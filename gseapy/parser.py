@@ -1,21 +1,25 @@
 # -*- coding: utf-8 -*-
 
-import sys, logging, json, os
-import requests
+import sys, logging, json, os, time
 import pandas as pd
 import xml.etree.ElementTree as ET 
-from io import StringIO
+from io import StringIO, BytesIO
+from xml.sax.saxutils import quoteattr
+from joblib import Parallel, delayed
+import numpy as np
 from numpy import in1d
-from requests.packages.urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
-from bioservices import BioMart, BioServicesError
-from gseapy.utils import unique, DEFAULT_LIBRARY, DEFAULT_CACHE_PATH, mkdirs
+from gseapy.utils import unique, DEFAULT_LIBRARY, mkdirs, retry
+from gseapy.utils import ENRICHR_URL, LIBRARY_TTL
+from gseapy.cache import GeneSetCache, library_file
 
 def gsea_cls_parser(cls):
     """Extract class(phenotype) name from .cls file.
 
     :param cls: the a class list instance or .cls file which is identical to GSEA input .
+                Continuous phenotype .cls files (first line is #numeric) are supported,
+                only the first phenotype is used.
     :return: phenotype name and a list of class vector.
+             For a continuous phenotype: phenotype name, None and a list of float values.
     """
 
     if isinstance(cls, list) :
@@ -24,6 +28,10 @@ def gsea_cls_parser(cls):
     elif isinstance(cls, str) :
         with open(cls) as c:
             file = c.readlines()
+        if file[0].strip().lower() == "#numeric":
+            name = file[1].lstrip("# ").strip()
+            values = file[2].split()
+            return name, None, [float(v) for v in values]
         classes = file[2].strip('\n').split(" ")
         sample_name = file[1].lstrip("# ").strip('\n').split(" ")
     else:
@@ -31,34 +39,69 @@ def gsea_cls_parser(cls):
 
     return sample_name[0], sample_name[1], classes
 
-def gsea_edb_parser(results_path):
-    """Parse results.edb file stored under **edb** file folder.
+def gsea_chip_parser(chip):
+    """Parse probe to gene mapping of a .chip file.
+
+    :param chip: a .chip file of GSEA (columns: Probe Set ID, Gene Symbol, Gene Title) or any
+                 tab-delimited file with a header, whose first two columns are probe id and gene.
+                 Also accepts a DataFrame with the same columns, a dict or a pd.Series.
+    :return: a pd.Series of probe id -> gene name. Probes without a gene are dropped.
+    """
+    if isinstance(chip, pd.Series):
+        mapping = chip.copy()
+    elif isinstance(chip, dict):
+        mapping = pd.Series(chip)
+    elif isinstance(chip, pd.DataFrame):
+        mapping = chip.set_index(chip.columns[0]).iloc[:, 0]
+    elif isinstance(chip, str) and os.path.isfile(chip):
+        df = pd.read_csv(chip, sep="\t", comment='#', dtype=str)
+        mapping = df.set_index(df.columns[0]).iloc[:, 0]
+    else:
+        raise Exception('Error parsing chip file!')
+    mapping.index = mapping.index.astype(str).str.strip()
+    mapping = mapping.dropna().astype(str).str.strip()
+    # GSEA chip files use '---' for probes without a gene
+    mapping = mapping[~mapping.isin(['', '---'])]
+    mapping = mapping[~mapping.index.duplicated(keep='first')]
+
+    return mapping
+
+def gsea_edb_iterparser(results_path):
+    """Stream results.edb file stored under **edb** file folder, one gene set at a time.
+       Each DTG element is released after it is read, so memory doesn't grow with file size.
 
     :param results_path: the .results file located inside edb folder.
-    :param index: gene_set index of gmt database, used for iterating items.
-    :return: enrichment_term, hit_index,nes, pval, fdr.
+    :return: a generator of (enrichment_term, hit_index, nes, pval, fdr),
+             hit_index is an integer ndarray.
     """
-    
-    xtree = ET.parse(results_path)
-    xroot = xtree.getroot() 
-    res = {}
     # dict_keys(['RANKED_LIST', 'GENESET', 'FWER', 'ES_PROFILE',
     # 'HIT_INDICES', 'ES', 'NES', 'TEMPLATE', 'RND_ES', 'RANK_SCORE_AT_ES',
     # 'NP', 'RANK_AT_ES', 'FDR'])
-    for node in xroot.findall('DTG'):
+    context = ET.iterparse(results_path, events=('start', 'end'))
+    _, root = next(context)
+    for event, node in context:
+        if event != 'end' or node.tag != 'DTG': continue
         enrich_term = node.attrib.get('GENESET').split("#")[1]
-        es_profile = node.attrib.get('ES_PROFILE').split(" ")
-        # rank_es = term.get('RND_ES').split(" ")
-        hit_ind = node.attrib.get('HIT_INDICES').split(" ")
-        es_profile = [float(i) for i in es_profile ]
-        hit_ind = [float(i) for i in hit_ind ]
-        # rank_es = [float(i) for i in rank_es ]
+        hit_ind = np.array(node.attrib.get('HIT_INDICES').split(), dtype=float).astype(int)
         nes = node.attrib.get('NES')
         pval = node.attrib.get('NP')
         fdr =  node.attrib.get('FDR')
         # fwer = node.attrib.get('FWER')
         logging.debug("Enriched Gene set is: "+ enrich_term)
-        res[enrich_term] =[hit_ind, nes, pval, fdr]
+        root.clear()
+        yield enrich_term, hit_ind, nes, pval, fdr
+
+
+def gsea_edb_parser(results_path):
+    """Parse results.edb file stored under **edb** file folder.
+
+    :param results_path: the .results file located inside edb folder.
+    :param index: gene_set index of gmt database, used for iterating items.
+    :return: enrichment_term, hit_index,nes, pval, fdr.
+    """
+    res = {}
+    for enrich_term, hit_ind, nes, pval, fdr in gsea_edb_iterparser(results_path):
+        res[enrich_term] = [hit_ind.astype(float).tolist(), nes, pval, fdr]
     return res
 
 
@@ -83,6 +126,11 @@ def gsea_gmt_parser(gmt, min_size = 3, max_size = 1000, gene_list=None):
         with open(gmt) as genesets:
              genesets_dict = { line.strip().split("\t")[0]: line.strip().split("\t")[2:]
                               for line in genesets.readlines()}
+    elif GeneSetCache().get(library_file(gmt)) is not None:
+        logging.info("Enrichr library gene sets already downloaded, use local file")
+        with open(GeneSetCache().path(library_file(gmt))) as genesets:
+             genesets_dict = { line.strip().split("\t")[0]: line.strip().split("\t")[2:]
+                              for line in genesets.readlines()}
     else:
         logging.info("Downloading and generating Enrichr library gene sets...")
         if gmt in DEFAULT_LIBRARY:
@@ -90,16 +138,7 @@ def gsea_gmt_parser(gmt, min_size = 3, max_size = 1000, gene_list=None):
         else:
             names = get_library_name()
         if gmt in names:
-            """
-            define max tries num
-            if the backoff_factor is 0.1, then sleep() will sleep for
-            [0.1s, 0.2s, 0.4s, ...] between retries.
-            It will also force a retry if the status code returned is 500, 502, 503 or 504.
-            """
-            s = requests.Session()
-            retries = Retry(total=5, backoff_factor=0.1,
-                            status_forcelist=[ 500, 502, 503, 504 ])
-            s.mount('http://', HTTPAdapter(max_retries=retries))
+            s = retry(5)
             # query string
             ENRICHR_URL = 'http://amp.pharm.mssm.edu/Enrichr/geneSetLibrary'
             query_string = '?mode=text&libraryName=%s'
@@ -113,6 +152,8 @@ def gsea_gmt_parser(gmt, min_size = 3, max_size = 1000, gene_list=None):
         genesets_dict = { line.strip().split("\t")[0]:
                           list(map(lambda x: x.split(",")[0], line.strip().split("\t")[2:]))
                           for line in response.iter_lines(chunk_size=1024, decode_unicode='utf-8')}
+        GeneSetCache().put(library_file(gmt), ("%s\t\t%s\n"%(k, "\t".join(v))
+                                                    for k, v in genesets_dict.items()), version=gmt)
 
 
 
@@ -145,9 +186,64 @@ def gsea_gmt_parser(gmt, min_size = 3, max_size = 1000, gene_list=None):
     else:
         return genesets_filter
 
-def get_library_name(database='Human'):
+def enrichr_library_catalog(organism='Enrichr', ttl=None, url=ENRICHR_URL, fetch=None):
+    """return Enrichr library names of an organism. The catalogue is cached on disk,
+       so no request is made while the cached one is younger than ttl.
+       If the server can't be reached, a stale catalogue is used instead,
+       or the built-in library names for human and mouse.
+
+    :param str organism: Enrichr organism path, e.g. 'Enrichr', 'FlyEnrichr'.
+    :param ttl: seconds a cached catalogue stays valid. Default: gseapy.utils.LIBRARY_TTL.
+                Use 0 to always refresh.
+    :param url: Enrichr server url.
+    :param fetch: callable returns library names. Default: request datasetStatistics with requests.
+    :return: sorted library names.
+    """
+    ttl = LIBRARY_TTL if ttl is None else ttl
+    cache, name = GeneSetCache(), "enrichr.%s.libraries.json" % organism
+    path, cached = cache.get(name), None
+    if path is not None:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached.get('url') != url: cached = None
+        except (ValueError, OSError):
+            cached = None
+    if cached is not None and time.time() - cached['time'] < ttl:
+        return cached['libraries']
+
+    try:
+        if fetch is None:
+            import requests
+            response = requests.get('%s/%s/datasetStatistics' % (url, organism))
+            if not response.ok:
+                raise Exception("Error getting the Enrichr libraries")
+            libs = [lib['libraryName'] for lib in json.loads(response.text)['statistics']]
+        else:
+            libs = fetch()
+    except Exception as e:
+        if cached is not None:
+            logging.warning("Enrichr server not reachable, use cached library names from %s" % 
+                            time.strftime("%Y-%m-%d %H:%M", time.localtime(cached['time'])))
+            return cached['libraries']
+        if organism == 'Enrichr':
+            logging.warning("Enrichr server not reachable, use built-in library names")
+            return sorted(DEFAULT_LIBRARY)
+        raise e
+
+    libs = sorted(libs)
+    try:
+        cache.put(name, json.dumps({'time': time.time(), 'url': url, 'libraries': libs}))
+    except OSError:
+        logging.debug("Could not write Enrichr library catalogue to %s" % cache.root)
+
+    return libs
+
+
+def get_library_name(database='Human', ttl=None):
     """return enrichr active enrichr library name. 
     :param str database: Select one from { 'Human', 'Mouse', 'Yeast', 'Fly', 'Fish', 'Worm' } 
+    :param ttl: seconds a cached library catalogue stays valid, see :func:`enrichr_library_catalog`.
     
     """
 
@@ -173,129 +269,285 @@ def get_library_name(database='Human'):
         database = 'Enrichr'
     else:
         database += 'Enrichr'
-    lib_url='http://amp.pharm.mssm.edu/%s/datasetStatistics'%database
-    response = requests.get(lib_url)
-    if not response.ok:
-        raise Exception("Error getting the Enrichr libraries")
-    libs_json = json.loads(response.text)
-    libs = [lib['libraryName'] for lib in libs_json['statistics']]
-
-    return sorted(libs)
-
-
-class Biomart(BioMart):
-    """query from BioMart"""
-    def __init__(self, host="www.ensembl.org", verbose=False):
-        """A wrapper of BioMart() from bioseverices.
-
-        How to query validated dataset, attributes, filters:
-        example:
-        >>> from gseapy.parser import Biomart 
-        >>> bm = Biomart(verbose=False, host="asia.ensembl.org")
-        >>> ## view validated marts
-        >>> marts = bm.get_marts()
-        >>> ## view validated dataset
-        >>> datasets = bm.get_datasets(mart='ENSEMBL_MART_ENSEMBL')
-        >>> ## view validated attributes
-        >>> attrs = bm.get_attributes(dataset='hsapiens_gene_ensembl') 
-        >>> ## view validated filters
-        >>> filters = bm.get_filters(dataset='hsapiens_gene_ensembl')
-        >>> ## query results
-        >>> results = bm.query(dataset='hsapiens_gene_ensembl', 
-                               attributes=['entrezgene', ‘go_id'],
-                               filters={'ensembl_gene_id': [your input list]}
-                              )         
+
+    return enrichr_library_catalog(database, ttl=ttl)
+
+
+def _dataset_table(dataset):
+    """return path and version of the BioMart table of a dataset, cached or bundled.
+       (None, None) if the table is not available locally.
+    """
+    cache = GeneSetCache()
+    table = "{}.background.genes.txt".format(dataset)
+    source = cache.get(table)
+    if source is not None:
+        return source, cache.info(table)['sha256']
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", table)
+    if os.path.exists(source):
+        return source, "bundled"
+    return None, None
+
+
+def get_background_index(dataset='hsapiens_gene_ensembl'):
+    """return background genes of a BioMart dataset, as sorted unique arrays.
+       The index is compiled once from the background table and kept in the gene set cache.
+
+    :param dataset: BioMart dataset name, e.g. 'hsapiens_gene_ensembl'.
+    :return: dict, 'symbol': gene names, 'entrez': int64 entrez ids.
+             Genes without entrez id are not included.
+    """
+    cache = GeneSetCache()
+    table = "{}.background.genes.txt".format(dataset)
+    # the index is rebuilt when the source table changes
+    source, version = _dataset_table(dataset)
+    name = "{}.background.index.npz".format(dataset)
+    path = cache.get(name)
+    if path is not None and source is not None and cache.info(name)['version'] == version:
+        with np.load(path) as idx:
+            return {'symbol': idx['symbol'], 'entrez': idx['entrez']}
+
+    if source is not None:
+        df = pd.read_csv(source, sep="\t")
+    else:
+        # background is a biomart database name
+        logging.warning("Downloading %s for the first time. It might take a couple of miniutes."%dataset)
+        from gseapy.biomart import Biomart
+        df = Biomart().query(dataset=dataset)
+        df.dropna(subset=['go_id'], inplace=True)
+        version = cache.info(table)['sha256']
+    df.dropna(subset=['entrezgene'], inplace=True)
+    idx = {'symbol': np.unique(df['external_gene_name'].dropna().values.astype(str)),
+           'entrez': np.unique(df['entrezgene'].astype(np.int64).values)}
+    buf = BytesIO()
+    np.savez(buf, **idx)
+    try:
+        cache.put(name, buf.getvalue(), version=version)
+    except OSError:
+        logging.debug("Could not write background index to %s" % cache.root)
+
+    return idx
+
+
+class IDMapper(object):
+    """Local gene id mapping index, built from the cached or bundled BioMart table of a dataset.
+
+    :param dataset: BioMart dataset name. Default: 'hsapiens_gene_ensembl'.
+    :param target: id type to convert to, one of 'symbol', 'entrez', 'ensembl'. Default: 'symbol'.
+    :param source: id type of the input, one of 'symbol', 'entrez', 'ensembl'.
+                   Default: None, guess from the input ids.
+    :param collapse: how to collapse values of input ids mapped to the same target id, one of
+                     'max', 'min', 'mean', 'median', 'maxabs' (largest absolute value) and 'first'.
+                     Default: 'max'.
+    :param table: a DataFrame or tab-delimited file with BioMart columns, e.g. ensembl_gene_id,
+                  external_gene_name, entrezgene. Used instead of the table of dataset.
+
+    An input id found in several rows is mapped to the target id of its first row.
+    """
+    COLUMNS = {'ensembl': ['gene_id', 'ensembl_gene_id'],
+               'symbol': ['external_gene_name', 'gene_name'],
+               'entrez': ['entrezgene', 'entrezgene_id']}
+    COLLAPSE = ['max', 'min', 'mean', 'median', 'maxabs', 'first']
+
+    def __init__(self, dataset='hsapiens_gene_ensembl', target='symbol', source=None,
+                 collapse='max', table=None):
+        for t in [target, source]:
+            if t is not None and t not in self.COLUMNS:
+                raise Exception("Unsupported id type: %s, choose from %s" % (t, list(self.COLUMNS)))
+        if collapse not in self.COLLAPSE:
+            raise Exception("Unsupported collapse rule: %s, choose from %s" % (collapse, self.COLLAPSE))
+        self.dataset = dataset
+        self.target = target
+        self.source = source
+        self.collapse = collapse
+        self._table = table
+        self._pairs = {}
+
+    def table(self):
+        """return the mapping table, columns are id types, all ids are str."""
+        if not isinstance(self._table, pd.DataFrame):
+            if self._table is not None:
+                df = pd.read_csv(self._table, sep="\t")
+            else:
+                source, version = _dataset_table(self.dataset)
+                if source is None:
+                    logging.warning("Downloading %s for the first time. It might take a couple of miniutes."%self.dataset)
+                    from gseapy.biomart import Biomart
+                    Biomart().query(dataset=self.dataset)
+                    source, version = _dataset_table(self.dataset)
+                df = pd.read_csv(source, sep="\t")
+            self._table = df
+        df = self._table
+        columns = {}
+        for t, names in self.COLUMNS.items():
+            col = [c for c in names if c in df.columns]
+            if len(col) == 0: continue
+            col = df[col[0]]
+            if t == 'entrez': col = col.dropna().astype(np.int64)
+            columns[t] = col.astype(str)
+        return pd.DataFrame(columns)
+
+    def _normalize(self, ids, source):
+        ids = pd.Series(ids).astype(str).str.strip()
+        if source == 'ensembl':
+            # drop version suffix, ENSG00000141510.16 -> ENSG00000141510
+            ids = ids.str.replace(r"\.\d+$", "", regex=True)
+        elif source == 'entrez':
+            ids = ids.str.replace(r"\.0$", "", regex=True)
+        return ids
+
+    def guess_source(self, ids):
+        """guess id type of ids"""
+        ids = pd.Series(ids).astype(str)
+        if ids.str.startswith("ENS").mean() > 0.5: return 'ensembl'
+        if ids.str.fullmatch(r"\d+(\.0)?").mean() > 0.5: return 'entrez'
+        return 'symbol'
+
+    def map(self, ids):
+        """map ids to target ids.
+
+        :param ids: list-like of gene ids.
+        :return: a Series indexed by ids, values are target ids, None if not found.
         """
-        super(Biomart, self).__init__(host=host, verbose=verbose)
-        hosts=["www.ensembl.org", "asia.ensembl.org", "useast.ensembl.org"]
-        # if host not work, select next
-        i=0
-        while (self.host is None) and (i < 3):
-            self.host = hosts[i]
-            i +=1 
-     
-    def get_marts(self):
-        """Get available marts and their names."""
-
-        mart_names = pd.Series(self.names, name="Name")
-        mart_descriptions = pd.Series(self.displayNames, name="Description")
-
-        return pd.concat([mart_names, mart_descriptions], axis=1)
-
-    def get_datasets(self, mart='ENSEMBL_MART_ENSEMBL'):
-        """Get available datasets from mart you've selected"""
-        datasets = self.datasets(mart, raw=True)
-        return pd.read_csv(StringIO(datasets), header=None, usecols=[1, 2],
-                            names = ["Name", "Description"],sep="\t")
-
-    def get_attributes(self, dataset):
-        """Get available attritbutes from dataset you've selected"""
-        attributes = self.attributes(dataset)
-        attr_ = [ (k, v[0]) for k, v in attributes.items()]
-        return pd.DataFrame(attr_, columns=["Attribute","Description"])
-
-    def get_filters(self, dataset):
-        """Get available filters from dataset you've selected"""
-        filters = self.filters(dataset)
-        filt_ = [ (k, v[0]) for k, v in filters.items()]
-        return pd.DataFrame(filt_, columns=["Filter", "Description"])
-    
-    def query(self, dataset='hsapiens_gene_ensembl', attributes=[], 
-              filters={}, filename=None):
-        """mapping ids using BioMart.  
-
-        :param dataset: str, default: 'hsapiens_gene_ensembl'
-        :param attributes: str, list, tuple
-        :param filters: dict, {'filter name': list(filter value)}
-        :param host: www.ensembl.org, asia.ensembl.org, useast.ensembl.org
-        :return: a dataframe contains all attributes you selected.
-
-        **Note**: it will take a couple of minutes to get the results.
-        A xml template for querying biomart. (see https://gist.github.com/keithshep/7776579)
-        
-        exampleTaxonomy = "mmusculus_gene_ensembl"
-        exampleGene = "ENSMUSG00000086981,ENSMUSG00000086982,ENSMUSG00000086983"
-        urlTemplate = \
-        '''http://ensembl.org/biomart/martservice?query=''' \
-        '''<?xml version="1.0" encoding="UTF-8"?>''' \
-        '''<!DOCTYPE Query>''' \
-        '''<Query virtualSchemaName="default" formatter="CSV" header="0" uniqueRows="0" count="" datasetConfigVersion="0.6">''' \
-        '''<Dataset name="%s" interface="default"><Filter name="ensembl_gene_id" value="%s"/>''' \
-        '''<Attribute name="ensembl_gene_id"/><Attribute name="ensembl_transcript_id"/>''' \
-        '''<Attribute name="transcript_start"/><Attribute name="transcript_end"/>''' \
-        '''<Attribute name="exon_chrom_start"/><Attribute name="exon_chrom_end"/>''' \
-        '''</Dataset>''' \
-        '''</Query>''' 
-        
-        exampleURL = urlTemplate % (exampleTaxonomy, exampleGene)
-        req = requests.get(exampleURL, stream=True)
-                   
+        source = self.source if self.source is not None else self.guess_source(ids)
+        if source not in self._pairs:
+            df = self.table()
+            if source not in df.columns or self.target not in df.columns:
+                raise Exception("Mapping table has no %s ids" % (source if source not in df.columns else self.target))
+            # first row of a source id wins
+            pair = df[[source, self.target]].dropna().drop_duplicates(subset=source)
+            self._pairs[source] = (pd.Index(pair[source].values), pair[self.target].values)
+        index, values = self._pairs[source]
+        idx = index.get_indexer(self._normalize(ids, source))
+        mapped = np.where(idx >= 0, values[idx], None)
+        return pd.Series(mapped, index=list(ids), dtype=object)
+
+    def convert_genes(self, genes):
+        """convert a gene list, genes not found are dropped.
+
+        :return: a list of unique target ids, same order as genes.
+        """
+        mapped = self.map(genes).dropna()
+        return mapped.drop_duplicates().tolist()
+
+    def convert_ranking(self, rank_metric, ascending=False):
+        """convert gene ids of a ranking, genes not found are dropped.
+
+        :param rank_metric: a DataFrame, first column is gene id, second column is the ranking value.
+        :param ascending: sorting order of the output.
+        :return: a DataFrame with the same columns, values of genes mapped to the same
+                 target id are collapsed by the collapse rule.
         """
-        if not attributes: 
-            attributes = ['ensembl_gene_id', 'external_gene_name', 'entrezgene', 'go_id'] 
-        # i=0
-        # while (self.host is None) and (i < 3):
-        #     self.host = self.ghosts[i]
-        #     i +=1 
-        self.new_query()
-        # 'mmusculus_gene_ensembl'
-        self.add_dataset_to_xml(dataset)
-        for at in attributes:
-            self.add_attribute_to_xml(at)
-        # add filters
-        if filters:
-            for k, v in filters.items(): 
-                if isinstance(v, list): v = ",".join(v)
-                self.add_filter_to_xml(k, v)
-
-        xml_query = self.get_xml()
-        results = super(Biomart, self).query(xml_query)
-        df = pd.read_csv(StringIO(results), header=None, sep="\t",
-                         names=attributes, index_col=None)
-        # save file to cache path.
-        if filename is None: 
-            mkdirs(DEFAULT_CACHE_PATH)
-            filename = os.path.join(DEFAULT_CACHE_PATH, "{}.background.genes.txt".format(dataset))
-        df.to_csv(filename, sep="\t", index=False)
-      
-        return df
+        gene, value = rank_metric.columns[:2]
+        df = rank_metric[[gene, value]].copy()
+        df[gene] = self.map(df[gene]).values
+        df = df.dropna()
+        if self.collapse in ['mean', 'median']:
+            df = df.groupby(gene, sort=False)[value].agg(self.collapse).reset_index()
+        elif self.collapse != 'first':
+            key = df[value].abs() if self.collapse == 'maxabs' else df[value]
+            order = np.argsort(key.values if self.collapse == 'min' else -key.values, kind='mergesort')
+            df = df.iloc[order].drop_duplicates(subset=gene, keep='first')
+        else:
+            df = df.drop_duplicates(subset=gene, keep='first')
+
+        return df.sort_values(by=value, ascending=ascending).reset_index(drop=True)
+
+
+BIOMART_QUERY = '<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE Query>' \
+                '<Query virtualSchemaName="default" formatter="TSV" header="0" uniqueRows="1" ' \
+                'count="" datasetConfigVersion="0.6" completionStamp="1">' \
+                '<Dataset name=%s interface="default">%s%s</Dataset></Query>'
+
+
+def _biomart_chunk(session, url, dataset, attributes, filters, timeout=None, retries=3):
+    """query one chunk, an interrupted query is retried with back-off."""
+    import requests
+    for i in range(retries):
+        try:
+            return _biomart_stream(session, url, dataset, attributes, filters, timeout)
+        except (requests.exceptions.RequestException, IncompleteResults) as e:
+            if i == retries - 1: raise
+            logging.debug("BioMart query failed: %s, retry" % e)
+            time.sleep(0.5 * 2**i)
+
+
+class IncompleteResults(Exception):
+    pass
+
+
+def _biomart_stream(session, url, dataset, attributes, filters, timeout=None):
+    """query one chunk, rows are parsed while the response streams in."""
+    filt = "".join('<Filter name=%s value=%s/>' % (quoteattr(k), quoteattr(v)) for k, v in filters.items())
+    attr = "".join('<Attribute name=%s/>' % quoteattr(a) for a in attributes)
+    xml = BIOMART_QUERY % (quoteattr(dataset), filt, attr)
+    response = session.post(url, data={'query': xml}, stream=True, timeout=timeout)
+    if not response.ok:
+        raise Exception("Error querying BioMart: %s" % response.status_code)
+    response.encoding = 'utf-8'
+    rows, complete = [], False
+    for line in response.iter_lines(decode_unicode=True):
+        if not line: continue
+        if line == "[success]":
+            complete = True
+            continue
+        if line.startswith("Query ERROR"):
+            raise Exception("Error querying BioMart: %s" % line)
+        fields = line.split("\t")
+        rows.append(tuple(fields) + ("",) * (len(attributes) - len(fields)))
+    response.close()
+    if not complete:
+        raise IncompleteResults("BioMart query was interrupted, results are incomplete.")
+    return rows
+
+
+def biomart_query(url, dataset='hsapiens_gene_ensembl', attributes=[], filters={},
+                  chunksize=500, processes=1, timeout=None):
+    """query a BioMart martservice. A long filter value list is split into chunks of
+       chunksize, which are queried concurrently through one pooled session.
+       Rows are parsed while each response streams in, and duplicated rows are dropped.
+
+    :param url: martservice url, e.g. http://www.ensembl.org/biomart/martservice
+    :param dataset: str, default: 'hsapiens_gene_ensembl'
+    :param attributes: list of attributes.
+    :param filters: dict, {'filter name': list(filter value)}. Only the longest list is chunked.
+    :param chunksize: max number of filter values in one query.
+    :param processes: max number of concurrent queries.
+    :return: a dataframe contains all attributes you selected.
+    """
+    if isinstance(attributes, str): attributes = attributes.split(",")
+    filters = {k: (v.split(",") if isinstance(v, str) else list(v)) for k, v in filters.items()}
+    chunks = [{k: ",".join(map(str, v)) for k, v in filters.items()}]
+    if filters:
+        key = max(filters, key=lambda k: len(filters[k]))
+        values = filters[key]
+        if len(values) > chunksize:
+            chunks = []
+            for i in range(0, len(values), chunksize):
+                chunk = {k: ",".join(map(str, v)) for k, v in filters.items()}
+                chunk[key] = ",".join(map(str, values[i:i+chunksize]))
+                chunks.append(chunk)
+    processes = max(min(int(processes), len(chunks)), 1)
+    session = retry(num=5, backoff_factor=0.5, pool=processes)
+    if processes == 1:
+        results = [_biomart_chunk(session, url, dataset, attributes, c, timeout) for c in chunks]
+    else:
+        results = Parallel(n_jobs=processes, backend='threading')(
+                           delayed(_biomart_chunk)(session, url, dataset, attributes, c, timeout)
+                           for c in chunks)
+    df = pd.DataFrame([r for rows in results for r in rows], columns=attributes)
+    df = df.drop_duplicates().replace("", np.nan).reset_index(drop=True)
+    # numeric columns, e.g. entrezgene
+    for col in df.columns:
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def __getattr__(name):
+    # Biomart is built on bioservices, which is slow to import
+    if name == "Biomart":
+        from gseapy.biomart import Biomart
+        return Biomart
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
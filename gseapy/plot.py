@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import logging, sys, operator
+import logging, sys, operator, json
+from html import escape
 
 from matplotlib.colors import Normalize
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
@@ -91,12 +92,14 @@ def heatmap(df, z_score=None, title='', figsize=(5,5), cmap='RdBu_r',
     :param figsize: heatmap figsize.
     :param cmap: matplotlib colormap.
     :param ofname: output file name. If None, don't save figure 
+    :param pdf: matplotlib PdfPages object. If given, append figure as a new page instead.
 
     """
+    pdf = kwargs.get('pdf')
     df = zscore(df, axis=z_score)
     df = df.iloc[::-1]
     # If working on commandline, don't show figure
-    if hasattr(sys, 'ps1') and (ofname is None): 
+    if hasattr(sys, 'ps1') and (ofname is None) and (pdf is None): 
         fig = plt.figure(figsize=figsize)
     else:
         fig = Figure(figsize=figsize)
@@ -126,11 +129,38 @@ def heatmap(df, z_score=None, title='', figsize=(5,5), cmap='RdBu_r',
         cbar.ax.spines[side].set_visible(False)
     # cbar.ax.set_title('',loc='left')
 
-    if ofname is not None: 
+    if pdf is not None:
+        pdf.savefig(fig, bbox_inches='tight', dpi=300)
+    elif ofname is not None: 
         # canvas.print_figure(ofname, bbox_inches='tight', dpi=300)
         fig.savefig(ofname, bbox_inches='tight', dpi=300)
     return
 
+def minmax_decimate(y, n_bins):
+    """Min/max preserving decimation of a curve.
+
+    :param y: 1-D array.
+    :param int n_bins: number of bins, usually the pixel width of the axes.
+    :return: sorted indices of the points to keep. The first, last, min and max
+             point of each bin are kept, so the envelope of the curve is unchanged.
+    """
+    N = len(y)
+    k = int(np.ceil(N / n_bins))
+    if k <= 4: return np.arange(N)
+    nb = int(np.ceil(N / k))
+    # pad the last bin with the last value
+    mat = np.empty(nb * k, dtype=float)
+    mat[:N] = y
+    mat[N:] = y[-1]
+    mat = mat.reshape(nb, k)
+    start = np.arange(nb) * k
+    ind = np.r_[start, np.minimum(start + k, N) - 1,
+                np.minimum(mat.argmin(axis=1) + start, N - 1),
+                np.minimum(mat.argmax(axis=1) + start, N - 1)]
+
+    return np.unique(ind)
+
+
 class GSEAPlot(object):
     def __init__(self, rank_metric, term, hit_indices, nes, pval, fdr, RES,
                  pheno_pos='', pheno_neg='', figsize=(6, 5.5), 
@@ -141,12 +171,30 @@ class GSEAPlot(object):
         self._x = np.arange(len(rank_metric))
         self.rankings = rank_metric.values
         self.RES = RES
-        self._im_matrix = np.tile(self.rankings, (2,1))
+        # level of detail. draw at most a few points per pixel column when the ranking is long,
+        # and rasterize the heavy layers inside vector outputs.
+        self._npix = int(figsize[0] * kwargs.get('dpi', 300))
+        self._lod = kwargs.get('lod', True) and len(self._x) > 4 * self._npix
+        if self._lod:
+            N = len(self._x)
+            k = int(np.ceil(N / self._npix))
+            nb = int(np.ceil(N / k))
+            # one colormap column per bin, keep the color scale of the full rankings
+            cols = np.add.reduceat(self.rankings, np.arange(nb) * k) / np.diff(np.r_[np.arange(nb) * k, N])
+            self._im_matrix = cols.reshape(1, -1)
+            self._norm = MidpointNormalize(vmin=self.rankings.min(), vmax=self.rankings.max(), midpoint=0)
+            # one rug line per pixel column
+            _, first = np.unique(np.asarray(hit_indices) // k, return_index=True)
+            self._rug = np.asarray(hit_indices)[first]
+        else:
+            self._im_matrix = np.tile(self.rankings, (2,1))
+            self._rug = hit_indices
 
         self.figsize = figsize
         self.term = term
         self.cmap=cmap
         self.ofname=ofname
+        self._pdf = kwargs.get('pdf')
         
         self._pos_label = pheno_pos 
         self._neg_label = pheno_neg
@@ -169,7 +217,7 @@ class GSEAPlot(object):
         # It's also usefull to run this script on command line.
 
         # GSEA Plots
-        if hasattr(sys, 'ps1') and (self.ofname is None):
+        if hasattr(sys, 'ps1') and (self.ofname is None) and (self._pdf is None):
             # working inside python console, show figure
             self.fig = plt.figure(figsize=self.figsize)
         else:
@@ -187,11 +235,15 @@ class GSEAPlot(object):
         """
         # Ranked Metric Scores Plot
         ax1 = self.fig.add_axes(rect, sharex=self.ax)
+        y1 = np.log(self.rankings) if self.module == 'ssgsea' else self.rankings
+        x = self._x
+        if self._lod:
+            ind = minmax_decimate(y1, self._npix)
+            x, y1 = x[ind], y1[ind]
+        ax1.fill_between(x, y1=y1, y2=0, color='#C9D3DB', rasterized=self._lod)
         if self.module == 'ssgsea':
-            ax1.fill_between(self._x, y1=np.log(self.rankings), y2=0, color='#C9D3DB')
             ax1.set_ylabel("log ranked metric", fontsize=14)
         else:
-            ax1.fill_between(self._x, y1=self.rankings, y2=0, color='#C9D3DB')
             ax1.set_ylabel("Ranked list metric", fontsize=14)
 
         ax1.text(.05, .9, self._pos_label, color='red',
@@ -234,7 +286,7 @@ class GSEAPlot(object):
         ax2 = self.fig.add_axes(rect, sharex=self.ax)
         # the x coords of this transformation are data, and the y coord are axes
         trans2 = transforms.blended_transform_factory(ax2.transData, ax2.transAxes)
-        ax2.vlines(self._hit_indices, 0, 1, linewidth=.5, transform=trans2)
+        ax2.vlines(self._rug, 0, 1, linewidth=.5, transform=trans2, rasterized=self._lod)
         ax2.spines['bottom'].set_visible(False)
         ax2.tick_params(axis='both', which='both', 
                         bottom=False, top=False,
@@ -249,8 +301,14 @@ class GSEAPlot(object):
         """
         # colormap
         ax3 =  self.fig.add_axes(rect, sharex=self.ax)
-        ax3.imshow(self._im_matrix, aspect='auto', norm=self._norm, 
-                   cmap=self.cmap, interpolation='none') # cm.coolwarm
+        if self._lod:
+            # binned colormap, stretched over the full ranking
+            ax3.imshow(self._im_matrix, aspect='auto', norm=self._norm, cmap=self.cmap,
+                       interpolation='none', extent=(-0.5, len(self._x)-0.5, 1.5, -0.5),
+                       rasterized=True)
+        else:
+            ax3.imshow(self._im_matrix, aspect='auto', norm=self._norm, 
+                       cmap=self.cmap, interpolation='none') # cm.coolwarm
         ax3.spines['bottom'].set_visible(False)
         ax3.tick_params(axis='both', which='both', 
                         bottom=False, top=False,
@@ -266,7 +324,11 @@ class GSEAPlot(object):
         # Enrichment score plot
         
         ax4 = self.fig.add_axes(rect)
-        ax4.plot(self._x, self.RES, linewidth=4, color ='#88C544')
+        if self._lod:
+            ind = minmax_decimate(self.RES, self._npix)
+            ax4.plot(self._x[ind], self.RES[ind], linewidth=4, color ='#88C544', rasterized=True)
+        else:
+            ax4.plot(self._x, self.RES, linewidth=4, color ='#88C544')
         ax4.text(.1, .1, self._fdr_label, transform=ax4.transAxes)
         ax4.text(.1, .2, self._pval_label, transform=ax4.transAxes)
         ax4.text(.1, .3, self._nes_label, transform=ax4.transAxes)
@@ -309,7 +371,10 @@ class GSEAPlot(object):
     def savefig(self, bbox_inches='tight', dpi=300):   
         
         #if self.ofname is not None: 
-        if hasattr(sys, 'ps1') and (self.ofname is not None):
+        if self._pdf is not None:
+            # one page of a multi-page pdf report
+            self._pdf.savefig(self.fig, bbox_inches=bbox_inches, dpi=dpi)
+        elif hasattr(sys, 'ps1') and (self.ofname is not None):
             self.fig.savefig(self.ofname, bbox_inches=bbox_inches, dpi=dpi)
         elif self.ofname is None:
             return
@@ -334,14 +399,144 @@ def gseaplot(rank_metric, term, hit_indices, nes, pval, fdr, RES,
     :param pheno_neg: phenotype label, negative correlated.
     :param figsize: matplotlib figsize.
     :param ofname: output file name. If None, don't save figure 
+    :param bool lod: level of detail rendering for long rankings, decimate curves to
+                     pixel resolution and rasterize the heavy layers. Default: True.
+    :param pdf: matplotlib PdfPages object. If given, append figure as a new page instead.
 
     """
     g = GSEAPlot(rank_metric, term, hit_indices, nes, pval, fdr, RES,
-                 pheno_pos, pheno_neg, figsize, cmap, ofname)
+                 pheno_pos, pheno_neg, figsize, cmap, ofname, **kwargs)
     g.add_axes()
     g.savefig()
 
 
+_HTML_REPORT = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+body {font-family: Helvetica, Arial, sans-serif; margin: 0; display: flex; height: 100vh;}
+#terms {width: 40%%; overflow-y: auto; border-right: 1px solid #ccc;}
+#terms input {width: 95%%; margin: 6px;}
+table {border-collapse: collapse; width: 100%%; font-size: 12px;}
+td, th {padding: 3px 6px; text-align: left; border-bottom: 1px solid #eee;}
+tr.term {cursor: pointer;} tr.term:hover, tr.selected {background: #e8eef4;}
+#plot {flex: 1; padding: 10px;}
+</style>
+</head>
+<body>
+<div id="terms"><input id="filter" placeholder="filter terms"><table id="table"></table></div>
+<div id="plot"></div>
+<script>
+var DATA = %(data)s;
+var W = 640, H = 520, L = 60, R = 20;
+function svg(tag, attrs) {
+  var el = document.createElementNS("http://www.w3.org/2000/svg", tag);
+  for (var k in attrs) el.setAttribute(k, attrs[k]);
+  return el;
+}
+function scale(d0, d1, r0, r1) {
+  return function (v) { return r0 + (v - d0) / ((d1 - d0) || 1) * (r1 - r0); };
+}
+function fmt(v) { return (typeof v === "number") ? v.toFixed(3) : v; }
+function esc(v) {
+  return String(v).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+}
+function name(t) { return esc((t.sample ? t.sample + ": " : "") + t.term); }
+function draw(i) {
+  var t = DATA.terms[i], rnk = DATA.rankings[t.rnk], N = rnk.n;
+  var plot = document.getElementById("plot");
+  plot.innerHTML = "<h3>" + name(t) + "</h3>";
+  var s = svg("svg", {width: W, height: H});
+  var x = scale(0, N - 1, L, W - R);
+  var ymin = Math.min(0, Math.min.apply(null, t.res)), ymax = Math.max(0, Math.max.apply(null, t.res));
+  var y = scale(ymin, ymax, 220, 20);
+  s.appendChild(svg("line", {x1: L, x2: W - R, y1: y(0), y2: y(0), stroke: "grey", "stroke-width": 0.5}));
+  s.appendChild(svg("polyline", {fill: "none", stroke: "#88C544", "stroke-width": 3,
+    points: t.x.map(function (v, j) { return x(v) + "," + y(t.res[j]); }).join(" ")}));
+  var rug = t.hits.map(function (h) { return "M" + x(h) + ",230V265"; }).join("");
+  s.appendChild(svg("path", {d: rug, stroke: "black", "stroke-width": 0.5}));
+  var rmin = Math.min(0, Math.min.apply(null, rnk.y)), rmax = Math.max(0, Math.max.apply(null, rnk.y));
+  var yr = scale(rmin, rmax, 480, 290);
+  var pts = [x(0) + "," + yr(0)].concat(rnk.x.map(function (v, j) { return x(v) + "," + yr(rnk.y[j]); }));
+  pts.push(x(N - 1) + "," + yr(0));
+  s.appendChild(svg("polygon", {fill: "#C9D3DB", points: pts.join(" ")}));
+  var labels = [[DATA.es_label + ": " + fmt(t.nes), 40], ["Pval: " + fmt(t.pval), 60], ["FDR: " + fmt(t.fdr), 80],
+                [DATA.pheno_pos, 300], [DATA.pheno_neg, 470], ["Rank in Ordered Dataset (N=" + N + ")", 510]];
+  labels.forEach(function (l) {
+    var txt = svg("text", {x: L + 10, y: l[1], "font-size": 12});
+    txt.textContent = l[0];
+    s.appendChild(txt);
+  });
+  plot.appendChild(s);
+}
+function table() {
+  var tb = document.getElementById("table");
+  tb.innerHTML = "<tr><th>Term</th><th>" + DATA.es_label + "</th><th>Pval</th><th>FDR</th></tr>";
+  DATA.terms.forEach(function (t, i) {
+    var tr = document.createElement("tr");
+    tr.className = "term";
+    tr.innerHTML = "<td>" + name(t) + "</td><td>" + fmt(t.nes) +
+                   "</td><td>" + fmt(t.pval) + "</td><td>" + fmt(t.fdr) + "</td>";
+    tr.onclick = function () {
+      var sel = tb.querySelector(".selected");
+      if (sel) sel.className = "term";
+      tr.className = "term selected";
+      draw(i);
+    };
+    tb.appendChild(tr);
+  });
+}
+document.getElementById("filter").oninput = function () {
+  var q = this.value.toLowerCase();
+  document.querySelectorAll("tr.term").forEach(function (tr) {
+    tr.style.display = tr.textContent.toLowerCase().indexOf(q) >= 0 ? "" : "none";
+  });
+};
+table();
+if (DATA.terms.length) draw(0);
+</script>
+</body>
+</html>
+"""
+
+
+def html_report(terms, rankings, ofname, title='GSEApy report', es_label='NES',
+                pheno_pos='', pheno_neg='', n_points=1000):
+    """Write a self-contained html report. Plots are rendered by the browser
+       from compact per-term data.
+
+    :param terms: list of dicts with keys: term, nes, pval, fdr, hit_indices, RES, rnk,
+                  and optional sample. rnk is the key of the term's rankings.
+    :param rankings: dict of sorted rankings (1-D arrays), shared by terms.
+    :param ofname: output html file name.
+    :param es_label: label of the enrichment score column, 'NES' or 'ES'.
+    :param int n_points: RES and rankings curves are decimated to about 4 * n_points points.
+
+    """
+    def _round(a):
+        return [None if not np.isfinite(v) else round(float(v), 4) for v in a]
+
+    data = {'es_label': es_label, 'pheno_pos': pheno_pos, 'pheno_neg': pheno_neg,
+            'rankings': {}, 'terms': []}
+    for key, values in rankings.items():
+        values = np.asarray(values, dtype=float)
+        ind = minmax_decimate(values, n_points)
+        data['rankings'][str(key)] = {'n': len(values), 'x': ind.tolist(), 'y': _round(values[ind])}
+    for t in terms:
+        RES = np.asarray(t['RES'], dtype=float)
+        ind = minmax_decimate(RES, n_points)
+        data['terms'].append({'term': str(t['term']), 'sample': str(t.get('sample') or ''),
+                              'nes': float(t['nes']), 'pval': float(t['pval']), 'fdr': float(t['fdr']),
+                              'hits': np.asarray(t['hit_indices'], dtype=int).tolist(),
+                              'x': ind.tolist(), 'res': _round(RES[ind]), 'rnk': str(t['rnk'])})
+    # keep "</" out of the inline script
+    data = json.dumps(data).replace("</", "<\\/")
+    with open(ofname, 'w') as out:
+        out.write(_HTML_REPORT % {'title': escape(title), 'data': data})
+
+
 def isfloat(x):
         try:
             float(x)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Long-running analysis server, see ``gseapy serve``.
+
+One process serves all jobs, so Python, pandas and joblib are imported once, parsed
+and encoded gene set libraries stay in :data:`gseapy.cache.LIBRARY_MEMO`, and the
+joblib worker processes are reused by every job.
+
+Jobs are posted as a JSON object to ``/prerank``, ``/ssgsea`` or ``/enrichr``. Keys are the
+arguments of :func:`gseapy.prerank`, :func:`gseapy.ssgsea` and :func:`gseapy.enrichr`.
+Rankings and expression data are given as ``{gene: value}`` or ``{column: {gene: value}}``,
+or as a file path. File paths are only read from the data directory of the server
+(``--data-dir``), relative to it, and jobs never write files: ``outdir`` and ``report``
+are rejected. Anyone who can reach the server can run jobs as the server user, so
+listen on a loopback address or a unix socket unless the network is trusted. Results are streamed back as newline delimited JSON: a ``start`` event,
+one ``result`` event per row of the result table, then a ``done`` or ``error`` event.
+Jobs larger than ``max_body`` bytes are rejected with a 413 response.
+``GET /status`` returns server counters. Jobs run one at a time, each job uses the
+shared worker pool.
+"""
+
+import os, sys, json, time, logging, threading, ipaddress
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, TCPServer
+from socket import AF_UNIX, gethostbyname
+from joblib import Parallel, delayed, parallel_backend
+from gseapy.gsea import prerank, ssgsea
+from gseapy.enrichr import enrichr
+from gseapy.cache import LIBRARY_MEMO
+from gseapy.__main__ import __version__
+
+
+def _res2d(obj):
+    return obj.res2d.reset_index()
+
+def _results(obj):
+    return obj.results
+
+# job name -> (function, arguments holding data, result table)
+JOBS = {'prerank': (prerank, ('rnk',), _res2d),
+        'ssgsea': (ssgsea, ('data',), _res2d),
+        'enrichr': (enrichr, (), _results)}
+# arguments which may be file paths, only read from the data directory
+PATH_ARGS = ('rnk', 'data', 'gene_sets', 'gene_list', 'background', 'chip')
+# arguments which write files
+OUTPUT_ARGS = ('outdir', 'report')
+# default max size of a job in bytes
+MAX_BODY = 100 * 2**20
+
+
+def parse_data(value):
+    """convert JSON input to pandas objects.
+
+    :param value: {gene: value} for a Series, {column: {gene: value}} for a DataFrame.
+                  Other values, e.g. a file path, are returned as they are.
+    """
+    if not isinstance(value, dict) or len(value) == 0:
+        return value
+    if all(isinstance(v, dict) for v in value.values()):
+        return pd.DataFrame(value)
+    return pd.Series(value, dtype=float)
+
+
+def resolve_path(value, data_dir=None):
+    """check a file path of a job.
+
+    :param str value: a file path relative to data_dir, or a library or dataset name.
+    :param data_dir: directory files are read from. Default: None, no files are read.
+    :return: the full path of a file in data_dir, or value if it is not a file path.
+    """
+    if data_dir is not None:
+        path = os.path.realpath(os.path.join(data_dir, value))
+        if os.path.commonpath([path, data_dir]) == data_dir and os.path.isfile(path):
+            return path
+    if os.path.sep in value or os.path.exists(value):
+        raise Exception("File path %s not allowed, only files in the data directory of the server are read" % value)
+    return value
+
+
+def is_loopback(host):
+    """whether host is a loopback address"""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return ipaddress.ip_address(gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+    """Request handler of :class:`AnalysisServer`."""
+
+    def address_string(self):
+        # unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        logging.getLogger("gseapy.server").info("%s %s" % (self.address_string(), format % args))
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _event(self, event, data=None, raw=None):
+        """write one event line of the result stream"""
+        if raw is None:
+            line = json.dumps(dict(event=event, **(data or {})))
+        else:
+            line = '{"event": "%s", "data": %s}' % (event, raw)
+        self.wfile.write((line + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/status":
+            return self._send_json(404, {'error': "Unknown path: %s" % self.path})
+        self._send_json(200, self.server.status())
+
+    def do_POST(self):
+        name = self.path.strip("/")
+        if name not in JOBS:
+            return self._send_json(404, {'error': "Unknown job: %s, choose from %s" % (name, ", ".join(JOBS))})
+        length = self.headers.get("Content-Length", "0").strip()
+        if not length.isdigit():
+            return self._send_json(400, {'error': "Invalid Content-Length: %s" % length})
+        length = int(length)
+        if length > self.server.max_body:
+            # the body is not read, close the connection after the response
+            self.close_connection = True
+            return self._send_json(413, {'error': "Job of %s bytes exceeds the limit of %s bytes"
+                                                  % (length, self.server.max_body)})
+        try:
+            params = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(params, dict): raise ValueError("job should be a JSON object")
+        except ValueError as e:
+            return self._send_json(400, {'error': "Error parsing job: %s" % e})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self._event("start", {'job': name})
+        start = time.time()
+        try:
+            table = self.server.run_job(name, params)
+        except (Exception, SystemExit) as e:
+            # gseapy exits on bad inputs, that should not stop the server
+            msg = str(e) if isinstance(e, Exception) else "Job stopped on invalid inputs"
+            self._event("error", {'message': msg or type(e).__name__})
+            return
+        if table is not None and len(table) > 0:
+            for line in table.to_json(orient='records', lines=True).split("\n"):
+                if line: self._event("result", raw=line)
+        self._event("done", {'rows': 0 if table is None else len(table),
+                             'seconds': round(time.time() - start, 3)})
+
+
+class AnalysisServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of gseapy jobs.
+
+    :param address: (host, port) to listen on.
+    :param int processes: default number of processes of each job. Default: 1.
+    :param int idle_timeout: seconds before idle worker processes are shut down. Default: 3600.
+    :param data_dir: directory jobs may read files from. Default: None, jobs can't read files.
+    :param int max_body: max size of a job in bytes, larger jobs get a 413 response. Default: 100 MB.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, processes=1, idle_timeout=3600, data_dir=None, max_body=MAX_BODY):
+        self.processes = processes
+        self.idle_timeout = idle_timeout
+        self.data_dir = None if data_dir is None else os.path.realpath(data_dir)
+        self.max_body = max_body
+        self.jobs = 0
+        self.started = time.time()
+        self._job_lock = threading.Lock()
+        super(AnalysisServer, self).__init__(address, AnalysisHandler)
+
+    def status(self):
+        """server counters"""
+        return {'version': __version__,
+                'uptime': round(time.time() - self.started, 3),
+                'jobs': self.jobs,
+                'processes': self.processes,
+                'memo_items': len(LIBRARY_MEMO),
+                'memo_bytes': LIBRARY_MEMO.size()}
+
+    def warm_pool(self):
+        """start the worker processes before the first job"""
+        if self.processes < 2: return
+        with parallel_backend('loky', idle_worker_timeout=self.idle_timeout):
+            Parallel(n_jobs=self.processes)(delayed(os.getpid)() for i in range(self.processes))
+
+    def run_job(self, name, params):
+        """run one job.
+
+        :param name: one of JOBS.
+        :param dict params: arguments of the job function. File paths are resolved in data_dir,
+                            see :func:`resolve_path`.
+        :return: result table, a DataFrame.
+        """
+        func, data_args, table = JOBS[name]
+        params = dict(params)
+        for arg in OUTPUT_ARGS:
+            if params.get(arg) is not None:
+                raise Exception("%s not allowed, the server doesn't write files" % arg)
+        for arg in PATH_ARGS:
+            value = params.get(arg)
+            if arg == 'gene_sets' and isinstance(value, str):
+                # comma separated libraries of enrichr
+                params[arg] = ",".join(resolve_path(v.strip(), self.data_dir) for v in value.split(","))
+            elif arg == 'gene_sets' and isinstance(value, list):
+                params[arg] = [resolve_path(v, self.data_dir) if isinstance(v, str) else v for v in value]
+            elif isinstance(value, str):
+                params[arg] = resolve_path(value, self.data_dir)
+        for arg in data_args:
+            if arg in params: params[arg] = parse_data(params[arg])
+        # results are only returned, no files
+        params['outdir'] = None
+        params['no_plot'] = True
+        params.setdefault('processes', self.processes)
+        with self._job_lock:
+            # joblib keeps the worker processes until they are idle for idle_timeout
+            with parallel_backend('loky', idle_worker_timeout=self.idle_timeout):
+                obj = func(**params)
+            self.jobs += 1
+        return table(obj)
+
+
+class UnixAnalysisServer(AnalysisServer):
+    """:class:`AnalysisServer` on a unix socket.
+
+    :param path: socket file path.
+    """
+    address_family = AF_UNIX
+
+    def __init__(self, path, processes=1, idle_timeout=3600, data_dir=None, max_body=MAX_BODY):
+        if os.path.exists(path): os.remove(path)
+        super(UnixAnalysisServer, self).__init__(path, processes, idle_timeout, data_dir, max_body)
+
+    def server_bind(self):
+        TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address, 0
+
+    def server_close(self):
+        super(UnixAnalysisServer, self).server_close()
+        if os.path.exists(self.server_address): os.remove(self.server_address)
+
+
+def serve(host='127.0.0.1', port=8000, socket=None, processes=1, idle_timeout=3600, data_dir=None,
+          max_body=MAX_BODY, verbose=False):
+    """Run the analysis server until interrupted.
+
+    :param host: host to listen on. Anyone who can reach it can run jobs as this user,
+                 a warning is logged if it is not a loopback address. Default: 127.0.0.1.
+    :param int port: port to listen on. Default: 8000.
+    :param socket: listen on this unix socket file instead of host and port. Default: None.
+    :param int processes: default number of processes of each job. Default: 1.
+    :param int idle_timeout: seconds before idle worker processes are shut down. Default: 3600.
+    :param data_dir: directory jobs may read files from. Default: None, jobs can't read files.
+    :param int max_body: max size of a job in bytes, larger jobs get a 413 response. Default: 100 MB.
+    :param bool verbose: log every request. Default: False.
+    """
+    logger = logging.getLogger("gseapy.server")
+    logger.setLevel(logging.INFO if verbose else logging.WARNING)
+    # jobs reset the handlers of the gseapy logger
+    logger.propagate = False
+    if not logger.handlers: logger.addHandler(logging.StreamHandler())
+    if socket is not None:
+        server = UnixAnalysisServer(socket, processes, idle_timeout, data_dir, max_body)
+        where = socket
+    else:
+        if not is_loopback(host):
+            logger.warning("Listening on %s, which is not a loopback address: anyone who can reach it "
+                           "can run jobs as this user. Use a trusted network only." % host)
+        server = AnalysisServer((host, port), processes, idle_timeout, data_dir, max_body)
+        where = "http://%s:%s" % server.server_address[:2]
+    server.warm_pool()
+    sys.stderr.write("GSEApy server listening on %s\n" % where)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -2,7 +2,81 @@
 # -*- coding: utf-8 -*-
 import sys, logging
 import numpy as np
-from scipy.stats import hypergeom
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+def encode_gene_sets(gene_sets):
+    """Encode gene sets to a sparse terms x genes indicator matrix.
+
+    :param dict gene_sets: gmt file dict.
+    :returns: subsets: sorted term names.
+              genes: pd.Index of all genes found in gene_sets, the matrix columns.
+              matrix: scipy csr_matrix, 1 if a gene is in a term.
+              sizes: length of gene_set which belongs to each terms.
+    """
+    subsets = sorted(gene_sets.keys())
+    members = [gene_sets[s] for s in subsets]
+    sizes = np.array([len(m) for m in members], dtype=int)
+    rows = np.repeat(np.arange(len(subsets)), sizes)
+    cols, genes = pd.factorize(pd.Index([g for m in members for g in m], dtype=object))
+    matrix = csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                        shape=(len(subsets), len(genes)))
+    # duplicated genes in a gene set count once
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return subsets, pd.Index(genes, dtype=object), matrix, sizes
+
+
+def encode_query(query, genes):
+    """Encode query genes to an indicator vector over the columns of :func:`encode_gene_sets`.
+
+    :param query: iterable of query genes.
+    :param genes: pd.Index, the matrix columns.
+    :returns: int32 vector, 1 if a gene is in query.
+    """
+    vec = np.zeros(len(genes), dtype=np.int32)
+    idx = genes.get_indexer(pd.Index(list(query), dtype=object))
+    vec[idx[idx >= 0]] = 1
+    return vec
+
+
+class HitGenes(object):
+    """Overlapped gene names of each term. The set of a term is only built when accessed."""
+    def __init__(self, genes, indptr):
+        self._genes = genes
+        self._indptr = indptr
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return set(self._genes[self._indptr[i]:self._indptr[i+1]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def restrict_query(query, background):
+    """ keep query genes found in background.
+
+    :param set query: query genes.
+    :param background: a set, or a sorted unique array, e.g. from :func:`gseapy.parser.get_background_index`.
+    :returns: query genes found in background, and background size.
+    """
+    if isinstance(background, set):
+        return query.intersection(background), len(background)
+    if isinstance(background, np.ndarray):
+        q = np.asarray(list(query))
+        if len(q) == 0 or len(background) == 0 or q.dtype.kind != background.dtype.kind:
+            return set(), len(background)
+        idx = np.searchsorted(background, q).clip(max=len(background)-1)
+        return set(q[background[idx] == q].tolist()), len(background)
+    raise ValueError("background should be set, sorted array or int object")
 
 
 def calc_pvalues(query, gene_sets, background=20000, **kwargs):
@@ -10,11 +84,14 @@ def calc_pvalues(query, gene_sets, background=20000, **kwargs):
 
     :param set query: set of identifiers for which the p value is calculated
     :param dict gene_sets: gmt file dict after background was set
-    :param set background: total number of genes in your annotated database.
+    :param set background: total number of genes in your annotated database,
+                           or a set or sorted array of genes, see :func:`restrict_query`.
+    :param encoded: optional, output of :func:`encode_gene_sets` for gene_sets, to skip encoding
+                    when the same library is tested many times.
     :returns: pvalues
               x: overlapped gene number
               n: length of gene_set which belongs to each terms
-              hits: overlapped gene names.
+              hits: overlapped gene names, a :class:`HitGenes` sequence of sets.
 
 
     For 2*2 contingency table: 
@@ -49,30 +126,114 @@ def calc_pvalues(query, gene_sets, background=20000, **kwargs):
     # number of genes in your query data
     k = len(query) 
     query = set(query)
-    vals = []
     # background should be all genes in annotated database
     # such as go, kegg et.al.
-    if isinstance(background, set): 
-        bg = len(background) # total number in your annotated database 
-        # filter genes that not found in annotated database
-        query = query.intersection(background)
-    elif isinstance(background, int):
+    if isinstance(background, int):
         bg = background
     else:
-        raise ValueError("background should be set or int object")
-    # pval
-    subsets = sorted(gene_sets.keys())
-    for s in subsets:
-        category = gene_sets.get(s)
-        m = len(category)
-        hits = query.intersection(set(category))
-        x = len(hits)
-        if x < 1 : continue
-        # pVal = hypergeom.sf(hitCount-1,popTotal,bgHits,queryTotal) 
-        # p(X >= hitCounts)
-        vals.append((s, hypergeom.sf(x-1, bg, m, k), x, m, hits))
-
-    return zip(*vals)
+        # filter genes that not found in annotated database
+        # bg: total number in your annotated database 
+        query, bg = restrict_query(query, background)
+    # overlaps of all terms from one sparse matrix slice, only query genes are kept
+    encoded = kwargs.get('encoded')
+    subsets, genes, matrix, sizes = encode_gene_sets(gene_sets) if encoded is None else encoded
+    qcols = np.flatnonzero(encode_query(query, genes))
+    hitmat = matrix[:, qcols]
+    overlaps = np.diff(hitmat.indptr)
+    keep = np.flatnonzero(overlaps >= 1)
+    x, m = overlaps[keep], sizes[keep]
+    # pVal = hypergeom.sf(hitCount-1,popTotal,bgHits,queryTotal) 
+    # p(X >= hitCounts)
+    # many terms share the same (x, m), so only compute unique pairs
+    # scipy.stats is slow to import, only load it for enrichment tests
+    from scipy.stats import hypergeom
+    pairs, inv = np.unique(np.c_[x, m], axis=0, return_inverse=True)
+    pvals = hypergeom.sf(pairs[:, 0]-1, bg, pairs[:, 1], k)[inv.ravel()]
+    # hit genes, only for terms with overlaps
+    hitmat = hitmat[keep]
+    hits = HitGenes(genes.values[qcols[hitmat.indices]], hitmat.indptr)
+    if len(keep) == 0: return zip()
+
+    return iter([tuple(subsets[j] for j in keep), pvals, tuple(x.tolist()), tuple(m.tolist()), hits])
+
+
+def calc_pvalues_batch(queries, gene_sets, background=20000, **kwargs):
+    """ calculate pvalues for many queries against the same gene_sets in one pass.
+    Overlaps of all (query, term) pairs come from one sparse queries x terms matrix product.
+
+    :param list queries: list of query gene lists.
+    :param dict gene_sets: gmt file dict after background was set
+    :param set background: total number of genes in your annotated database.
+    :param encoded: optional, output of :func:`encode_gene_sets` for gene_sets.
+    :returns: qidx: index of the query in queries of each (query, term) pair
+              terms, pvalues, x, n, hits: same as :func:`calc_pvalues`, one item per pair.
+
+    Pairs without overlapped genes are dropped, the rest are sorted by query, then by term.
+    """
+    bg = background if isinstance(background, int) else restrict_query(set(), background)[1]
+    encoded = kwargs.get('encoded')
+    subsets, genes, matrix, sizes = encode_gene_sets(gene_sets) if encoded is None else encoded
+    # number of genes in each query
+    k = np.array([len(q) for q in queries], dtype=int)
+    # queries x genes indicator matrix
+    rows, cols = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+    for i, query in enumerate(queries):
+        query = set(query)
+        if not isinstance(background, int):
+            query = restrict_query(query, background)[0]
+        idx = genes.get_indexer(pd.Index(list(query), dtype=object))
+        idx = idx[idx >= 0]
+        rows.append(np.full(len(idx), i, dtype=int))
+        cols.append(idx)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    qmat = csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                      shape=(len(queries), len(genes)))
+    qmat.sort_indices()
+    # overlaps of all pairs
+    olap = (qmat @ matrix.T).tocsr()
+    olap.eliminate_zeros()
+    olap.sort_indices()
+    qidx = np.repeat(np.arange(len(queries)), np.diff(olap.indptr))
+    tidx = olap.indices
+    x, m = olap.data.astype(int), sizes[tidx]
+    if len(x) == 0: return zip()
+    # p(X >= hitCounts), only computed once for each unique (x, m, k)
+    from scipy.stats import hypergeom
+    triples, inv = np.unique(np.c_[x, m, k[qidx]], axis=0, return_inverse=True)
+    pvals = hypergeom.sf(triples[:, 0]-1, bg, triples[:, 1], triples[:, 2])[inv.ravel()]
+    # hit genes of each pair: terms of a query x genes of the query
+    hit_cols, hit_len = [], []
+    for i in range(len(queries)):
+        qcols = qmat.indices[qmat.indptr[i]:qmat.indptr[i+1]]
+        terms = tidx[olap.indptr[i]:olap.indptr[i+1]]
+        if len(terms) == 0: continue
+        sub = matrix[terms][:, qcols]
+        sub.sort_indices()
+        hit_cols.append(qcols[sub.indices])
+        hit_len.append(np.diff(sub.indptr))
+    indptr = np.r_[0, np.cumsum(np.concatenate(hit_len))]
+    hits = HitGenes(genes.values[np.concatenate(hit_cols)], indptr)
+
+    return iter([qidx, tuple(subsets[j] for j in tidx), pvals, tuple(x.tolist()), tuple(m.tolist()), hits])
+
+
+def odds_ratio(x, m, k, bg):
+    """ odds ratio of the 2*2 contingency table of :func:`calc_pvalues`.
+    0.5 is added to all cells of a table with a zero cell (Haldane-Anscombe correction).
+
+    :param x: overlapped gene number
+    :param m: length of gene_set
+    :param k: number of genes in query
+    :param bg: total number of genes in annotated database
+    :returns: odds ratios
+    """
+    a = np.asarray(x, dtype=float)
+    b = np.asarray(m, dtype=float) - a
+    c = np.asarray(k, dtype=float) - a
+    d = bg - a - b - c
+    zero = (a == 0) | (b <= 0) | (c <= 0) | (d <= 0)
+    a, b, c, d = [np.where(zero, v + 0.5, v) for v in (a, b, c, d)]
+    return (a * d) / (b * c)
 
 
 def _ecdf(x):
@@ -1,11 +1,16 @@
 
 import os, errno, logging
-import requests
-from requests.packages.urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 from os.path import expanduser
 
 DEFAULT_CACHE_PATH = os.path.join("/opt", "gseapy")
+# max size in bytes of the gene set cache
+CACHE_MAX_SIZE = 2 * 1024**3
+_CACHE_PATH = None
+ENRICHR_URL = 'http://amp.pharm.mssm.edu'
+# seconds a cached Enrichr library catalogue stays valid
+LIBRARY_TTL = 7 * 24 * 3600
+# max size in bytes of parsed gene set libraries kept in memory
+MEMO_MAX_SIZE = 256 * 1024**2
 
 def unique(seq):
     """Remove duplicates from a list in Python while preserving order.
@@ -36,6 +41,24 @@ def mkdirs(outdir):
             raise exc
         pass
 
+def set_cache_path(path):
+    """set the cache directory of gseapy. None resets to default."""
+    global _CACHE_PATH
+    _CACHE_PATH = path
+
+def get_cache_path():
+    """return the cache directory of gseapy.
+
+    The first found of: path set by :func:`set_cache_path`, environment variable GSEAPY_CACHE_PATH,
+    DEFAULT_CACHE_PATH if writable, ~/.cache/gseapy.
+    """
+    if _CACHE_PATH is not None: return _CACHE_PATH
+    if os.environ.get("GSEAPY_CACHE_PATH"): return os.environ["GSEAPY_CACHE_PATH"]
+    if os.access(DEFAULT_CACHE_PATH, os.W_OK) or \
+       (not os.path.exists(DEFAULT_CACHE_PATH) and os.access(os.path.dirname(DEFAULT_CACHE_PATH), os.W_OK)):
+        return DEFAULT_CACHE_PATH
+    return os.path.join(expanduser("~"), ".cache", "gseapy")
+
 def log_init(outlog, log_level=logging.INFO):
     """logging start"""
 
@@ -69,19 +92,26 @@ def log_stop(logger):
         logger.removeHandler(handler)
 
 
-def retry(num=5):
+def retry(num=5, backoff_factor=0.1, pool=10):
     """"retry connection.
     
         define max tries num
         if the backoff_factor is 0.1, then sleep() will sleep for
         [0.1s, 0.2s, 0.4s, ...] between retries.
         It will also force a retry if the status code returned is 500, 502, 503 or 504.    
+        Connections are kept alive, at most pool connections per host.
     
     """
+    # requests is only imported when a connection is needed
+    import requests
+    from requests.packages.urllib3.util.retry import Retry
+    from requests.adapters import HTTPAdapter
     s = requests.Session()
-    retries = Retry(total=num, backoff_factor=0.1,
+    retries = Retry(total=num, backoff_factor=backoff_factor,
                     status_forcelist=[500, 502, 503, 504])
-    s.mount('http://', HTTPAdapter(max_retries=retries))
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool, pool_maxsize=pool)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
 
     return s
 
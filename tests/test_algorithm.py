@@ -0,0 +1,90 @@
+import os
+import pytest
+import numpy as np
+from tempfile import TemporaryDirectory
+from gseapy.algorithm import NullAccumulator, gsea_significance, enrichment_score, enrichment_score_tensor
+from gseapy.algorithm import running_enrichment_score, enrichment_score_peak, collapse_dataset
+from gseapy.parser import gsea_chip_parser
+
+
+def test_null_accumulator():
+    rs = np.random.RandomState(0)
+    esnull = np.clip(rs.randn(50, 200) * 0.3, -1, 1)
+    es = np.clip(rs.randn(50) * 0.5, -1, 1)
+    es_, nes_, pval_, fdr_ = map(np.array, zip(*gsea_significance(es, esnull)))
+    # exact mode, spill esnulls to disk
+    tmpdir = TemporaryDirectory(dir="tests")
+    acc = NullAccumulator(len(es), spill=tmpdir.name)
+    for b in range(0, 200, 50):
+        acc.update(esnull[:, b:b+50], es=es)
+    _, nes, pval, fdr = map(np.array, zip(*acc.significance()))
+    assert np.allclose(nes, nes_) and np.allclose(pval, pval_) and np.allclose(fdr, fdr_)
+    tmpdir.cleanup()
+    # one gene set at a time, buffered into a few large blocks
+    tmpdir = TemporaryDirectory(dir="tests")
+    acc = NullAccumulator(len(es), spill=tmpdir.name, block_size=2000)
+    for i in range(len(es)):
+        acc.update(esnull[i], index=[i], es=es[i])
+    _, nes, pval, fdr = map(np.array, zip(*acc.significance()))
+    assert np.allclose(nes, nes_) and np.allclose(pval, pval_) and np.allclose(fdr, fdr_)
+    assert len(os.listdir(tmpdir.name)) == 5
+    tmpdir.cleanup()
+    # binned FDR null, one gene set at a time
+    acc = NullAccumulator(len(es))
+    for i in range(len(es)):
+        acc.update(esnull[i], index=[i], es=es[i])
+    _, nes, pval, fdr = map(np.array, zip(*acc.significance()))
+    assert np.allclose(nes, nes_) and np.allclose(pval, pval_)
+    assert np.abs(fdr - fdr_).max() < 0.01
+    # unscaled scores don't fit the grid of binned FDR null
+    acc = NullAccumulator(len(es))
+    with pytest.raises(ValueError):
+        acc.update(esnull * 100, es=es * 100)
+
+
+def test_lazy_res():
+    rs = np.random.RandomState(1)
+    correl = np.sort(rs.randn(500))[::-1]
+    genes = np.arange(500).astype(str)
+    hit_ind, pmax, pmin = [], [], []
+    for i in range(20):
+        gset = rs.choice(genes, rs.randint(5, 50), replace=False)
+        es, _, hits, RES = enrichment_score(genes, correl, gset, nperm=0, single=False)
+        assert np.allclose(RES, running_enrichment_score(correl, hits))
+        hit_ind.append(hits)
+        pmax.append(RES.argmax())
+        pmin.append(RES.argmin())
+    imax, imin = enrichment_score_peak(correl, hit_ind)
+    assert np.array_equal(imax, pmax) and np.array_equal(imin, pmin)
+    # lazy engines score hits only, same es and esnull
+    gmt = {str(i): genes[h] for i, h in enumerate(hit_ind)}
+    for single in (False, True):
+        es, esnull, _, _ = enrichment_score(genes, correl, gmt['0'], nperm=20, rs=3, single=single)
+        es_, esnull_, _, RES = enrichment_score(genes, correl, gmt['0'], nperm=20, rs=3, single=single, lazy=True)
+        assert RES is None and np.allclose(es, es_) and np.allclose(esnull, esnull_)
+        es, esnull, _, _ = enrichment_score_tensor(genes, correl, gmt, 1, nperm=20, rs=3, single=single)
+        es_, esnull_, _, RES = enrichment_score_tensor(genes, correl, gmt, 1, nperm=20, rs=3, single=single, lazy=True)
+        assert RES is None and np.allclose(es, es_) and np.allclose(esnull, esnull_)
+
+
+def test_collapse_dataset():
+    import pandas as pd
+    rs = np.random.RandomState(0)
+    df = pd.DataFrame(rs.randn(300, 4), index=["p%s" % i for i in range(300)])
+    chip = pd.DataFrame({"Probe Set ID": df.index, "Gene Symbol": ["g%s" % rs.randint(60) for i in range(300)]})
+    chip.iloc[:5, 1] = "---"
+    chip = gsea_chip_parser(chip)
+    assert len(chip) == 295
+    groups = df.loc[chip.index].groupby(chip, sort=False)
+    for mode in ['max', 'mean', 'median', 'sum']:
+        res = collapse_dataset(df, chip, mode)
+        ref = groups.agg(mode)
+        assert res.index.tolist() == ref.index.tolist()
+        assert np.allclose(res.values, ref.values)
+    res = collapse_dataset(df, chip, 'maxabs')
+    ref = groups.agg(lambda x: x.values[np.abs(x.values).argmax()])
+    assert np.allclose(res.values, ref.values)
+    # chip of another platform
+    other = pd.Series(["g1", "g2"], index=["q1", "q2"])
+    res = collapse_dataset(df, other)
+    assert res.shape == (0, 4) and res.columns.tolist() == df.columns.tolist()
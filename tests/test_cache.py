@@ -0,0 +1,83 @@
+import os, time
+from tempfile import TemporaryDirectory
+from gseapy.cache import GeneSetCache, LibraryMemo, LIBRARY_MEMO
+
+
+def test_put_get():
+    with TemporaryDirectory(dir="tests") as root:
+        cache = GeneSetCache(root)
+        assert cache.get("enrichr.A.gmt") is None
+        path = cache.put("enrichr.A.gmt", ("T%d\t\tG1\tG2\n" % i for i in range(3)), version="A")
+        assert cache.get("enrichr.A.gmt") == path
+        assert cache.info("enrichr.A.gmt")['version'] == "A"
+        with open(path) as f:
+            assert len(f.readlines()) == 3
+        # no temp files left behind
+        assert sorted(os.listdir(root)) == ['.lock', 'enrichr.A.gmt', 'manifest.json']
+        # truncated file is dropped
+        with open(path, "w") as f:
+            f.write("T0\t\tG1")
+        assert cache.get("enrichr.A.gmt") is None
+        assert not os.path.exists(path)
+        # files not written by the cache are not trusted
+        with open(cache.path("enrichr.B.gmt"), "w") as f:
+            f.write("T0\t\tG1\n")
+        assert cache.get("enrichr.B.gmt") is None
+
+
+def test_evict():
+    with TemporaryDirectory(dir="tests") as root:
+        cache = GeneSetCache(root, max_size=250)
+        for name in "ABC":
+            cache.put(name, "x" * 100)
+            time.sleep(0.01)
+        # A is the least recently used
+        assert cache.get("A") is None and cache.get("B") and cache.get("C")
+        time.sleep(0.01)
+        cache.get("B")
+        cache.put("D", "x" * 100)
+        assert cache.get("C") is None and cache.get("B") and cache.get("D")
+        assert cache.size() == 200
+
+
+def test_get_read_only():
+    with TemporaryDirectory(dir="tests") as root:
+        cache = GeneSetCache(root)
+        path = cache.put("A", "x" * 100)
+        entry = cache.info("A")
+        # an item replaced after it was found broken is kept
+        cache.put("A", "y" * 100)
+        cache.remove("A", entry=entry)
+        assert cache.get("A") == path
+        # atime updates are skipped when the manifest can't be written
+        def read_only(manifest):
+            raise OSError(30, "Read-only file system")
+        cache._save_manifest = read_only
+        assert cache.get("A") == path
+
+
+def test_library_memo():
+    from gseapy.gsea import Prerank
+    memo = LibraryMemo(max_size=100)
+    memo.put("a", {"T": ["G1"]}, nbytes=60)
+    memo.put("b", {"T": ["G2"]}, nbytes=30)
+    assert memo.get("a") == {"T": ["G1"]}
+    # "b" is least recently used
+    memo.put("c", {"T": ["G3"]}, nbytes=30)
+    assert memo.get("b") is None and len(memo) == 2 and memo.size() == 90
+    memo.put("d", {}, nbytes=200)
+    assert memo.get("d") is None
+    # load_gmt skips parsing on the second run
+    LIBRARY_MEMO.clear()
+    rnk, gmt = "tests/data/edb/gsea_data.gsea_data.rnk", "tests/data/genes.gmt"
+    pre = Prerank(rnk, gmt, None, min_size=1)
+    genes = pre._load_ranking(rnk).index.values
+    gs = pre.load_gmt(genes, gmt)
+    # parsed and filtered library
+    assert len(LIBRARY_MEMO) == 2
+    pre.parse_gmt = None
+    assert pre.load_gmt(genes[::-1], gmt) == gs
+    # a different gene universe is filtered again, without parsing
+    pre.load_gmt(genes[:100], gmt)
+    assert len(LIBRARY_MEMO) == 3
+    LIBRARY_MEMO.clear()
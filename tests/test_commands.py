@@ -1,7 +1,12 @@
-import pytest
+import pytest, json, threading, time, os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 from tempfile import NamedTemporaryFile, TemporaryDirectory, mkdtemp
-from gseapy.gsea import gsea, prerank, ssgsea, replot
-from gseapy.enrichr import enrichr
+from gseapy.gsea import gsea, prerank, ssgsea, replot, ssgsea_plot
+from gseapy.enrichr import Enrichr, enrichr, enrichr_batch
+from gseapy.utils import set_cache_path
+from gseapy.parser import IDMapper
+from gseapy.cache import GeneSetCache
 
 @pytest.fixture
 def edbDIR():
@@ -45,6 +50,60 @@ def test_gsea(gseaGCT, gseaCLS, geneGMT):
     tmpdir.cleanup()
 
 
+def test_gsea_contrasts(gseaGCT, gseaCLS, geneGMT):
+    from gseapy.parser import gsea_cls_parser
+    pos, neg, cls = gsea_cls_parser(gseaCLS)
+    # split MUT into two phenotypes
+    cls3 = [c if c != pos or i % 2 else 'MUT2' for i, c in enumerate(cls)]
+    tmpdir= TemporaryDirectory(dir="tests")
+    gs = gsea(gseaGCT, geneGMT, cls3, tmpdir.name, permutation_num=20, permutation_type='phenotype',
+              min_size=5, no_plot=True, contrast='one-vs-rest')
+    assert list(gs.res2d_by_contrast) == ['MUT2_vs_rest', 'MUT_vs_rest', 'WT_vs_rest']
+    assert os.path.isfile(os.path.join(tmpdir.name, "gseapy.gsea.contrasts.report.csv"))
+    tmpdir.cleanup()
+    gs = gsea(gseaGCT, geneGMT, cls3, None, min_size=5, no_plot=True, contrast='all-pairs')
+    assert gs.res2d['Contrast'].unique().tolist() == ['MUT2_vs_MUT', 'MUT2_vs_WT', 'MUT_vs_WT']
+    # same as a two phenotypes run with gene_set permutation
+    pair = gsea(gseaGCT, geneGMT, gseaCLS, None, permutation_num=20, min_size=5, seed=1,
+                no_plot=True, contrast=[(pos, neg)]).res2d_by_contrast['%s_vs_%s'%(pos, neg)]
+    single = gsea(gseaGCT, geneGMT, gseaCLS, None, permutation_num=20, min_size=5, seed=1,
+                  no_plot=True).res2d
+    assert (abs(pair.sort_index()['nes'] - single.sort_index()['nes']) < 1e-10).all()
+
+
+def test_gsea_continuous(gseaGCT, geneGMT):
+    import numpy as np
+    import pandas as pd
+    from gseapy.parser import gsea_cls_parser
+    df = pd.read_csv(gseaGCT, sep="\t", comment='#')
+    dat = df.drop_duplicates(subset=df.columns[0]).set_index(df.columns[0]).select_dtypes(include=[np.number])
+    pheno = np.random.RandomState(0).randn(dat.shape[1]).round(4)
+    tmpdir= TemporaryDirectory(dir="tests")
+    cls = os.path.join(tmpdir.name, "age.cls")
+    with open(cls, "w") as f:
+        f.write("#numeric\n#age\n%s\n" % " ".join(map(str, pheno)))
+    assert gsea_cls_parser(cls) == ('age', None, pheno.tolist())
+    gs = gsea(gseaGCT, geneGMT, cls, tmpdir.name, permutation_num=20, permutation_type='phenotype',
+              min_size=5, graph_num=1)
+    assert gs.method == 'pearson'
+    tmpdir.cleanup()
+    # observed ranking is the pearson correlation of each gene
+    gs = gsea(gseaGCT, geneGMT, pheno.tolist(), None, permutation_num=20, method='pearson',
+              min_size=5, no_plot=True)
+    expected = dat.T.corrwith(pd.Series(pheno, index=dat.columns)).loc[gs.ranking.index]
+    assert np.allclose(gs.ranking.values, expected.values)
+    # two classes are coded as 1 and 0
+    labels = ['A'] * (dat.shape[1] // 2) + ['B'] * (dat.shape[1] - dat.shape[1] // 2)
+    gs = gsea(gseaGCT, geneGMT, labels, None, permutation_num=20, method='pearson',
+              min_size=5, no_plot=True)
+    binary = pd.Series([1.0 if l == 'A' else 0.0 for l in labels], index=dat.columns)
+    expected = dat.T.corrwith(binary).loc[gs.ranking.index]
+    assert np.allclose(gs.ranking.values, expected.values)
+    with pytest.raises(Exception, match="two classes"):
+        gsea(gseaGCT, geneGMT, ['A', 'B', 'C'] * (dat.shape[1] // 3), None, permutation_num=20,
+             method='pearson', min_size=5, no_plot=True)
+
+
 def test_prerank(prernk, geneGMT):
     # Only tests of the command runs successfully,
     # doesnt't check the image
@@ -54,6 +113,96 @@ def test_prerank(prernk, geneGMT):
     prerank(prernk, geneGMT, None, permutation_num=10)
 
 
+def test_prerank_rankings(prernk, geneGMT):
+    import pandas as pd
+    rnk = pd.read_csv(prernk, header=None, sep="\t", index_col=0)[1]
+    df = pd.DataFrame({'up': rnk, 'down': -rnk})
+    tmpdir= TemporaryDirectory(dir="tests")
+    pre = prerank(df, geneGMT, tmpdir.name, permutation_num=20, min_size=5, seed=1, no_plot=True)
+    assert list(pre.res2d_by_ranking) == ['up', 'down']
+    assert os.path.isfile(os.path.join(tmpdir.name, "up", "gseapy.prerank.gene_sets.report.csv"))
+    assert os.path.isfile(os.path.join(tmpdir.name, "gseapy.prerank.rankings.report.csv"))
+    tmpdir.cleanup()
+    assert pre.res2d.columns[:2].tolist() == ['Ranking', 'Term']
+    single = prerank(rnk, geneGMT, None, permutation_num=20, min_size=5, no_plot=True).res2d
+    up, down = pre.res2d_by_ranking['up'].sort_index(), pre.res2d_by_ranking['down'].sort_index()
+    single = single.sort_index()
+    assert (abs(up['es'] - single['es']) < 1e-10).all()
+    assert (abs(down['es'] + single['es']) < 1e-10).all()
+    assert (up['ledge_genes'] == single['ledge_genes']).all()
+    # nulls of all modes give the same nes and pval
+    single = prerank(rnk, geneGMT, None, permutation_num=20, min_size=5, seed=1, no_plot=True,
+                     null_mode='memory').res2d.sort_index()
+    for mode in ('stream', 'exact'):
+        res = prerank(rnk, geneGMT, None, permutation_num=20, min_size=5, seed=1, no_plot=True,
+                      null_mode=mode).res2d.sort_index()
+        assert (abs(res['nes'] - single['nes']) < 1e-10).all() and (res['pval'] == single['pval']).all()
+    # tied values are ordered as in a single run
+    rnk = rnk.round(1)
+    pre = prerank(pd.DataFrame({'up': rnk, 'down': -rnk}), geneGMT, None, permutation_num=20,
+                  min_size=5, seed=1, no_plot=True)
+    single = prerank(rnk, geneGMT, None, permutation_num=20, min_size=5, no_plot=True).res2d.sort_index()
+    up = pre.res2d_by_ranking['up'].sort_index()
+    assert (abs(up['es'] - single['es']) < 1e-10).all()
+    assert (up['ledge_genes'] == single['ledge_genes']).all()
+
+
+def test_id_map(prernk, genelist, geneGMT):
+    import pandas as pd
+    # rankings with ensembl ids, converted back to symbols with the bundled table
+    rnk = pd.read_csv(prernk, header=None, sep="\t")
+    ens = IDMapper(target='ensembl').map(rnk[0])
+    rnk = rnk[ens.notnull().values].reset_index(drop=True)
+    ens_rnk = pd.DataFrame({0: ens.dropna().values + ".1", 1: rnk[1]})
+    pre = prerank(rnk, geneGMT, None, permutation_num=10, seed=7, no_plot=True)
+    pre_ens = prerank(ens_rnk, geneGMT, None, permutation_num=10, seed=7, no_plot=True, id_map='symbol')
+    assert pre_ens.ranking.index.tolist() == pre.ranking.index.tolist()
+    assert (pre_ens.res2d['nes'] == pre.res2d['nes']).all()
+    # collapse rules
+    df = pd.DataFrame({0: ['ENSG00000141510', 'ENSG00000141510.2', '7157', 'ENSG00000012048'],
+                       1: [1.0, -3.0, 0.5, 2.0]})
+    rules = {'max': 1.0, 'min': -3.0, 'mean': -1.0, 'maxabs': -3.0, 'first': 1.0}
+    for rule, value in rules.items():
+        res = IDMapper(source='ensembl', collapse=rule).convert_ranking(df)
+        assert res.set_index(0)[1].to_dict() == {'TP53': value, 'BRCA1': 2.0}
+    # gene lists
+    enr = Enrichr(['7157', '672', '0'], geneGMT, outdir=None, id_map='symbol')
+    enr.parse_genelists()
+    assert enr._gls == ['TP53', 'BRCA1']
+
+
+def test_dataset_download(monkeypatch):
+    import pandas as pd
+    import gseapy.biomart
+    from gseapy.cache import GeneSetCache
+    from gseapy.parser import get_background_index
+    table = pd.DataFrame({'ensembl_gene_id': ['ENSDARG01', 'ENSDARG02'],
+                          'external_gene_name': ['tp53', 'brca1'],
+                          'entrezgene': [30590, 563536], 'go_id': ['GO:1', 'GO:2']})
+    calls = {'n': 0}
+
+    class Biomart(object):
+        # writes the background table to the cache, as a query without filters does
+        def query(self, dataset):
+            calls['n'] += 1
+            GeneSetCache().put("{}.background.genes.txt".format(dataset),
+                               table.to_csv(sep="\t", index=False), version=dataset)
+            return table.copy()
+
+    monkeypatch.setattr(gseapy.biomart, "Biomart", Biomart)
+    tmpdir = TemporaryDirectory(dir="tests")
+    set_cache_path(tmpdir.name)
+    try:
+        idx = get_background_index('drerio_gene_ensembl')
+        assert idx['symbol'].tolist() == ['brca1', 'tp53']
+        mapper = IDMapper(dataset='drerio_gene_ensembl', source='ensembl')
+        assert mapper.map(['ENSDARG02']).tolist() == ['brca1']
+        assert calls['n'] == 1
+    finally:
+        set_cache_path(None)
+        tmpdir.cleanup()
+
+
 def test_ssgsea1(ssGCT, geneGMT):
     # Only tests of the command runs successfully,
     # doesnt't check the image
@@ -68,6 +217,40 @@ def test_ssgsea2(ssGCT, geneGMT):
     ssgsea(ssGCT, geneGMT, tmpdir.name, permutation_num=0)
     tmpdir.cleanup()
     ssgsea(ssGCT, geneGMT, None, permutation_num=0)
+    # no per-sample subdirs without figures, or with one report
+    for kwargs in ({'no_plot': True}, {'report': 'pdf', 'graph_num': 1}):
+        tmpdir= TemporaryDirectory(dir="tests")
+        ss = ssgsea(ssGCT, geneGMT, tmpdir.name, permutation_num=0, **kwargs)
+        assert ss.outdir == tmpdir.name
+        assert not any(os.path.isdir(os.path.join(tmpdir.name, f)) for f in os.listdir(tmpdir.name))
+        tmpdir.cleanup()
+
+def test_ssgsea_permu(ssGCT, ssGMT):
+    # rank normalized data has many ties, permutations don't change es
+    es = ssgsea(ssGCT, ssGMT, None, permutation_num=0, seed=1).resultsOnSamples
+    es_permu = ssgsea(ssGCT, ssGMT, None, permutation_num=20, seed=1).resultsOnSamples
+    for name in es:
+        assert (abs(es[name] - es_permu[name][es[name].index]) < 1e-10).all()
+    # top terms by |es| are plotted, same as without permutations
+    tmpdir = TemporaryDirectory(dir="tests")
+    ss = ssgsea(ssGCT, ssGMT, tmpdir.name, permutation_num=20, seed=1, no_plot=False, graph_num=2, format='png')
+    for name in es:
+        top = es[name].abs().sort_values(ascending=False, kind='mergesort').index[:2]
+        assert sorted(os.listdir(os.path.join(tmpdir.name, name))) == sorted("%s.ssgsea.png" % t for t in top)
+    tmpdir.cleanup()
+    # unscaled ssGSEA scores don't fit binned FDR null
+    with pytest.raises(ValueError):
+        ssgsea(ssGCT, ssGMT, None, permutation_num=20, scale=False, null_mode='stream')
+
+def test_ssgsea_plot(ssGCT, ssGMT):
+    # plot top terms of each sample, then render one more figure from saved results
+    tmpdir= TemporaryDirectory(dir="tests")
+    ss = ssgsea(ssGCT, ssGMT, tmpdir.name, permutation_num=0, no_plot=False, graph_num=2)
+    sample = ss.res2d.columns[0]
+    term = ss.res2d.index[0]
+    es = ssgsea_plot(tmpdir.name + "/gseapy.ssgsea.plotdata.npz", sample, term)
+    assert abs(es - ss.resultsOnSamples[sample][term]) < 1e-6
+    tmpdir.cleanup()
 
 def test_enrichr(genelist, geneGMT):
     # Only tests of the command runs successfully,
@@ -77,9 +260,179 @@ def test_enrichr(genelist, geneGMT):
     tmpdir.cleanup()
     #enrichr(genelist, gene_sets='KEGG_2013,KEGG_2016', outdir=None)
 
+def test_enrichr_batch(genelist, geneGMT):
+    with open(genelist) as f:
+        genes = [g.strip() for g in f if g.strip()]
+    lists = {'all': genes, 'top': genes[:100], 'none': ['NOT_A_GENE']}
+    enr = enrichr_batch(lists, gene_sets=geneGMT, background=20000, outdir=None)
+    res = enr.results
+    assert res.columns[:3].tolist() == ['Gene_list', 'Gene_set', 'Term']
+    assert 'none' not in res['Gene_list'].values
+    single = enrichr(genes[:100], gene_sets=geneGMT, background=20000, outdir=None, no_plot=True).results
+    top = res[res['Gene_list'] == 'top']
+    assert top['Term'].tolist() == single['Term'].tolist()
+    assert (abs(top['Adjusted P-value'].values - single['Adjusted P-value'].values) < 1e-12).all()
+
+@pytest.fixture
+def enrichrStub():
+    """local stand-in of the Enrichr server"""
+    calls = {'addList': 0, 'export': 0, 'active': 0, 'max_active': 0, 'library': 0}
+    with open("tests/data/gene_list.txt") as f:
+        genes = [g.strip() for g in f if g.strip()]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+        def reply(self, text):
+            body = text.encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            calls['addList'] += 1
+            self.reply(json.dumps({'userListId': 1, 'shortId': 'abc'}))
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.endswith('datasetStatistics'):
+                return self.reply(json.dumps({'statistics': [{'libraryName': 'LIB%d' % i} for i in range(4)]}))
+            if url.path.endswith('geneSetLibrary'):
+                calls['library'] += 1
+                lib = parse_qs(url.query)['libraryName'][0]
+                return self.reply("".join("%s_term%d\t\t%s\n" % (lib, i, "\t".join(g + ",1.0" for g in genes[i::3]))
+                                          for i in range(3)))
+            lib = parse_qs(url.query)['backgroundType'][0]
+            with lock:
+                calls['export'] += 1
+                calls['active'] += 1
+                calls['max_active'] = max(calls['max_active'], calls['active'])
+                # first export is not ready yet
+                ready = calls['export'] > 1
+            time.sleep(0.2)
+            with lock: calls['active'] -= 1
+            self.reply("Term\tOverlap\tP-value\n%s_term\t1/10\t0.01\n" % lib if ready else "")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%s" % server.server_port, calls
+    server.shutdown()
+
+def test_enrichr_client(genelist, enrichrStub):
+    url, calls = enrichrStub
+    tmpdir = TemporaryDirectory(dir="tests")
+    set_cache_path(tmpdir.name)
+    enr = Enrichr(genelist, gene_sets='LIB0,LIB1,LIB2,LIB3', outdir=None, no_plot=True, processes=2)
+    enr.url = url
+    try:
+        enr.run()
+    finally:
+        set_cache_path(None)
+        tmpdir.cleanup()
+    assert calls['addList'] == 1 and calls['export'] == 5
+    assert calls['max_active'] == 2
+    assert enr.results['Gene_set'].tolist() == ['LIB0', 'LIB1', 'LIB2', 'LIB3']
+
+def test_enrichr_offline(genelist, enrichrStub):
+    url, calls = enrichrStub
+    tmpdir = TemporaryDirectory(dir="tests")
+    set_cache_path(tmpdir.name)
+    try:
+        for i in range(2):
+            enr = Enrichr(genelist, gene_sets='LIB0,LIB1', outdir=None, no_plot=True,
+                          background=20000, offline=True)
+            enr.url = url
+            enr.run()
+        # libraries are downloaded once, gene list is never sent
+        assert calls['library'] == 2 and calls['addList'] == 0 and calls['export'] == 0
+        res = enr.results
+        assert res.columns.tolist() == ['Gene_set', 'Term', 'Overlap', 'P-value', 'Adjusted P-value',
+                                        'Old P-value', 'Old Adjusted P-value', 'Odds Ratio',
+                                        'Combined Score', 'Genes']
+        assert res['Gene_set'].tolist() == ['LIB0'] * 3 + ['LIB1'] * 3
+        assert (res['Combined Score'] > 0).all()
+        # cached libraries of other organisms are found without the catalogue
+        enr = Enrichr(genelist, gene_sets='LIB2', organism='fly', outdir=None, no_plot=True,
+                      background=20000, offline=True)
+        enr.url = url
+        enr.run()
+        GeneSetCache().remove("enrichr.FlyEnrichr.libraries.json")
+        enr = Enrichr(genelist, gene_sets='LIB2', organism='fly', outdir=None, no_plot=True,
+                      background=20000, offline=True)
+        enr.url = "http://127.0.0.1:9"
+        enr.run()
+        assert calls['library'] == 3 and enr.results['Gene_set'].tolist() == ['LIB2'] * 3
+    finally:
+        set_cache_path(None)
+        tmpdir.cleanup()
+
+def test_biomart_query():
+    import xml.etree.ElementTree as ET
+    from gseapy.parser import biomart_query
+    calls = {'n': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            query = ET.fromstring(form['query'][0].split("<!DOCTYPE Query>")[1])
+            ids = query.find("Dataset/Filter").get("value").split(",")
+            calls['n'] += 1
+            body = "".join("%s\tSYM%s\t%s\n" % (i, i[3:], int(i[3:]) + 1000) for i in ids)
+            # rows shared by all chunks, and an interrupted response
+            body += "ENSX\tX\t\n" + ("" if calls['n'] == 2 else "[success]\n")
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        ids = ["ENS%d" % i for i in range(1050)]
+        df = biomart_query("http://127.0.0.1:%s/biomart/martservice" % server.server_port,
+                           attributes=['ensembl_gene_id', 'external_gene_name', 'entrezgene'],
+                           filters={'ensembl_gene_id': ids}, chunksize=500, processes=2)
+    finally:
+        server.shutdown()
+    # 3 chunks, one retried
+    assert calls['n'] == 4
+    assert df.shape == (1051, 3) and df['ensembl_gene_id'].is_unique
+    assert df['entrezgene'].isna().sum() == 1 and df['entrezgene'].max() == 2049
+    assert set(df['ensembl_gene_id']) == set(ids + ['ENSX'])
+
+def test_library_catalog():
+    from gseapy.parser import enrichr_library_catalog
+    calls = []
+    def fetch():
+        calls.append(1)
+        return ['B', 'A']
+    def offline():
+        raise Exception("offline")
+    tmpdir = TemporaryDirectory(dir="tests")
+    set_cache_path(tmpdir.name)
+    try:
+        assert enrichr_library_catalog('TestEnrichr', url='stub', fetch=fetch) == ['A', 'B']
+        assert enrichr_library_catalog('TestEnrichr', url='stub', fetch=fetch) == ['A', 'B']
+        assert len(calls) == 1
+        # expired, then server not reachable
+        assert enrichr_library_catalog('TestEnrichr', ttl=0, url='stub', fetch=offline) == ['A', 'B']
+        enrichr_library_catalog('TestEnrichr', ttl=0, url='stub', fetch=fetch)
+        assert len(calls) == 2
+    finally:
+        set_cache_path(None)
+        tmpdir.cleanup()
+
 def test_replot(edbDIR):
     # Only tests of the command runs successfully,
     # doesnt't check the image
     tmpdir= TemporaryDirectory(dir="tests")
     replot(edbDIR, tmpdir.name)
     tmpdir.cleanup()
+
+def test_report(prernk, geneGMT, edbDIR):
+    # Only tests of the command runs successfully,
+    # doesnt't check the report
+    tmpdir= TemporaryDirectory(dir="tests")
+    prerank(prernk, geneGMT, tmpdir.name, permutation_num=10, report='pdf')
+    replot(edbDIR, tmpdir.name, report='html')
+    tmpdir.cleanup()
@@ -0,0 +1,28 @@
+import sys, subprocess
+
+
+def _import(stmt):
+    """import in a fresh interpreter, return the import time of gseapy in seconds and loaded modules"""
+    code = "import sys; %s; print(' '.join(sys.modules))" % stmt
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                         capture_output=True, text=True, check=True)
+    times = [l.split("|") for l in out.stderr.splitlines() if l.startswith("import time:")]
+    total = sum(int(t[1]) for t in times if t[2].strip() == "gseapy")
+    return total / 1e6, set(out.stdout.split())
+
+
+def test_lazy_imports():
+    seconds, modules = _import("import gseapy")
+    assert seconds < 1.0
+    assert not {'gseapy.gsea', 'gseapy.plot', 'pandas', 'matplotlib'} & modules
+    # pure numeric prerank doesn't need plotting or network modules
+    seconds, modules = _import("from gseapy import prerank")
+    assert not {'matplotlib', 'mpl_toolkits.axes_grid1', 'bioservices', 'requests',
+                'pkg_resources', 'scipy.stats'} & modules
+    seconds, modules = _import("import gseapy.enrichr")
+    assert 'requests' not in modules
+    seconds, modules = _import("import gseapy; gseapy.dotplot")
+    assert 'matplotlib' in modules
+    # submodules share names with functions, the functions are kept
+    _import("import gseapy.gsea, gseapy.enrichr, gseapy; "
+            "assert callable(gseapy.gsea) and callable(gseapy.enrichr)")
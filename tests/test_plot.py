@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pandas as pd
+from tempfile import TemporaryDirectory
+from gseapy.algorithm import running_enrichment_score
+from gseapy.plot import minmax_decimate, gseaplot, GSEAPlot
+
+
+def test_minmax_decimate():
+    rs = np.random.RandomState(0)
+    y = np.cumsum(rs.randn(10007))
+    ind = minmax_decimate(y, 100)
+    assert len(ind) < len(y) / 20
+    assert (np.diff(ind) > 0).all()
+    assert ind[0] == 0 and ind[-1] == len(y) - 1
+    assert y[ind].max() == y.max() and y[ind].min() == y.min()
+    # short curves are kept as they are
+    assert np.array_equal(minmax_decimate(y[:300], 100), np.arange(300))
+
+
+def test_gseaplot_lod():
+    rs = np.random.RandomState(0)
+    N = 20000
+    rnk = pd.Series(np.sort(rs.randn(N))[::-1], index=["g%s" % i for i in range(N)])
+    hits = np.sort(rs.choice(N, 200, replace=False))
+    RES = running_enrichment_score(rnk.values, hits)
+    g = GSEAPlot(rnk, "term", hits, 1.5, 0.01, 0.05, RES)
+    assert g._lod and g._im_matrix.shape[1] <= g._npix and len(g._rug) <= len(hits)
+    tmpdir = TemporaryDirectory(dir="tests")
+    ofname = os.path.join(tmpdir.name, "term.png")
+    gseaplot(rnk, "term", hits, 1.5, 0.01, 0.05, RES, ofname=ofname)
+    assert os.path.getsize(ofname) > 0
+    tmpdir.cleanup()
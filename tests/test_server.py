@@ -0,0 +1,72 @@
+import os, json, socket, threading
+import http.client
+import pandas as pd
+from tempfile import TemporaryDirectory
+from gseapy.gsea import prerank
+from gseapy.server import AnalysisServer, UnixAnalysisServer
+
+
+def _post(conn, path, job):
+    conn.request("POST", path, body=json.dumps(job), headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    return resp.status, [json.loads(l) for l in resp.read().decode('utf-8').splitlines()]
+
+
+def test_serve():
+    rnk = pd.read_csv("tests/data/temp.rnk", header=None, sep="\t", index_col=0)[1]
+    rnk = rnk[~rnk.index.duplicated()]
+    job = {'rnk': rnk.to_dict(), 'gene_sets': "temp.gmt",
+           'permutation_num': 10, 'seed': 7}
+    server = AnalysisServer(("127.0.0.1", 0), data_dir="tests/data")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+        status, events = _post(conn, "/prerank", job)
+        assert status == 200
+        assert events[0] == {'event': 'start', 'job': 'prerank'}
+        assert events[-1]['event'] == 'done'
+        res = pd.DataFrame([e['data'] for e in events if e['event'] == 'result']).set_index('Term')
+        pre = prerank(rnk, "tests/data/temp.gmt", None, permutation_num=10, seed=7, no_plot=True)
+        assert events[-1]['rows'] == len(pre.res2d)
+        assert (res.loc[pre.res2d.index, 'es'].values.round(6) == pre.res2d['es'].values.round(6)).all()
+        # failed jobs report an error, the server keeps running
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+        status, events = _post(conn, "/prerank", dict(job, min_size=1000))
+        assert events[-1]['event'] == 'error'
+        # files are only read from the data directory, and never written
+        for bad in ({'gene_sets': "tests/data/temp.gmt"}, {'gene_sets': "../test_server.py"},
+                    {'rnk': os.path.abspath("tests/test_server.py")}, {'outdir': "tests"}):
+            conn = http.client.HTTPConnection(*server.server_address[:2])
+            status, events = _post(conn, "/prerank", dict(job, **bad))
+            assert events[-1]['event'] == 'error' and "not allowed" in events[-1]['message']
+        # jobs over the size limit are rejected before they are read
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+        conn.putrequest("POST", "/prerank")
+        conn.putheader("Content-Length", str(server.max_body + 1))
+        conn.endheaders()
+        resp = conn.getresponse()
+        assert resp.status == 413 and "exceeds" in json.loads(resp.read())['error']
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+        conn.request("GET", "/status")
+        status = json.loads(conn.getresponse().read())
+        assert status['jobs'] == 1 and status['memo_items'] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_unix_socket():
+    with TemporaryDirectory(dir="tests") as tmp:
+        path = os.path.join(tmp, "gseapy.sock")
+        server = UnixAnalysisServer(path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            conn = http.client.HTTPConnection("localhost")
+            conn.sock = socket.socket(socket.AF_UNIX)
+            conn.sock.connect(path)
+            conn.request("GET", "/status")
+            assert json.loads(conn.getresponse().read())['jobs'] == 0
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert not os.path.exists(path)
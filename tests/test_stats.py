@@ -0,0 +1,28 @@
+import numpy as np
+from scipy.stats import hypergeom
+from gseapy.stats import calc_pvalues, encode_gene_sets
+
+
+def test_calc_pvalues():
+    rs = np.random.RandomState(0)
+    genes = np.array(["G%d" % i for i in range(2000)], dtype=object)
+    gmt = {"T%d" % i: list(genes[rs.choice(2000, rs.randint(5, 100), replace=False)])
+           for i in range(300)}
+    query = list(genes[rs.choice(2000, 100, replace=False)]) + ["NOT_A_GENE"]
+    terms, pvals, x, m, hits = calc_pvalues(query, gmt, background=20000,
+                                            encoded=encode_gene_sets(gmt))
+    for t, p, x_, m_, h in zip(terms, pvals, x, m, hits):
+        hits_ = set(query).intersection(gmt[t])
+        assert h == hits_ and x_ == len(hits_) and m_ == len(gmt[t])
+        assert np.isclose(p, hypergeom.sf(x_ - 1, 20000, m_, len(query)))
+    assert len(terms) == sum(len(set(query).intersection(g)) > 0 for g in gmt.values())
+
+
+def test_restrict_query():
+    from gseapy.stats import restrict_query
+    bg = ["TP53", "MDM2", "CDKN1A", "BAX"]
+    query = {"TP53", "BAX", "NOT_A_GENE", "BA"}
+    assert restrict_query(query, set(bg)) == restrict_query(query, np.unique(bg))
+    assert restrict_query({1, 5, 9}, np.array([1, 2, 9])) == ({1, 9}, 3)
+    # id types don't match
+    assert restrict_query({1, 5}, np.unique(bg)) == (set(), 4)